@@ -0,0 +1,159 @@
+"""
+Ingress control for /webhook. Every file message starts a pipeline (download, Gemini,
+Drive upload), and one number sending fifty files used to start fifty at once, ahead
+of everyone else.
+
+1. Per-sender token buckets (kept in the state store, so all workers share them):
+   SENDER_FILES_PER_MINUTE files with bursts of SENDER_FILE_BURST, and a more generous
+   bucket for text messages (each can be a Gemini call). Over the limit, the message
+   is dropped and the sender gets one friendly notice per NOTICE_COOLDOWN.
+2. Admission on queue depth: past PIPELINE_MAX_QUEUED waiting pipelines in this process
+   new files are turned away with a "busy" notice; past PIPELINE_NOTICE_AHEAD the file is
+   accepted and the sender told it's queued.
+3. Fair scheduling: PIPELINE_SLOTS pipelines run at once, at most PIPELINE_PER_SENDER of
+   them for one sender, and waiting senders are served round-robin. A flood from one
+   number queues behind its own files; other users' files start at the next free slot.
+
+Metrics: docs_manager_ingress_total{kind, result}, the pipeline_queue_depth gauge and
+the "pipeline" queue_wait histogram.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from state_store import get_state_store
+from tracing import observe, count, gauge, submit
+
+SENDER_FILES_PER_MINUTE = float(os.getenv("SENDER_FILES_PER_MINUTE", "10"))
+SENDER_FILE_BURST = float(os.getenv("SENDER_FILE_BURST", "10"))
+SENDER_TEXTS_PER_MINUTE = float(os.getenv("SENDER_TEXTS_PER_MINUTE", "20"))
+SENDER_TEXT_BURST = float(os.getenv("SENDER_TEXT_BURST", "10"))
+NOTICE_COOLDOWN = 60
+
+PIPELINE_SLOTS = int(os.getenv("PIPELINE_SLOTS", "6"))
+PIPELINE_PER_SENDER = int(os.getenv("PIPELINE_PER_SENDER", "2"))
+PIPELINE_MAX_QUEUED = int(os.getenv("PIPELINE_MAX_QUEUED", "200"))
+PIPELINE_NOTICE_AHEAD = int(os.getenv("PIPELINE_NOTICE_AHEAD", "10"))
+
+LIMITS = {  # kind -> (tokens per second, burst)
+    "file": (SENDER_FILES_PER_MINUTE / 60, SENDER_FILE_BURST),
+    "text": (SENDER_TEXTS_PER_MINUTE / 60, SENDER_TEXT_BURST),
+}
+
+NOTICES = {
+    "throttled": "⏳ You're sending messages faster than I can keep up with. "
+                 "I'm working on what you've sent; please send the rest in a minute.",
+    "busy": "🚦 I'm very busy right now and couldn't take that file. Please send it again in a few minutes.",
+    "deferred": "📥 Got it! Lots of files are being sorted right now; I'll message you as each of yours is saved.",
+}
+
+
+def take_token(sender, kind):
+    """True if the sender's bucket for `kind` had a token (and takes it)."""
+    rate, burst = LIMITS[kind]
+    if rate <= 0:
+        return True
+    now = time.time()
+    taken = []
+
+    def refill_and_take(bucket):
+        tokens, updated = bucket
+        tokens = min(burst, tokens + (now - updated) * rate)
+        taken.append(tokens >= 1)
+        return [tokens - taken[-1], now]
+
+    # Refill and take in one step: two workers can't both spend the last token
+    get_state_store().update("ingress_buckets", f"{kind}:{sender}", refill_and_take,
+                             default=[burst, now], ttl=int(burst / rate) + 60)
+    return taken[-1]
+
+
+def notice_once(sender, reason):
+    """The notice text for `reason`, or None if the sender got it within NOTICE_COOLDOWN."""
+    if get_state_store().add("ingress_notices", f"{sender}:{reason}", ttl=NOTICE_COOLDOWN):
+        return NOTICES[reason]
+    return None
+
+
+class FairScheduler:
+    """Runs jobs on `slots` threads, round-robin across senders, at most `per_sender` each."""
+
+    def __init__(self, slots, per_sender):
+        self.slots, self.per_sender = slots, per_sender
+        self.pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="pipeline")
+        self.waiting = OrderedDict()  # sender -> deque of (fn, args, kwargs, queued_at); the order is the rotation
+        self.running = {}  # sender -> jobs running
+        self.queued = 0
+        self.lock = threading.Lock()
+
+    def depth(self):
+        return self.queued
+
+    def submit(self, sender, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs). Returns how many jobs were waiting ahead of it."""
+        with self.lock:
+            ahead = self.queued
+            self.waiting.setdefault(sender, deque()).append((fn, args, kwargs, time.perf_counter()))
+            self.queued += 1
+            self._dispatch()
+            gauge("pipeline_queue_depth", self.queued)
+        return ahead
+
+    def _dispatch(self):
+        """Starts waiting jobs while slots are free. Holds the lock."""
+        while sum(self.running.values()) < self.slots:
+            sender = next((s for s in self.waiting if self.running.get(s, 0) < self.per_sender), None)
+            if sender is None:
+                return
+            jobs = self.waiting.pop(sender)
+            fn, args, kwargs, queued_at = jobs.popleft()
+            if jobs:
+                self.waiting[sender] = jobs  # Back of the rotation
+            self.queued -= 1
+            self.running[sender] = self.running.get(sender, 0) + 1
+            observe("pipeline", "queue_wait", time.perf_counter() - queued_at)
+            submit(self.pool, self._run, sender, fn, args, kwargs)
+
+    def _run(self, sender, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running[sender] -= 1
+                if not self.running[sender]:
+                    del self.running[sender]
+                self._dispatch()
+                gauge("pipeline_queue_depth", self.queued)
+
+
+PIPELINES = FairScheduler(PIPELINE_SLOTS, PIPELINE_PER_SENDER)
+
+
+def admit_file(sender, fn, *args, **kwargs):
+    """
+    Schedules fn (a file pipeline) if the sender's bucket and the queue allow it.
+    Returns (accepted, notice for the sender or None).
+    """
+    if not take_token(sender, "file"):
+        count("ingress", kind="file", result="throttled")
+        return False, notice_once(sender, "throttled")
+    if PIPELINES.depth() >= PIPELINE_MAX_QUEUED:
+        count("ingress", kind="file", result="busy")
+        return False, notice_once(sender, "busy")
+
+    ahead = PIPELINES.submit(sender, fn, *args, **kwargs)
+    if ahead >= PIPELINE_NOTICE_AHEAD:
+        count("ingress", kind="file", result="deferred")
+        return True, notice_once(sender, "deferred")
+    count("ingress", kind="file", result="admitted")
+    return True, None
+
+
+def admit_text(sender):
+    """(accepted, notice for the sender or None) for a text message."""
+    if take_token(sender, "text"):
+        count("ingress", kind="text", result="admitted")
+        return True, None
+    count("ingress", kind="text", result="throttled")
+    return False, notice_once(sender, "throttled")
@@ -0,0 +1,436 @@
+"""
+Local stand-ins for the three external services the backend talks to:
+the WhatsApp Graph API, Google Drive v3 and Gemini (REST + File API).
+
+They speak just enough of each protocol for the real client libraries to work,
+keep everything in memory, and can add a fixed latency to every request so the
+benchmark can model slow upstreams. Used by benchmark.py only.
+"""
+import re
+import json
+import time
+import hashlib
+import itertools
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Shared plumbing: latency injection, JSON replies, request counting."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    requests_seen = 0
+    ids = itertools.count(1)
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _begin(self):
+        with self.lock:
+            type(self).requests_seen += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _reply(self, status, body=None, headers=None, raw=None, content_type="application/json"):
+        payload = raw if raw is not None else (json.dumps(body).encode() if body is not None else b"")
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @classmethod
+    def next_id(cls, prefix):
+        return f"{prefix}-{next(cls.ids)}"
+
+
+class ResumableUploadMixin:
+    """
+    The resumable upload protocol shared by Drive and the Gemini File API.
+    Every `fail_every`-th chunk PUT answers 503 so the resume path gets exercised.
+    """
+    sessions = {}
+    chunk_puts = 0
+    fail_every = 0
+
+    def start_resumable(self, path_prefix):
+        upload_id = self.next_id("upload")
+        self.sessions[upload_id] = 0
+        location = f"http://{self.headers['Host']}{path_prefix}?uploadType=resumable&upload_id={upload_id}"
+        self._reply(200, headers={"Location": location})
+
+    def continue_resumable(self, finished_body):
+        body = self._read_body()
+        upload_id = parse_qs(urlparse(self.path).query)["upload_id"][0]
+        content_range = self.headers.get("Content-Range", "")
+        received = self.sessions[upload_id]
+
+        # Status query after an error: "bytes */<total>"
+        if content_range.startswith("bytes */"):
+            return self._reply(308, headers={"Range": f"bytes=0-{received - 1}"} if received else {})
+
+        with self.lock:
+            ResumableUploadMixin.chunk_puts += 1
+            should_fail = self.fail_every and ResumableUploadMixin.chunk_puts % self.fail_every == 0
+        if should_fail:
+            return self._reply(503, {"error": {"code": 503, "message": "Injected failure"}})
+
+        start, end, total = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range).groups()
+        assert int(start) == received and len(body) == int(end) - int(start) + 1
+        self.sessions[upload_id] = int(end) + 1
+
+        if total != "*" and int(end) + 1 == int(total):
+            del self.sessions[upload_id]
+            return self._reply(200, finished_body())
+        return self._reply(308, headers={"Range": f"bytes=0-{end}"})
+
+
+# ==========================================
+# 📱 WHATSAPP GRAPH API
+# ==========================================
+class GraphStubHandler(StubHandler):
+    """POST /v17.0/<phone_id>/messages, GET /v17.0/<media_id>, GET /media/<media_id>."""
+    media_bytes = b"%PDF-1.4\n" + b"0" * 64 * 1024  # Followed by the media ID: one file per ID
+    sent = []
+    max_per_second = 0  # Messages accepted per rolling second; more answer Meta's throughput error
+    throttled = 0
+    recent = []
+
+    def do_POST(self):
+        self._begin()
+        body = json.loads(self._read_body() or b"{}")
+        with self.lock:
+            now = time.monotonic()
+            if self.max_per_second:
+                GraphStubHandler.recent = [t for t in self.recent if t > now - 1] + [now]
+            if self.max_per_second and len(self.recent) > self.max_per_second:
+                GraphStubHandler.throttled += 1
+                self.recent.pop()
+                limited = True
+            else:
+                self.sent.append(body)
+                limited = False
+        if limited:
+            return self._reply(429, {"error": {"code": 130429, "message": "Rate limit hit"}})
+        self._reply(200, {"messages": [{"id": self.next_id("wamid")}]})
+
+    def do_GET(self):
+        self._begin()
+        media_id = self.path.rstrip("/").split("/")[-1]
+        if self.path.startswith("/media/"):
+            return self._reply(200, raw=self.media_bytes + media_id.encode(), content_type="application/pdf")
+        self._reply(200, {"id": media_id, "url": f"http://{self.headers['Host']}/media/{media_id}"})
+
+
+# ==========================================
+# 📂 GOOGLE DRIVE V3
+# ==========================================
+class DriveStubHandler(ResumableUploadMixin, StubHandler):
+    """
+    files.list / get / create / update / delete plus multipart and resumable uploads.
+    Every folder lists `list_folders` sub-folders and `list_files` files; a query over
+    several parents gets each one's sub-folders and spreads the files across them.
+    """
+    list_folders = 5
+    list_files = 20
+    folder_depth = 0  # Folders this deep below "root" have no sub-folders (0 = endless tree)
+    unique_files = False  # File IDs per parent ("<parent>-f<i>") instead of shared "file-<i>"
+    file_size = 250_000
+    file_names = ["Physics_Unit 1_Notes_{i}.pdf"]  # Cycled through; {i} is the file's index
+    moved = {}  # file ID -> new parent, from batched files.update calls
+    rate_limit_every = 0  # Every Nth batched update answers 403 userRateLimitExceeded
+    updates = 0
+    gone = set()  # Folder IDs deleted in Drive: 404 from files.get / addParents, left out of listings
+    names = {}  # Folder ID -> the name files.get reports in a batch (a rename in Drive); unset: no name
+    max_in_flight = 0  # GETs beyond this many at once answer 403 userRateLimitExceeded (0 = no limit)
+    in_flight = 0
+    rate_limited = 0
+    RATE_LIMITED = {"error": {"code": 403, "message": "User Rate Limit Exceeded",
+                              "errors": [{"reason": "userRateLimitExceeded"}]}}
+    checksums = {}  # file ID -> md5 of the bytes a multipart upload sent (reported by files.get)
+    upload_bytes = 0
+    deleted = []  # File IDs removed with files.delete
+
+    def _listing(self, query=""):
+        parents = re.findall(r"'([^']+)' in parents", query) or ["root"]
+        branching = [p for p in parents if not self.folder_depth or p.count("-u") < self.folder_depth]
+        items = [{
+            "id": f"{parent}-u{i}", "name": f"Unit {i}", "mimeType": "application/vnd.google-apps.folder",
+            "webViewLink": f"https://drive.google.com/drive/folders/{parent}-u{i}",
+            "iconLink": "https://drive-thirdparty.googleusercontent.com/16/type/application/vnd.google-apps.folder",
+            "parents": [parent],
+        } for parent in branching for i in range(self.list_folders) if f"{parent}-u{i}" not in self.gone]
+        file_id = (lambda i: f"{parents[i % len(parents)]}-f{i}") if self.unique_files else (lambda i: f"file-{i}")
+        items += [{
+            "id": file_id(i), "name": self.file_names[i % len(self.file_names)].format(i=i),
+            "mimeType": "application/pdf",
+            "webViewLink": f"https://drive.google.com/file/d/{file_id(i)}/view?usp=drivesdk",
+            "iconLink": "https://drive-thirdparty.googleusercontent.com/16/type/application/pdf",
+            "parents": [parents[i % len(parents)]], "size": str(self.file_size),
+        } for i in range(self.list_files)]
+        return {"files": items}
+
+    def do_GET(self):
+        with self.lock:
+            DriveStubHandler.in_flight += 1
+            over = self.max_in_flight and self.in_flight > self.max_in_flight
+        try:
+            self._begin()
+            if over:
+                with self.lock:
+                    DriveStubHandler.rate_limited += 1
+                return self._reply(403, self.RATE_LIMITED)
+            path = urlparse(self.path).path
+            if path == "/drive/v3/files":
+                query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+                return self._reply(200, self._listing(query))
+            file_id = path.split("/")[-1]
+            item = {"id": file_id, "name": f"Folder {file_id}"}
+            if file_id in self.checksums:
+                item.update(md5Checksum=self.checksums[file_id], trashed=False,
+                            webViewLink=f"https://drive.google.com/file/d/{file_id}/view?usp=drivesdk")
+            self._reply(200, item)
+        finally:
+            with self.lock:
+                DriveStubHandler.in_flight -= 1
+
+    def _media(self, body):
+        """The file bytes of a multipart/related upload (the part after the JSON metadata)."""
+        boundary = self.headers["Content-Type"].split("boundary=")[-1].strip('"').encode()
+        media_part = body.split(b"--" + boundary)[2]
+        return media_part.split(b"\n\n", 1)[1][:-1]  # The client separates with bare newlines
+
+    def _folder(self, folder_id):
+        """(status line, reply) for a files.get on a folder, inside a batch."""
+        if folder_id in self.gone:
+            return "404 Not Found", {"error": {"code": 404, "message": f"File not found: {folder_id}."}}
+        item = {"id": folder_id, "mimeType": "application/vnd.google-apps.folder", "trashed": False}
+        if folder_id in self.names:
+            item["name"] = self.names[folder_id]
+        return "200 OK", item
+
+    def _batch(self, body):
+        """files.update and files.get calls bundled in one multipart/mixed request; answered in kind."""
+        boundary = self.headers["Content-Type"].split("boundary=")[-1].strip('"')
+        parts = []
+        for part in body.decode().split(f"--{boundary}")[1:-1]:
+            content_id = re.search(r"Content-ID: <([^>]+)>", part).group(1)
+            method, request_line = re.search(r"(PATCH|GET|POST) (\S+) HTTP", part).groups()
+            file_id = urlparse(request_line).path.split("/")[-1]
+            if method == "GET":
+                status, reply = self._folder(file_id)
+            else:
+                with self.lock:
+                    DriveStubHandler.updates += 1
+                    limited = self.rate_limit_every and DriveStubHandler.updates % self.rate_limit_every == 0
+                    if not limited:
+                        self.moved[file_id] = parse_qs(urlparse(request_line).query).get("addParents", [None])[0]
+                status, reply = ("403 Forbidden", self.RATE_LIMITED) if limited else ("200 OK", {"id": file_id})
+            parts.append(f"--reply\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                         f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n{json.dumps(reply)}\r\n")
+        self._reply(200, raw=("".join(parts) + "--reply--").encode(), content_type="multipart/mixed; boundary=reply")
+
+    def do_POST(self):
+        self._begin()
+        if "uploadType=resumable" in self.path:
+            self._read_body()
+            return self.start_resumable("/upload/drive/v3/files")
+        body = self._read_body()
+        if urlparse(self.path).path.startswith("/batch/"):
+            return self._batch(body)
+        file_id = self.next_id("drive")
+        if "uploadType=multipart" in self.path:
+            media = self._media(body)
+            with self.lock:
+                DriveStubHandler.checksums[file_id] = hashlib.md5(media).hexdigest()
+                DriveStubHandler.upload_bytes += len(media)
+        self._reply(200, {"id": file_id})
+
+    def do_PUT(self):
+        self._begin()
+        self.continue_resumable(lambda: {"id": self.next_id("drive")})
+
+    def do_PATCH(self):
+        self._begin()
+        self._read_body()
+        target = parse_qs(urlparse(self.path).query).get("addParents", [None])[0]
+        if target in self.gone:
+            return self._reply(404, {"error": {"code": 404, "message": f"File not found: {target}."}})
+        self._reply(200, {"id": urlparse(self.path).path.split("/")[-1]})
+
+    def do_DELETE(self):
+        self._begin()
+        with self.lock:
+            DriveStubHandler.deleted.append(urlparse(self.path).path.split("/")[-1])
+        self.send_response(204)
+        self.end_headers()
+
+
+# ==========================================
+# 🤖 GEMINI (generateContent + File API)
+# ==========================================
+class GeminiStubHandler(ResumableUploadMixin, StubHandler):
+    """
+    Answers each of our prompts with a fixed, valid JSON reply, chosen by the
+    prompt's wording. The File API discovery document is served locally too,
+    since google.generativeai fetches it before the first upload.
+    """
+    sort_reply = {"subject": "Physics", "unit": "Unit 1", "suggested_filename": "Physics_Unit 1_Bench.pdf"}
+    search_reply = {"is_search": True, "subject": "Physics", "keyword": ""}
+    syllabus_reply = {"subjects": [{"name": "Physics", "units": ["Unit 1", "Unit 2"]},
+                                   {"name": "DBMS", "units": ["Unit 1", "Unit 2", "Unit 3"]}]}
+
+    # Syllabus text with "Subject: X" / "Unit N: Y" lines is answered from those lines instead,
+    # taking `seconds_per_unit` longer per unit and cut off mid-JSON past `max_reply_units`
+    # (an output-token limit). Every `bad_json_every`-th reply (of any kind) is cut short.
+    # Streamed replies arrive in `stream_pieces` pieces spread over the generation time.
+    seconds_per_unit = 0.0
+    max_reply_units = 0
+    bad_json_every = 0
+    stream_pieces = 8
+    replies = 0
+
+    def _syllabus_text_reply(self, prompt):
+        """(reply text, generation seconds) for a syllabus prompt."""
+        subjects, current = {}, None
+        for line in prompt.split("\n"):
+            line = line.strip()
+            if line.startswith("Subject:"):
+                current = subjects.setdefault(line[len("Subject:"):].strip(), [])
+            elif current is not None and re.match(r"Unit \d+:", line):
+                current.append(line)
+        if not subjects:
+            return json.dumps(self.syllabus_reply), 0.0
+
+        units = sum(len(u) for u in subjects.values())
+        text = json.dumps({"subjects": [{"name": name, "units": u} for name, u in subjects.items()]})
+        if self.max_reply_units and units > self.max_reply_units:
+            text = text[:len(text) * self.max_reply_units // (units + 1)]
+        return text, self.seconds_per_unit * min(units, self.max_reply_units or units)
+
+    def _resort_reply(self, prompt):
+        """Every listed file name containing "Lecture" goes to Physics / Unit 1; the rest stay unknown."""
+        files = re.findall(r"^\s*(\d+)\. (.*)$", prompt, re.MULTILINE)
+        return json.dumps({"files": [
+            {"index": int(i), "subject": "Physics" if "Lecture" in name else "None", "unit": "Unit 1"}
+            for i, name in files]})
+
+    def _reply_text(self, prompt):
+        if "File Name Sorter" in prompt:
+            text, seconds = self._resort_reply(prompt), 0.0
+        elif "Document Sorter" in prompt:
+            text, seconds = json.dumps(self.sort_reply), 0.0
+        elif "Search Assistant" in prompt:
+            text, seconds = json.dumps(self.search_reply), 0.0
+        else:
+            text, seconds = self._syllabus_text_reply(prompt)
+        with self.lock:
+            GeminiStubHandler.replies += 1
+            malformed = self.bad_json_every and GeminiStubHandler.replies % self.bad_json_every == 0
+        if malformed:
+            text = text[:len(text) * 3 // 4]
+        return text, seconds
+
+    @staticmethod
+    def _candidate(text):
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+
+    def _stream(self, text, seconds):
+        """streamGenerateContent over REST: a JSON array of partial responses, written as generated."""
+        size = max(1, -(-len(text) // self.stream_pieces))
+        pieces = [json.dumps(self._candidate(text[i:i + size])).encode() for i in range(0, len(text), size)]
+        payload_size = 2 + sum(len(p) for p in pieces) + max(0, len(pieces) - 1)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(payload_size))
+        self.end_headers()
+        self.wfile.write(b"[")
+        for i, piece in enumerate(pieces):
+            time.sleep(seconds / len(pieces))
+            self.wfile.write((b"," if i else b"") + piece)
+            self.wfile.flush()
+        self.wfile.write(b"]")
+
+    def _discovery(self):
+        root = f"http://{self.headers['Host']}/"
+        return {
+            "kind": "discovery#restDescription", "discoveryVersion": "v1",
+            "id": "generativelanguage:v1beta", "name": "generativelanguage", "version": "v1beta",
+            "rootUrl": root, "servicePath": "", "baseUrl": root, "batchPath": "batch",
+            "parameters": {"key": {"type": "string", "location": "query"}},
+            "schemas": {
+                "CreateFileRequest": {"id": "CreateFileRequest", "type": "object",
+                                      "properties": {"file": {"type": "object"}}},
+                "CreateFileResponse": {"id": "CreateFileResponse", "type": "object",
+                                       "properties": {"file": {"type": "object"}}},
+            },
+            "resources": {"media": {"methods": {"upload": {
+                "id": "generativelanguage.media.upload", "path": "v1beta/files", "flatPath": "v1beta/files",
+                "httpMethod": "POST", "parameters": {}, "parameterOrder": [],
+                "request": {"$ref": "CreateFileRequest"}, "response": {"$ref": "CreateFileResponse"},
+                "supportsMediaUpload": True,
+                "mediaUpload": {"accept": ["*/*"], "protocols": {
+                    "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                    "resumable": {"multipart": True, "path": "/resumable/upload/v1beta/files"},
+                }},
+            }}}},
+        }
+
+    def _file(self, name):
+        return {"name": name, "mimeType": "application/pdf", "state": "ACTIVE",
+                "uri": f"http://{self.headers['Host']}/v1beta/{name}"}
+
+    def do_GET(self):
+        self._begin()
+        path = urlparse(self.path).path
+        if path.startswith("/$discovery/rest"):
+            return self._reply(200, self._discovery())
+        self._reply(200, self._file(path.split("/v1beta/")[-1]))
+
+    def do_POST(self):
+        self._begin()
+        if "uploadType=resumable" in self.path:
+            self._read_body()
+            return self.start_resumable(urlparse(self.path).path)
+        body = self._read_body()
+
+        method = urlparse(self.path).path.rsplit(":", 1)[-1]
+        if method not in ("generateContent", "streamGenerateContent"):
+            # Simple (non-resumable) media upload
+            return self._reply(200, {"file": self._file(self.next_id("files/bench"))})
+
+        request = json.loads(body or b"{}")
+        prompt = "\n".join(part.get("text", "") for content in request.get("contents", [])
+                           for part in content.get("parts", []))
+        text, seconds = self._reply_text(prompt)
+        if method == "streamGenerateContent":
+            return self._stream(text, seconds)
+        time.sleep(seconds)
+        reply = self._candidate(text)
+        reply["candidates"][0]["finishReason"] = 1
+        self._reply(200, reply)
+
+    def do_PUT(self):
+        self._begin()
+        self.continue_resumable(lambda: {"file": self._file(self.next_id("files/bench"))})
+
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 256  # Bursty benchmarks open hundreds of connections at once
+
+
+def start_stub(handler, latency=0.0):
+    """Starts `handler` on a free local port in a daemon thread. Returns (server, base_url)."""
+    handler.latency = latency
+    server = StubServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
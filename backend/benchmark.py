@@ -0,0 +1,1526 @@
+"""
+Local benchmarks. Nothing here needs live credentials: Meta, Drive and Gemini
+are replaced by the stand-ins in bench_stubs.py.
+
+    python benchmark.py upload    # upload_to_drive throughput vs chunk size
+    python benchmark.py tracing   # per-span overhead of tracing.py
+    python benchmark.py load      # replay webhook / browse / dashboard / create-folders traffic
+    python benchmark.py load --max-block-ms 300  # ...and fail if a handler blocks the event loop
+    python benchmark.py syllabus  # long-syllabus parse latency + completeness vs chunk size
+    python benchmark.py state     # shared state store: ops/s + cross-process dedup
+    python benchmark.py gemini-json  # ok / repaired / retried / failed per call
+    python benchmark.py startup --budget-ms 1000  # cold `import main`, fail if over budget
+    python benchmark.py payloads  # listing size (raw/gzip/brotli, full vs compact) + encode time
+    python benchmark.py resort    # bulk re-sort of Imported Documents: files/min, interrupted + resumed
+    python benchmark.py import    # onboarding import of an existing Drive: dry run, then paced apply
+    python benchmark.py fulltext --budget-ms 8  # text extraction + FTS5 indexing rate, query p95 per user
+    python benchmark.py semantic  # hashed TF-IDF ranking over 100k files: build, memory, latency, recall
+    python benchmark.py duplicates  # re-sent files: uploads skipped, bytes saved, reply latency
+    python benchmark.py outbox    # WhatsApp replies in a burst: direct vs queued (throttling, coalescing, latency)
+    python benchmark.py fairness  # one number floods /webhook with files: other users' latency before vs after
+"""
+import os
+import sys
+import json
+import time
+import base64
+import sqlite3
+import logging
+import argparse
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import requests
+
+from bench_stubs import start_stub, GraphStubHandler, DriveStubHandler, GeminiStubHandler
+from tracing import traced
+
+# Backend modules read their config at import time; they are imported inside the benchmarks
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is KB on Linux
+
+
+# ==========================================
+# 📦 UPLOAD THROUGHPUT
+# ==========================================
+def bench_upload(size_mb, chunk_sizes_mb, fail_every, repeat):
+    from googleapiclient.discovery import build
+    from google_auth import RootOverrideHttp
+    from test_sorting import upload_to_drive
+
+    server, base_url = start_stub(DriveStubHandler)
+    DriveStubHandler.fail_every = fail_every
+    service = build("drive", "v3", http=RootOverrideHttp(base_url), static_discovery=True)
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(b"%PDF-1.4\n" + os.urandom(size_mb * 1024 * 1024))
+        path = f.name
+
+    print(f"📦 Upload benchmark: {size_mb} MB file, fail_every={fail_every}, repeat={repeat}")
+    try:
+        for chunk_mb in chunk_sizes_mb:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                upload_to_drive(service, path, "bench.pdf", "folder", chunk_size=chunk_mb * 1024 * 1024)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"   chunk={chunk_mb:>3} MB  best={best * 1000:8.1f} ms  throughput={size_mb / best:8.1f} MB/s")
+    finally:
+        os.remove(path)
+        server.shutdown()
+
+
+# ==========================================
+# 🔬 TRACING OVERHEAD
+# ==========================================
+def bench_tracing(calls):
+    def plain():
+        return None
+
+    wrapped = traced("bench")(plain)
+
+    def run(fn, n):
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - started) / n * 1e6  # µs per call
+
+    run(wrapped, calls)  # warm up
+    overhead_us = run(wrapped, calls) - run(plain, calls)
+
+    # For scale: the cheapest thing we trace is a SQLite round trip like get_user()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        sqlite3.connect(db_path).close()
+
+        def sqlite_roundtrip():
+            conn = sqlite3.connect(db_path)
+            conn.execute("SELECT 1").fetchone()
+            conn.close()
+
+        reference_us = run(sqlite_roundtrip, min(calls, 20_000))
+
+    print(f"🔬 Tracing overhead over {calls} calls")
+    print(f"   overhead={overhead_us:.2f} µs/span  sqlite round trip={reference_us:.1f} µs")
+    print(f"   -> tracing adds {overhead_us / reference_us:.1%} to the cheapest traced call")
+
+
+# ==========================================
+# 🚦 LOAD TEST (whole app against local stubs)
+# ==========================================
+SESSION_SECRET = "super-secret-random-string"  # must match SessionMiddleware in main.py
+
+
+def session_cookie(phone):
+    """The signed cookie Starlette's SessionMiddleware would have set after login."""
+    from itsdangerous import TimestampSigner
+    data = base64.b64encode(json.dumps({"user_phone": phone}).encode("utf-8"))
+    return TimestampSigner(SESSION_SECRET).sign(data).decode("utf-8")
+
+
+def whatsapp_payload(sender, message):
+    return {"entry": [{"changes": [{"value": {"messages": [dict(message, **{"from": sender})]}}]}]}
+
+
+def point_gemini_at(gemini_url):
+    """The Gemini SDK is a process-wide singleton, so it is re-pointed here rather than via env."""
+    from gemini_json import load_genai
+    genai = load_genai()  # Loaded lazily: configure it first so it isn't reset to the defaults later
+    import google.generativeai.client as genai_client
+    genai_client.GENAI_API_DISCOVERY_URL = f"{gemini_url}/$discovery/rest"
+    genai.configure(api_key="bench", transport="rest", client_options={"api_endpoint": gemini_url})
+
+
+def boot_app(graph_url, drive_url, gemini_url):
+    """Imports the backend against the stubs (in a scratch dir) and serves it with uvicorn."""
+    os.chdir(tempfile.mkdtemp(prefix="docs-bench-"))  # fresh bot_memory.db + temp files
+    os.environ.update({
+        "WHATSAPP_TOKEN": "bench", "PHONE_NUMBER_ID": "bench-phone", "VERIFY_TOKEN": "bench",
+        "GRAPH_API_URL": f"{graph_url}/v17.0", "GOOGLE_API_ROOT": drive_url,
+    })
+
+    import uvicorn
+    import main
+
+    point_gemini_at(gemini_url)
+
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    server.thread = threading.Thread(target=server.run, daemon=True)
+    server.thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return main, server, f"http://127.0.0.1:{port}"
+
+
+def stop_app(server, stubs):
+    """
+    Stops the app first (its lifespan drains the outbox and background jobs while the stubs
+    still answer), then the stubs. Closing their sockets makes any straggler fail fast.
+    """
+    server.should_exit = True
+    server.thread.join(timeout=60)
+    for stub in stubs:
+        stub.shutdown()
+        stub.server_close()
+
+
+SLOW_CALLBACK_MS = 50  # listed as suspects when the loop-lag budget is blown
+
+
+class SlowCallbacks(logging.Handler):
+    """Collects asyncio's debug-mode "Executing <callback> took X seconds" warnings."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.seen = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if " took " in message:
+            self.seen.append(message)
+
+
+def watch_slow_callbacks(server, threshold_ms):
+    """
+    Turns on asyncio debug mode in the app's loop: any single callback (a route, a
+    middleware step) that holds the loop longer than threshold_ms gets reported.
+    """
+    handler = SlowCallbacks()
+    logging.getLogger("asyncio").addHandler(handler)
+    loop = server.servers[0].get_loop()
+
+    def enable():
+        loop.set_debug(True)
+        loop.slow_callback_duration = threshold_ms / 1000
+
+    loop.call_soon_threadsafe(enable)
+    return handler
+
+
+def seed_users(main, count):
+    folder_map = {
+        "Physics": {"id": "physics", "units": {"Unit 1": "physics-u1", "Unit 2": "physics-u2"}},
+        "Imported Documents": {"id": "imported", "units": {}},
+    }
+    phones = [f"9100000{i:04d}" for i in range(count)]
+    for phone in phones:
+        main.update_user(phone, "status", "ACTIVE")
+        main.update_user(phone, "google_token", {"access_token": "bench", "refresh_token": "bench"})
+        main.update_user(phone, "root_folder_id", f"root-{phone}")
+        main.update_user(phone, "folder_map", folder_map)
+        main.update_user(phone, "temp_syllabus_list", {"Bench": ["Unit 1", "Unit 2"]})
+    return phones
+
+
+def run_scenario(name, make_request, total, concurrency):
+    latencies, errors = [], 0
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        ok = make_request(local.session, i)
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, ok in pool.map(one, range(total)):
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name, "requests": total, "errors": errors,
+        "rps": total / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rss_mb": peak_rss_mb(),
+    }
+
+
+def count_saved():
+    return sum("Auto-Saved" in json.dumps(m) for m in GraphStubHandler.sent)
+
+
+def bench_load(args):
+    graph, graph_url = start_stub(GraphStubHandler, args.graph_latency)
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    gemini, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    rss_before = peak_rss_mb()
+
+    results = []
+    quiet = open(os.devnull, "w") if args.quiet else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        main, server, app_url = boot_app(graph_url, drive_url, gemini_url)
+        phones = seed_users(main, args.users)
+
+        def pick(i):
+            return phones[i % len(phones)]
+
+        def webhook_text(session, i):
+            message = {"type": "text", "text": {"body": "find physics notes"}}
+            r = session.post(f"{app_url}/webhook", json=whatsapp_payload(pick(i), message))
+            return r.status_code == 200 and r.text == "OK"
+
+        def webhook_file(session, i):
+            # One file per user, so each user's "Auto-Saved" count is one pipeline
+            message = {"type": "document", "document": {"id": f"media-{i}", "mime_type": "application/pdf"}}
+            r = session.post(f"{app_url}/webhook", json=whatsapp_payload(phones[i], message))
+            return r.status_code == 200
+
+        def browse(session, i):
+            r = session.get(f"{app_url}/api/drive/browse", cookies={"session": session_cookie(pick(i))})
+            return r.status_code == 200
+
+        def dashboard_waterfall(session, i):
+            # The old first paint: profile, then the root listing, counts computed client-side
+            cookies = {"session": session_cookie(pick(i))}
+            r = session.get(f"{app_url}/api/dashboard-data", cookies=cookies)
+            return r.status_code == 200 and session.get(f"{app_url}/api/drive/browse", cookies=cookies).status_code == 200
+
+        def dashboard(session, i):
+            # One aggregated call, revalidated with the ETag like a browser would
+            if not hasattr(session, "etags"):
+                session.etags = {}
+            headers = {"If-None-Match": session.etags[pick(i)]} if pick(i) in session.etags else {}
+            r = session.get(f"{app_url}/api/dashboard", cookies={"session": session_cookie(pick(i))}, headers=headers)
+            session.etags[pick(i)] = r.headers.get("ETag")
+            return r.status_code in (200, 304)
+
+        def create_folders(session, i):
+            r = session.post(f"{app_url}/create-folders", data={"selected_subjects": f"Bench {i}"},
+                             cookies={"session": session_cookie(pick(i))})
+            return r.status_code == 200
+
+        scenarios = {
+            "webhook-text": webhook_text,
+            "browse": browse,
+            "dashboard-waterfall": dashboard_waterfall,
+            "dashboard": dashboard,
+            "create-folders": create_folders,
+        }
+        # One warm-up call each first, so lazy imports and first connections aren't counted
+        with requests.Session() as session:
+            for name in args.scenarios:
+                if name in scenarios:
+                    scenarios[name](session, 0)
+        slow = watch_slow_callbacks(server, SLOW_CALLBACK_MS) if args.max_block_ms else None
+        main.event_loop_lag["max_ms"] = 0.0
+
+        for name in args.scenarios:
+            if name in scenarios:
+                results.append(run_scenario(name, scenarios[name], args.requests, args.concurrency))
+
+        if "webhook-file" in args.scenarios:
+            # The webhook answers immediately; the real work is the background pipeline
+            files = min(args.requests, len(phones))
+            done_before = count_saved()
+            started = time.perf_counter()
+            result = run_scenario("webhook-file", webhook_file, files, args.concurrency)
+            deadline = time.time() + args.timeout
+            done = 0
+            while time.time() < deadline:
+                done = count_saved() - done_before
+                if done >= files:
+                    break
+                time.sleep(0.05)
+            result["pipelines_done"] = done
+            result["pipelines_per_s"] = done / (time.perf_counter() - started)
+            results.append(result)
+
+        loop_lag_ms = main.event_loop_lag["max_ms"]
+        stop_app(server, (graph, drive, gemini))
+
+    print(f"🚦 Load test: users={args.users} concurrency={args.concurrency} "
+          f"latency graph={args.graph_latency}s drive={args.drive_latency}s gemini={args.gemini_latency}s")
+    for r in results:
+        line = (f"   {r['scenario']:<19} n={r['requests']:<5} err={r['errors']:<3} {r['rps']:8.1f} req/s  "
+                f"p50={r['p50_ms']:7.1f} ms  p95={r['p95_ms']:7.1f} ms  p99={r['p99_ms']:7.1f} ms")
+        if "pipelines_done" in r:
+            line += f"  pipelines={r['pipelines_done']} ({r['pipelines_per_s']:.1f}/s)"
+        print(line)
+    print(f"   peak RSS {peak_rss_mb():.1f} MB (stubs only: {rss_before:.1f} MB)")
+    print(f"   upstream calls: graph={GraphStubHandler.requests_seen} drive={DriveStubHandler.requests_seen} "
+          f"gemini={GeminiStubHandler.requests_seen}")
+    # The lag also includes waiting for the GIL behind busy pool threads (the load generator
+    # and stubs share this process), so the budget can't be tighter than that floor.
+    print(f"   worst event loop wake-up lag {loop_lag_ms:.0f} ms")
+    if not args.max_block_ms:
+        return True
+    if loop_lag_ms > args.max_block_ms:
+        print(f"❌ Event loop was blocked for {loop_lag_ms:.0f} ms (budget {args.max_block_ms:.0f} ms). "
+              f"Slowest callbacks on the loop:")
+        for message in sorted(slow.seen, key=lambda m: m.rsplit(" took ", 1)[-1], reverse=True)[:5]:
+            print(f"      {message}")
+        return False
+    print(f"   ✅ event loop never blocked for over {args.max_block_ms:.0f} ms")
+    return True
+
+
+# ==========================================
+# 📚 LONG SYLLABUS PARSING
+# ==========================================
+def write_text_pdf(path, pages):
+    """A minimal PDF with one Helvetica text page per list of lines (enough for pypdf)."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = "".join(f"({line.replace('(', '[').replace(')', ']')}) '\n" for line in lines)
+        stream = f"BT /F1 9 Tf 12 TL 40 800 Td\n{text}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_syllabus(page_count, units_per_subject=5):
+    """
+    Pages of a multi-semester syllabus: one subject every two pages, its units split
+    across both pages (so subjects straddle chunk boundaries). Returns (pages, expected).
+    """
+    pages, expected = [], {}
+    filler = "Course outcomes, reference books and evaluation scheme as per university norms."
+    for page in range(page_count):
+        index = page // 2
+        subject = f"Subject {index + 1:02d} Sem {index // 5 + 1}"
+        first_half = page % 2 == 0
+        units = range(1, units_per_subject // 2 + 2) if first_half else range(units_per_subject // 2 + 2, units_per_subject + 1)
+        lines = [f"Semester {index // 5 + 1}", f"Subject: {subject}"]
+        for u in units:
+            unit = f"Unit {u}: Topic {index + 1}.{u}"
+            lines += [unit, filler, filler]
+            expected.setdefault(subject, []).append(unit)
+        pages.append(lines)
+    return pages, expected
+
+
+def bench_syllabus(args):
+    _, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    GeminiStubHandler.seconds_per_unit = args.seconds_per_unit
+    GeminiStubHandler.max_reply_units = args.max_reply_units
+    GeminiStubHandler.bad_json_every = args.bad_json_every
+
+    os.chdir(tempfile.mkdtemp(prefix="docs-bench-"))  # fresh syllabus cache
+    import database
+    import syllabus_parser
+    database.init_db()
+    point_gemini_at(gemini_url)
+
+    pages, expected = synthetic_syllabus(args.pages)
+    write_text_pdf("syllabus.pdf", pages)
+    expected_units = sum(len(u) for u in expected.values())
+
+    print(f"📚 Syllabus parse: {args.pages} pages, {len(expected)} subjects, {expected_units} units "
+          f"(gemini {args.gemini_latency}s + {args.seconds_per_unit}s/unit, "
+          f"reply cap {args.max_reply_units or 'off'}, bad JSON every {args.bad_json_every or '-'})")
+    for chunk_pages in args.chunk_pages:
+        syllabus_parser.CHUNK_PAGES = chunk_pages or args.pages  # 0 = whole document in one prompt
+        timings, found = [], {}
+        for _ in range(args.repeat):
+            with sqlite3.connect(database.DB_NAME) as conn:
+                conn.execute("DELETE FROM syllabus_cache")
+            with open(os.devnull, "w") as quiet, \
+                    contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(quiet):
+                started = time.perf_counter()
+                found = syllabus_parser.parse_syllabus_with_gemini("syllabus.pdf")
+                timings.append(time.perf_counter() - started)
+        units = sum(len(set(found.get(s, [])) & set(u)) for s, u in expected.items())
+        label = f"{chunk_pages} pages" if chunk_pages else "single"
+        print(f"   chunks={label:<10} best={min(timings):6.2f}s  "
+              f"subjects={len(set(found) & set(expected)):>3}/{len(expected)}  units={units:>4}/{expected_units}")
+
+
+# ==========================================
+# 🧩 STRUCTURED GEMINI REPLIES
+# ==========================================
+def bench_gemini_json(args):
+    _, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    GeminiStubHandler.bad_json_every = args.bad_json_every
+    GeminiStubHandler.search_reply = {"is_search": True, "subject": "Physics", "keyword": "unit 1 notes"}
+
+    import test_sorting
+    from tracing import counter_value
+    point_gemini_at(gemini_url)
+    folder_map = {"Physics": {"id": "physics", "units": {"Unit 1": "u1"}}}
+
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        for _ in range(args.calls):
+            test_sorting.parse_search_intent("find physics unit 1 notes", folder_map)
+            test_sorting.generate_json(["You are a Document Sorter."], test_sorting.SORT_SCHEMA, "sort",
+                                       required=("subject",))
+
+    print(f"🧩 Gemini JSON: {args.calls} calls each, latency {args.gemini_latency}s, "
+          f"1 in {args.bad_json_every or '-'} replies cut short")
+    for call in ("search_intent", "sort"):
+        outcomes = {r: counter_value("gemini_json", call=call, result=r)
+                    for r in ("ok", "repaired", "retried", "failed")}
+        total = sum(outcomes.values()) or 1
+        print(f"   {call:<14} " + "  ".join(f"{r}={n}" for r, n in outcomes.items())
+              + f"  wasted calls={outcomes['failed'] / total:.0%}")
+
+
+# ==========================================
+# 🗄️ SHARED STATE STORE
+# ==========================================
+def claim_messages(db_path, message_ids):
+    """One 'worker process': tries to claim every message ID, returns the ones it won."""
+    os.environ["DB_PATH"] = db_path
+    os.environ["STATE_BACKEND"] = "sqlite"
+    from state_store import get_state_store
+    store = get_state_store()
+    return [m for m in message_ids if store.add("seen_messages", m, ttl=60)]
+
+
+def bench_state(args):
+    scratch = tempfile.mkdtemp(prefix="docs-bench-")
+    os.environ["DB_PATH"] = os.path.join(scratch, "bot_memory.db")
+    import database
+    import state_store
+    database.init_db()
+
+    print(f"🗄️ State store: {args.ops} ops per kind")
+    for name, store in (("memory", state_store.MemoryStateStore()), ("sqlite", state_store.SQLiteStateStore())):
+        timings = {}
+        for kind, op in (
+            ("set", lambda i: store.set("bench", f"k{i}", {"progress": i}, ttl=60)),
+            ("get", lambda i: store.get("bench", f"k{i}")),
+            ("add", lambda i: store.add("bench-add", f"k{i}", ttl=60)),
+        ):
+            started = time.perf_counter()
+            for i in range(args.ops):
+                op(i)
+            timings[kind] = args.ops / (time.perf_counter() - started)
+        print(f"   {name:<7} " + "  ".join(f"{k}={v:9.0f}/s" for k, v in timings.items()))
+
+    # Several worker processes see the same webhook retries: each message must be handled once
+    message_ids = [f"wamid-{i}" for i in range(args.messages)]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        claimed = list(pool.map(claim_messages, [os.environ["DB_PATH"]] * args.workers,
+                                [message_ids] * args.workers))
+    total = sum(len(c) for c in claimed)
+    unique = len(set().union(*claimed))
+    ok = total == unique == len(message_ids)
+    print(f"   dedup across {args.workers} processes: {total} claims for {len(message_ids)} messages "
+          f"({'✅ each handled once' if ok else '❌ duplicates or misses'}); "
+          f"per worker {[len(c) for c in claimed]}")
+    return ok
+
+
+# ==========================================
+# 🗂️ BULK RE-SORT
+# ==========================================
+def bench_resort(args):
+    graph, graph_url = start_stub(GraphStubHandler, 0)
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    gemini, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    # Our own names and "physics ..." match locally, "Lecture" needs Gemini, scans stay unsorted
+    DriveStubHandler.list_files = args.files
+    DriveStubHandler.file_names = ["Physics_Unit 1_Notes_{i}.pdf", "Lecture {i}.pdf", "Scan_{i}.pdf",
+                                   "physics lab record {i}.pdf"]
+
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        main, server, _ = boot_app(graph_url, drive_url, gemini_url)
+        phone = seed_users(main, 1)[0]
+    import resort_job
+    from tracing import counter_value
+
+    # 1. Interrupt the job after a few rounds (as a restart would), then start it again
+    real_move_files, rounds = resort_job.move_files, [0]
+
+    def crash_after_rounds(*a, **kw):
+        rounds[0] += 1
+        if rounds[0] > args.interrupt_after:
+            raise RuntimeError("simulated restart")
+        return real_move_files(*a, **kw)
+
+    gemini_before = GeminiStubHandler.requests_seen
+    resort_job.move_files = crash_after_rounds
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        try:
+            resort_job.run_resort(phone)
+        except RuntimeError:
+            pass
+        interrupted = resort_job.job_status(phone)
+        resort_job.move_files = real_move_files
+        job = resort_job.run_resort(phone)
+
+    print(f"🗂️ Re-sort: {args.files} files in Imported Documents "
+          f"(drive {args.drive_latency}s, gemini {args.gemini_latency}s, "
+          f"batch {resort_job.RESORT_BATCH} x {resort_job.RESORT_WORKERS} workers)")
+    print(f"   interrupted at {interrupted['position']}/{interrupted['total']}, resumed to "
+          f"{job['position']}/{job['total']} ({job['status']})")
+    print(f"   moved={job['moved']} unsorted={job['unsorted']} failed={job['failed']}  "
+          f"local={counter_value('resort_files', method='local')} gemini={counter_value('resort_files', method='gemini')}")
+    print(f"   {job['files_per_minute']:.0f} files/min | gemini calls {GeminiStubHandler.requests_seen - gemini_before} "
+          f"| files moved in Drive {len(DriveStubHandler.moved)}")
+    stop_app(server, (graph, drive, gemini))
+    return job["status"] == "done" and len(DriveStubHandler.moved) == job["moved"]
+
+
+# ==========================================
+# 🧭 ONBOARDING DRIVE IMPORT
+# ==========================================
+def bench_import(args):
+    os.environ["IMPORT_MOVES_PER_SECOND"] = str(args.moves_per_second)
+    os.environ["MOVE_BACKOFF"] = "0.05"
+    graph, graph_url = start_stub(GraphStubHandler, 0)
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    gemini, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    # A tree `depth` levels deep, `folders` sub-folders per folder; every listing query returns `files` files
+    DriveStubHandler.list_folders, DriveStubHandler.folder_depth = args.folders, args.depth
+    DriveStubHandler.list_files, DriveStubHandler.unique_files = args.files, True
+    DriveStubHandler.file_names = ["Physics_Unit 1_Notes_{i}.pdf", "Lecture {i}.pdf", "IMG_{i}.jpg",
+                                   "physics lab record {i}.pdf"]
+    DriveStubHandler.rate_limit_every = args.rate_limit_every
+
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        main, server, _ = boot_app(graph_url, drive_url, gemini_url)
+        phone = seed_users(main, 1)[0]
+    import drive_import
+    from tracing import counter_value
+
+    # 1. Dry run: walk + classify, nothing moves
+    drive_before, gemini_before = DriveStubHandler.requests_seen, GeminiStubHandler.requests_seen
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        plan = drive_import.run_import(phone)
+    listing_calls = DriveStubHandler.requests_seen - drive_before
+    gemini_calls = GeminiStubHandler.requests_seen - gemini_before
+    print(f"🧭 Import: {plan['files_found']} files in {plan['folders_scanned']} folders "
+          f"(drive {args.drive_latency}s, gemini {args.gemini_latency}s, {drive_import.IMPORT_WORKERS} workers)")
+    print(f"   dry run: scan {plan['scan_seconds']}s ({listing_calls} listing calls, "
+          f"{plan['files_found'] / max(plan['scan_seconds'], 1e-9) * 60:.0f} files/min), "
+          f"classify {plan['classify_seconds']}s ({gemini_calls} gemini calls)")
+    print(f"   plan: {plan['planned']} to move, {plan['unsorted']} stay put, by subject {plan['by_subject']}; "
+          f"moved so far {len(DriveStubHandler.moved)}")
+
+    # 2. Apply the stored plan (no second walk or Gemini pass), paced and with injected rate limits
+    drive_before, gemini_before = DriveStubHandler.requests_seen, GeminiStubHandler.requests_seen
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        job = drive_import.run_import(phone, apply=True)
+    moves_per_second = job["position"] / job["move_seconds"] if job["move_seconds"] else 0
+    print(f"   apply: moved {job['moved']} failed {job['failed']} in {job['move_seconds']:.1f}s "
+          f"({moves_per_second:.0f} moves/s, limit {args.moves_per_second:g}/s); "
+          f"{DriveStubHandler.requests_seen - drive_before} drive requests, "
+          f"{GeminiStubHandler.requests_seen - gemini_before} gemini calls, "
+          f"{counter_value('drive_rate_limited', op='move')} rate-limited moves retried")
+    stop_app(server, (graph, drive, gemini))
+    ok = (job["status"] == "done" and job["moved"] == plan["planned"] == len(DriveStubHandler.moved)
+          and moves_per_second <= args.moves_per_second * 1.05)
+    print(f"   {'✅' if ok else '❌'} every planned file moved once, within the pace limit")
+    return ok
+
+
+# ==========================================
+# 🔎 FULL-TEXT INDEX
+# ==========================================
+def text_pdf(lines):
+    """A minimal one-page PDF whose text layer is `lines` (enough for pypdf's extract_text)."""
+    stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(
+        "(" + line.replace("\\", "").replace("(", "").replace(")", "") + ") '" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = "%PDF-1.4\n", []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+def bench_fulltext(args):
+    import random
+    scratch = tempfile.mkdtemp(prefix="docs-bench-")
+    os.environ["DB_PATH"] = os.path.join(scratch, "bot_memory.db")
+    import database
+    import text_index
+    database.init_db()
+
+    # Zipf-ish vocabulary: a few very common words, a long tail of rare ones
+    rng = random.Random(7)
+    vocab = [f"term{i}" for i in range(args.vocab)] + ["normalization", "eigenvalue", "thermodynamics", "recursion"]
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+
+    def document():
+        return " ".join(rng.choices(vocab, weights, k=args.words))
+
+    # 1. Extraction: pypdf on PDFs shaped like lecture notes
+    pdf_path = os.path.join(scratch, "notes.pdf")
+    lines = document().split()
+    with open(pdf_path, "wb") as f:
+        f.write(text_pdf([" ".join(lines[i:i + 12]) for i in range(0, min(len(lines), 720), 12)]))
+    started = time.perf_counter()
+    for _ in range(args.extract_repeat):
+        extracted = text_index.extract_text(pdf_path)
+    extract_ms = (time.perf_counter() - started) / args.extract_repeat * 1000
+    print(f"🔎 Full-text index: {args.users} users x {args.docs} docs x {args.words} words")
+    print(f"   extract   {extract_ms:7.2f} ms per 1-page PDF ({len(extracted.split())} words recovered)")
+
+    # 2. Indexing throughput (one index_file call per upload, as the pipeline does)
+    phones = [f"9100000{i:04d}" for i in range(args.users)]
+    started = time.perf_counter()
+    for d in range(args.docs):
+        for phone in phones:
+            text_index.index_file(phone, f"{phone}-doc{d}", f"Notes {d}.pdf", f"{phone}-folder{d % 8}", document())
+    index_seconds = time.perf_counter() - started
+    total_docs = args.docs * args.users
+    db_mb = sum(os.path.getsize(os.path.join(scratch, n)) for n in os.listdir(scratch) if n.startswith("bot_memory")) / 1e6
+    print(f"   index     {total_docs / index_seconds:7.0f} docs/s "
+          f"({total_docs / index_seconds * args.words / 1e6:.1f}M words/s), database {db_mb:.0f} MB")
+
+    # 3. Query latency against one user's corpus: rare, common and multi-word queries
+    queries = ["find normalization notes", "eigenvalue", "term3 term40", "term900 thermodynamics", "recursion term2"]
+    latencies, hits = [], 0
+    for i in range(args.queries):
+        phone, query = phones[i % len(phones)], queries[i % len(queries)]
+        folder = f"{phone}-folder{i % 8}" if i % 3 == 0 else None
+        started = time.perf_counter()
+        results = text_index.search(phone, query, folder)
+        latencies.append(time.perf_counter() - started)
+        hits += bool(results)
+        assert all(r["id"].startswith(phone) for r in results), "results leaked across users"
+    latencies.sort()
+    p50, p95 = percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000
+    sample = text_index.search(phones[0], "normalization")[:1]
+    print(f"   query     p50 {p50:.2f} ms  p95 {p95:.2f} ms  ({hits}/{args.queries} with results)")
+    if sample:
+        print(f"   snippet   {sample[0]['snippet']}")
+    ok = not args.budget_ms or p95 <= args.budget_ms
+    if args.budget_ms:
+        print(f"   {'✅' if ok else '❌'} p95 {'within' if ok else 'over'} the {args.budget_ms:g} ms budget")
+    return ok
+
+
+# ==========================================
+# 🧠 LOCAL SEMANTIC RANKING
+# ==========================================
+def synthetic_corpus(count, rng):
+    """(docs, groups): docs = [(name, path, body)]; files in the same group answer the same query."""
+    subjects = ["DBMS", "Operating Systems", "Physics", "Mathematics", "Computer Networks", "Data Structures",
+                "Chemistry", "Economics", "Machine Learning", "Digital Electronics", "Compiler Design", "English"]
+    kinds = ["Lecture Notes", "Question Paper", "Previous Year Question Paper", "Assignment", "Lab Record",
+             "Tutorial Sheet", "Summary"]
+    syllables = ["ka", "lo", "ver", "min", "tra", "sol", "pex", "dri", "on", "ul", "zen", "mar", "ti", "qua", "bel"]
+    topics = list(dict.fromkeys("".join(rng.choices(syllables, k=3)) for _ in range(4000)))[:2000]
+
+    docs, groups = [], []
+    for i in range(count):
+        subject, kind, topic = rng.choice(subjects), rng.choice(kinds), rng.choice(topics)
+        unit, year = rng.randint(1, 5), rng.randint(2018, 2024)
+        name = f"{subject}_Unit {unit}_{kind} {topic} {year}_{i}.pdf"
+        body = " ".join([topic] * 3 + rng.choices(topics, k=30))
+        docs.append((name, f"{subject} Unit {unit}", body))
+        groups.append((subject, kind, topic))
+    return docs, groups
+
+
+def typo(word, rng):
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+def bench_semantic(args):
+    import random
+    import semantic_index
+    np = semantic_index.numpy_module()
+    if np is None:
+        print("⚠️ numpy is not installed: semantic ranking is disabled")
+        return False
+    rng = random.Random(11)
+    docs, groups = synthetic_corpus(args.docs, rng)
+    by_group = {}
+    for i, group in enumerate(groups):
+        by_group.setdefault(group, set()).add(i)
+
+    # Queries phrased the way people ask: lower case, a typo, extra words, no file-name layout
+    queries = []
+    for target in rng.sample(range(args.docs), args.queries):
+        subject, kind, topic = groups[target]
+        words = [typo(topic, rng), kind.lower().replace("previous year", "last year's"), subject.lower()]
+        rng.shuffle(words)
+        queries.append(("find " + " ".join(words), by_group[groups[target]]))
+
+    print(f"🧠 Semantic ranking: {args.docs} files, {args.queries} queries (lower case, one typo, reordered)")
+    ok = True
+    for dim in args.dims:
+        started = time.perf_counter()
+        matrix, idf = semantic_index.build(docs, dim=dim)
+        build_seconds = time.perf_counter() - started
+
+        latencies, hits, precision = [], 0, 0.0
+        for text, relevant in queries:
+            started = time.perf_counter()
+            vector = semantic_index.query_vector(text, idf, dim=dim)
+            best = semantic_index.top_matches(matrix, vector, 10)
+            latencies.append(time.perf_counter() - started)
+            found = [row for row, _ in best if row in relevant]
+            hits += bool(found)
+            precision += len(found) / min(10, len(relevant))
+        latencies.sort()
+        recall = hits / len(queries)
+        print(f"   dim {dim:>4}: build {build_seconds:5.1f}s  matrix {matrix.nbytes / 1e6:6.1f} MB  "
+              f"query p50 {percentile(latencies, 50) * 1000:5.2f} ms p95 {percentile(latencies, 95) * 1000:5.2f} ms  "
+              f"hit@10 {recall:.3f}  precision@10 {precision / len(queries):.3f}")
+        ok = ok and recall >= args.min_recall
+    if args.min_recall:
+        print(f"   {'✅' if ok else '❌'} hit@10 >= {args.min_recall} at every dimension")
+    return ok
+
+
+# ==========================================
+# ♻️ DUPLICATE UPLOADS
+# ==========================================
+def bench_duplicates(args):
+    import random
+    os.environ["SENDER_FILES_PER_MINUTE"] = "0"  # One sender sends every file
+    graph, graph_url = start_stub(GraphStubHandler, 0)
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    gemini, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        main, server, app_url = boot_app(graph_url, drive_url, gemini_url)
+        phone = seed_users(main, 1)[0]
+    from tracing import counter_value
+
+    # `files` messages drawn from `distinct` documents: everything after a document's first send is a resend
+    rng = random.Random(5)
+    media_ids = [f"media-{rng.randrange(args.distinct)}" for _ in range(args.files)]
+    drive_before, bytes_before = DriveStubHandler.requests_seen, DriveStubHandler.upload_bytes
+    latencies = {"new": [], "duplicate": []}
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet), requests.Session() as session:
+        for media_id in media_ids:
+            # One at a time, so a resend finds the first copy already recorded
+            replies = len(GraphStubHandler.sent)
+            started = time.perf_counter()
+            session.post(f"{app_url}/webhook", json=whatsapp_payload(
+                phone, {"type": "document", "document": {"id": media_id, "mime_type": "application/pdf"}}))
+            done = []
+            while not done and time.perf_counter() - started < 30:
+                time.sleep(0.005)
+                done = [m["text"]["body"] for m in GraphStubHandler.sent[replies:]
+                        if m.get("text", {}).get("body", "")[:1] in ("✅", "♻", "❌")]
+            if not done or done[-1].startswith("❌"):
+                latencies.setdefault("failed", []).append(time.perf_counter() - started)
+                continue
+            latencies["duplicate" if done[-1].startswith("♻") else "new"].append(time.perf_counter() - started)
+
+    uploads = len(latencies["new"])
+    size_kb = len(GraphStubHandler.media_bytes) / 1024
+    print(f"♻️ Duplicate uploads: {args.files} files from {args.distinct} documents ({size_kb:.0f} KB each, "
+          f"drive {args.drive_latency}s, gemini {args.gemini_latency}s)")
+    for kind, values in latencies.items():
+        values.sort()
+        print(f"   {kind:>9}: {len(values):4d} files  p50 {percentile(values, 50) * 1000:6.1f} ms  "
+              f"p95 {percentile(values, 95) * 1000:6.1f} ms")
+    sent_bytes = DriveStubHandler.upload_bytes - bytes_before
+    print(f"   drive: {sent_bytes:,} bytes uploaded (vs {sent_bytes // max(uploads, 1) * args.files:,} without the check), "
+          f"{DriveStubHandler.requests_seen - drive_before} requests; "
+          f"checks {counter_value('duplicate_checks', result='duplicate')} duplicate / "
+          f"{counter_value('duplicate_checks', result='new')} new / {counter_value('duplicate_checks', result='stale')} stale")
+    stop_app(server, (graph, drive, gemini))
+    ok = uploads == len(set(media_ids))
+    print(f"   {'✅' if ok else '❌'} every document uploaded exactly once")
+    return ok
+
+
+# ==========================================
+# 📨 OUTBOUND WHATSAPP QUEUE
+# ==========================================
+def bench_outbox(args):
+    import random
+    os.environ["WHATSAPP_MPS"] = str(args.mps)
+    os.environ["OUTBOX_BACKOFF"] = "0.2"
+    graph, graph_url = start_stub(GraphStubHandler, args.graph_latency)
+    GraphStubHandler.max_per_second = args.meta_mps
+    import outbox
+    from tracing import counter_value
+
+    received = {}  # (to, text) -> time the Graph API accepted it
+
+    def deliver(payload):
+        r = requests.post(f"{graph_url}/v17.0/bench-phone/messages", json=payload)
+        if r.ok:
+            received[(payload["to"], payload["text"]["body"])] = time.perf_counter()
+        return r
+
+    def run(send):
+        """`users` file pipelines arriving together: an analyzing ping, three upload pings, the result."""
+        rng = random.Random(3)
+        sent_at = {}
+
+        def pipeline(i):
+            to = f"9199{i:06d}"
+            texts = ["🤖 Analyzing document...", "⏫ Uploading... 25%", "⏫ Uploading... 50%", "⏫ Uploading... 75%"]
+            for text in texts:
+                sent_at[(to, text)] = time.perf_counter()
+                send(to, text, outbox.PROGRESS)
+                time.sleep(rng.uniform(0, args.step_ms / 1000))
+            sent_at[(to, "✅ Auto-Saved!")] = time.perf_counter()
+            send(to, "✅ Auto-Saved!", outbox.RESULT)
+
+        received.clear()
+        throttled_before, started = GraphStubHandler.throttled, time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            list(pool.map(pipeline, range(args.users)))
+        outbox.drain(timeout=120)
+        elapsed = time.perf_counter() - started
+        results = sorted(received[k] - t for k, t in sent_at.items() if k in received and k[1].startswith("✅"))
+        return {"requested": len(sent_at), "delivered": len(received), "results": len(results),
+                "throttled": GraphStubHandler.throttled - throttled_before, "seconds": elapsed,
+                "p50": percentile(results, 50), "p95": percentile(results, 95)}
+
+    def direct(to, text, priority):
+        # The old send_message: post on the caller's thread, ignore the answer
+        try:
+            deliver({"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": text}})
+        except requests.RequestException:
+            pass
+
+    def queued(to, text, priority):
+        outbox.enqueue(to, {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": text}},
+                       deliver, priority)
+
+    print(f"📨 Outbound queue: {args.users} pipelines at once, Meta limit {args.meta_mps}/s, "
+          f"outbox pace {args.mps}/s, graph {args.graph_latency}s")
+    outcomes = {"direct": run(direct), "outbox": run(queued)}
+    for name, r in outcomes.items():
+        print(f"   {name:>6}: {r['requested']} requested, {r['delivered']} delivered, {r['throttled']} throttled, "
+              f"results {r['results']}/{args.users} (p50 {r['p50'] * 1000:.0f} ms p95 {r['p95'] * 1000:.0f} ms), "
+              f"{r['seconds']:.1f}s")
+    print(f"   outbox: {counter_value('whatsapp_messages', result='coalesced', priority='progress')} progress pings "
+          f"coalesced, {counter_value('whatsapp_messages', result='retried', priority='result')} result / "
+          f"{counter_value('whatsapp_messages', result='retried', priority='progress')} progress retries")
+    graph.shutdown()
+    ok = outcomes["outbox"]["results"] == args.users
+    print(f"   {'✅' if ok else '❌'} every result delivered through the outbox")
+    return ok
+
+
+# ==========================================
+# 🎛️ DRIVE QUOTA
+# ==========================================
+def bench_quota(args):
+    os.environ["DRIVE_BACKOFF"] = str(args.backoff)
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.errors import HttpError
+    from google_auth import RootOverrideHttp, drive_discovery
+    from drive_index import list_folder
+    import drive_quota
+    from tracing import counter_value
+
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    DriveStubHandler.max_in_flight = args.capacity
+    DriveStubHandler.list_files = 20
+
+    def run(quota):
+        """`callers` browse listings at once (one user, `distinct` different folders); each builds its own client."""
+        builder = drive_quota.request_builder("9100000000") if quota else None
+        latencies, errors = [], [0]
+        ready = threading.Barrier(args.callers)
+
+        def browse(i):
+            kwargs = {"requestBuilder": builder} if builder else {}
+            service = build_from_document(drive_discovery(), http=RootOverrideHttp(drive_url), **kwargs)
+            ready.wait()
+            started = time.perf_counter()
+            try:
+                list_folder(service, f"folder-{i % args.distinct}")
+                latencies.append(time.perf_counter() - started)
+            except HttpError:
+                errors[0] += 1
+
+        seen, limited = DriveStubHandler.requests_seen, DriveStubHandler.rate_limited
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.callers) as pool:
+            list(pool.map(browse, range(args.callers)))
+        latencies.sort()
+        return {"ok": len(latencies), "errors": errors[0], "seconds": time.perf_counter() - started,
+                "sent": DriveStubHandler.requests_seen - seen, "limited": DriveStubHandler.rate_limited - limited,
+                "p50": percentile(latencies, 50), "p95": percentile(latencies, 95)}
+
+    print(f"🎛️ Drive quota: {args.callers} concurrent listings of {args.distinct} folders for one user, "
+          f"Drive accepts {args.capacity} at once, latency {args.drive_latency}s")
+    outcomes = {"direct": run(False), "quota": run(True)}
+    for name, r in outcomes.items():
+        print(f"   {name:>6}: {r['ok']}/{args.callers} ok, {r['errors']} errors, {r['sent']} Drive requests "
+              f"({r['limited']} rate-limited), p50 {r['p50'] * 1000:.0f} ms p95 {r['p95'] * 1000:.0f} ms, "
+              f"{r['seconds']:.1f}s")
+    op = "drive.files.list"
+    user_limit = drive_quota._user_limiter("9100000000").limit
+    print(f"   quota: {counter_value('drive_requests', op=op, result='coalesced')} coalesced, "
+          f"{counter_value('drive_requests', op=op, result='retried')} retried, user limit now {user_limit:.1f} "
+          f"(max {drive_quota.DRIVE_USER_CONCURRENCY})")
+    drive.shutdown()
+    ok = outcomes["quota"]["errors"] == 0 and outcomes["quota"]["limited"] < outcomes["direct"]["limited"]
+    print(f"   {'✅' if ok else '❌'} no rate-limit errors reach callers, fewer rate-limited requests")
+    return ok
+
+
+# ==========================================
+# 🩹 FOLDER MAP RECONCILER
+# ==========================================
+def bench_folders(args):
+    graph, graph_url = start_stub(GraphStubHandler, 0)
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    gemini, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    DriveStubHandler.list_folders = 5
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        main, server, app_url = boot_app(graph_url, drive_url, gemini_url)
+        phone = seed_users(main, 1)[0]
+    import folder_reconciler
+    from database import get_user, json_field
+    from state_store import get_state_store
+    from tracing import counter_value
+
+    # Gemini files everything under Physics > Unit 1; the stub Drive lists "<parent>-u<i>" as "Unit <i>"
+    folder_map = {"Physics": {"id": "physics", "units": {"Unit 1": "physics-old1", "Unit 2": "physics-u2"}}}
+    for k in range(args.subjects):
+        folder_map[f"Subject {k}"] = {"id": f"s{k}", "units": {f"Unit {i}": f"s{k}-u{i}" for i in range(5)}}
+    folder_map["Imported Documents"] = {"id": "imported", "units": {}}
+    main.update_user(phone, "folder_map", folder_map)
+    folders = 1 + sum(1 + len(e["units"]) if isinstance(e, dict) else 1 for e in folder_map.values())
+
+    def send_file(media_id):
+        """(reply text, seconds) for one document sent over WhatsApp."""
+        replies, started = len(GraphStubHandler.sent), time.perf_counter()
+        requests.post(f"{app_url}/webhook", json=whatsapp_payload(
+            phone, {"type": "document", "document": {"id": media_id, "mime_type": "application/pdf"}}))
+        while time.perf_counter() - started < 30:
+            done = [m["text"]["body"] for m in GraphStubHandler.sent[replies:]
+                    if m.get("text", {}).get("body", "")[:1] in ("✅", "♻", "❌")]
+            if done:
+                return done[-1], time.perf_counter() - started
+            time.sleep(0.005)
+        return "(no reply)", time.perf_counter() - started
+
+    # 1. A clean map: one batched check
+    seen = DriveStubHandler.requests_seen
+    started = time.perf_counter()
+    folder_reconciler.reconcile(phone)
+    clean = (time.perf_counter() - started, DriveStubHandler.requests_seen - seen)
+
+    # 2. The user deletes Physics > Unit 1 (and made a new "Unit 1"), deletes a unit and a whole
+    #    subject, and renames another subject; then sends a file for Physics > Unit 1
+    DriveStubHandler.gone |= {"physics-old1", "s0-u2", "s1"}
+    DriveStubHandler.names["s2"] = "Subject 2 (Honours)"
+    get_state_store().delete("folder_map_verified", phone)
+
+    real_verify, real_reconcile = folder_reconciler.verify_async, folder_reconciler.reconcile
+    folder_reconciler.verify_async = folder_reconciler.reconcile = lambda *a, **kw: None
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        before = send_file("media-before")
+        time.sleep(0.2)  # The staged copy is deleted around the failure reply
+    folder_reconciler.verify_async, folder_reconciler.reconcile = real_verify, real_reconcile
+    discarded = list(DriveStubHandler.deleted)
+
+    seen = DriveStubHandler.requests_seen
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        after = send_file("media-after")
+        cached = send_file("media-cached")
+    repaired = json_field(get_user(phone), "folder_map", {})
+
+    # 3. Deleted again while the map counts as verified: the move fails, the map is repaired, the move retried
+    DriveStubHandler.gone.add("physics-u1")
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        stale = send_file("media-stale")
+
+    print(f"🩹 Folder map: {folders} folders ({args.subjects + 2} subjects), drive {args.drive_latency}s, "
+          f"gemini {args.gemini_latency}s")
+    print(f"   clean check: {clean[0] * 1000:.0f} ms, {clean[1]} Drive request(s)")
+    for name, (reply, seconds) in (("no check", before), ("check", after), ("cached", cached), ("stale", stale)):
+        print(f"   {name:>8}: {seconds * 1000:6.0f} ms  {reply.splitlines()[0]} {' '.join(reply.splitlines()[1:2])}")
+    print(f"   repairs: " + ", ".join(f"{kind} {counter_value('folder_map_repairs', kind=kind)}"
+                                      for kind in ("renamed", "relinked", "recreated"))
+          + f" | checks cached {counter_value('folder_map_checks', result='cached')}"
+          + f" | Drive requests for the last three files {DriveStubHandler.requests_seen - seen}")
+    print(f"   Physics > Unit 1 -> {repaired['Physics']['units']['Unit 1']}, "
+          f"Subject 1 -> {repaired['Subject 1']['id']}, renamed: {'Subject 2 (Honours)' in repaired}")
+    print(f"   staged copies deleted after the failed save: {len(discarded)}, after the saved ones: "
+          f"{len(DriveStubHandler.deleted) - len(discarded)}")
+    stop_app(server, (graph, drive, gemini))
+    ok = before[0].startswith("❌") and all(r[0].startswith("✅") for r in (after, cached, stale)) \
+        and repaired["Physics"]["units"]["Unit 1"] == "physics-u1" and "Subject 2 (Honours)" in repaired \
+        and len(discarded) == 1 and len(DriveStubHandler.deleted) == 1
+    print(f"   {'✅' if ok else '❌'} the file reaches the re-linked folder instead of failing")
+    return ok
+
+
+# ==========================================
+# 🧭 FOLDER ROUTING
+# ==========================================
+def old_route(folder_map, decision, staging_folder_id):
+    """The chained lookups process_file_background used before routing_table (for comparison)."""
+    subj, unit = decision.get("subject"), decision.get("unit")
+    if subj in folder_map and unit in folder_map[subj].get("units", {}):
+        return folder_map[subj]["units"][unit]
+    if subj in folder_map:
+        return folder_map[subj]["id"]
+    target = folder_map.get("Imported Documents")
+    return (target.get("id") if isinstance(target, dict) else target) or staging_folder_id
+
+
+def bench_routing(args):
+    import random
+    import routing_table
+
+    rng = random.Random(11)
+    folder_map = {"Database Management Systems": {"id": "dbms", "units": {f"Unit {i}": f"dbms-u{i}" for i in range(1, 6)}}}
+    for k in range(args.subjects):
+        name = f"Subject {chr(65 + k)} Studies"
+        folder_map[name] = {"id": f"s{k}", "units": {f"Unit {i}": f"s{k}-u{i}" for i in range(1, 6)}}
+    for name in ("Important Documents", "Screenshots", "Identity Cards", "Personal", "Imported Documents"):
+        folder_map[name] = {"id": name.lower().replace(" ", "-"), "units": {}}
+    raw = json.dumps(folder_map)
+
+    def typo(text):
+        i = rng.randrange(1, len(text) - 2)
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+    roman = ["I", "II", "III", "IV", "V"]
+    variants = {  # How Gemini writes (subject, unit "Unit n"): the wanted folder is always that unit
+        "exact": lambda s, n: (s, f"Unit {n}"),
+        "casing/spacing": lambda s, n: (f" {s.lower()} ", f"unit  {n}"),
+        "separators": lambda s, n: (s.replace(" ", "_"), f"Unit-{n}"),
+        "roman": lambda s, n: (s, f"Unit {roman[n - 1]}"),
+        "typo": lambda s, n: (typo(s), f"Unit {n}"),
+        "initials": lambda s, n: ("".join(w[0] for w in s.split()).upper(), f"unit{n}"),
+    }
+    subjects = [s for s in folder_map if folder_map[s]["units"]]
+    cases = {kind: [] for kind in variants}
+    for kind, make in variants.items():
+        for _ in range(args.cases):
+            subject, n = rng.choice(subjects), rng.randint(1, 5)
+            answer, unit = make(subject, n)
+            cases[kind].append(({"subject": answer, "unit": unit}, folder_map[subject]["units"][f"Unit {n}"]))
+
+    print(f"🧭 Folder routing: {len(subjects)} subjects x 5 units + 5 utility folders, {args.cases} answers per kind")
+    print(f"   {'answer style':>15}  {'before':>7}  {'table':>7}")
+    for kind, pairs in cases.items():
+        before = sum(old_route(folder_map, d, "root") == want for d, want in pairs) / len(pairs)
+        after = sum(routing_table.table_for(raw).route(d, "root")[0] == want for d, want in pairs) / len(pairs)
+        print(f"   {kind:>15}  {before:7.0%}  {after:7.0%}")
+
+    # Per file: the old path decoded the map, rebuilt the prompt JSON and walked the checks
+    def per_file(kinds):
+        decisions = [d for kind in kinds for d, _ in cases[kind]]
+        started = time.perf_counter()
+        for i in range(args.repeat):
+            decoded = json.loads(raw)
+            json.dumps({subj: list(data["units"].keys()) for subj, data in decoded.items()})
+            old_route(decoded, decisions[i % len(decisions)], "root")
+        before = (time.perf_counter() - started) / args.repeat
+        started = time.perf_counter()
+        for i in range(args.repeat):
+            routes = routing_table.table_for(raw)
+            routes.sort_prompt
+            routes.route(decisions[i % len(decisions)], "root")
+        return before, (time.perf_counter() - started) / args.repeat
+
+    for label, kinds in (("exact/alias", ["exact", "casing/spacing", "separators", "roman", "initials"]),
+                         ("typos (fuzzy)", ["typo"])):
+        before, after = per_file(kinds)
+        print(f"   per file, {label:>13}: before {before * 1e6:6.1f} us, table {after * 1e6:6.1f} us")
+    started = time.perf_counter()
+    routing_table.RoutingTable(folder_map)
+    print(f"   compiling the table (once per folder_map version): {(time.perf_counter() - started) * 1000:.2f} ms")
+    exact_ok = all(routing_table.table_for(raw).route(d, "root")[0] == want for d, want in cases["exact"])
+    return exact_ok
+
+
+# ==========================================
+# 🚦 INGRESS FAIRNESS
+# ==========================================
+def bench_fairness(args):
+    import threading as _threading
+    graph, graph_url = start_stub(GraphStubHandler, 0)
+    drive, drive_url = start_stub(DriveStubHandler, args.drive_latency)
+    gemini, gemini_url = start_stub(GeminiStubHandler, args.gemini_latency)
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        main, server, app_url = boot_app(graph_url, drive_url, gemini_url)
+        phones = seed_users(main, 2 * (args.users + 1))
+    import admission
+    from tracing import counter_value
+
+    def saved(phone):
+        return sum(1 for m in list(GraphStubHandler.sent) if m.get("to") == phone
+                   and m.get("text", {}).get("body", "").startswith("✅"))
+
+    def run(flooder, users, media_prefix, flood):
+        """The flooder sends `flood` files at once; then each user sends one. Returns the users' latencies."""
+        def post(session, phone, media_id):
+            session.post(f"{app_url}/webhook", json=whatsapp_payload(
+                phone, {"type": "document", "document": {"id": media_id, "mime_type": "application/pdf"}}))
+
+        with requests.Session() as session:
+            for i in range(flood):
+                post(session, flooder, f"{media_prefix}-flood-{i}")
+        latencies = {}
+
+        def user(phone):
+            time.sleep(args.user_delay)
+            with requests.Session() as session:
+                started = time.perf_counter()
+                post(session, phone, f"{media_prefix}-{phone}")
+                while not saved(phone) and time.perf_counter() - started < args.timeout:
+                    time.sleep(0.01)
+                if saved(phone):
+                    latencies[phone] = time.perf_counter() - started
+
+        threads = [_threading.Thread(target=user, args=(phone,)) for phone in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        deadline = time.perf_counter() + args.timeout
+        while (admission.PIPELINES.depth() or admission.PIPELINES.running) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        return sorted(latencies.values())
+
+    # A lone file first, for the uncontended latency
+    with open(os.devnull, "w") as quiet, contextlib.redirect_stdout(quiet):
+        run(phones[-1], [phones[-1]], "warm", 0)
+        alone = run(phones[-1], [phones[-2]], "alone", 0)
+
+        # 1. Before: no buckets, every file starts at once (as BackgroundTasks did)
+        admission.LIMITS["file"] = (0, 0)
+        admission.PIPELINES = admission.FairScheduler(args.flood + args.users, args.flood + args.users)
+        before = run(phones[0], phones[1:args.users + 1], "before", args.flood)
+        flood_before = saved(phones[0])
+
+        # 2. After: per-sender buckets + fair, bounded scheduling (the defaults)
+        admission.LIMITS["file"] = (admission.SENDER_FILES_PER_MINUTE / 60, admission.SENDER_FILE_BURST)
+        admission.PIPELINES = admission.FairScheduler(admission.PIPELINE_SLOTS, admission.PIPELINE_PER_SENDER)
+        flooder, users = phones[args.users + 1], phones[args.users + 2:2 * args.users + 2]
+        after = run(flooder, users, "after", args.flood)
+        flood_after = saved(flooder)
+        notices = [m["text"]["body"] for m in GraphStubHandler.sent if m.get("to") == flooder
+                   and m.get("text", {}).get("body", "").startswith("⏳")]
+
+    print(f"🚦 Ingress fairness: one number sends {args.flood} files at once, then {args.users} users send one each "
+          f"(gemini {args.gemini_latency}s, drive {args.drive_latency}s)")
+    print(f"   alone : {alone[0] * 1000:.0f} ms for a single file")
+    for name, values, flood_saved in (("before", before, flood_before), ("after", after, flood_after)):
+        print(f"   {name:<6}: users saved {len(values)}/{args.users}, p50 {percentile(values, 50) * 1000:.0f} ms "
+              f"p95 {percentile(values, 95) * 1000:.0f} ms; flooder's files saved {flood_saved}/{args.flood}")
+    print(f"   after : flooder throttled {counter_value('ingress', kind='file', result='throttled')} files, "
+          f"{len(notices)} notice(s) sent")
+    stop_app(server, (graph, drive, gemini))
+    ok = len(after) == args.users and percentile(after, 95) < percentile(before, 95)
+    print(f"   {'✅' if ok else '❌'} other users' files are no longer stuck behind the flood")
+    return ok
+
+
+# ==========================================
+# 📉 PAYLOAD SIZE + ENCODING
+# ==========================================
+def synthetic_listing(folders, files):
+    """A browse reply shaped like Drive's (the links are the standard ones compact_listing drops)."""
+    folder_mime, pdf = "application/vnd.google-apps.folder", "application/pdf"
+    return {
+        "folders": [{"id": f"1Fo{i:030d}", "name": f"Unit {i}", "mimeType": folder_mime,
+                     "webViewLink": f"https://drive.google.com/drive/folders/1Fo{i:030d}",
+                     "iconLink": f"https://drive-thirdparty.googleusercontent.com/16/type/{folder_mime}"}
+                    for i in range(folders)],
+        "files": [{"id": f"1Fi{i:030d}", "name": f"Physics_Unit {i % 5 + 1}_Lecture Notes {i}.pdf", "mimeType": pdf,
+                   "webViewLink": f"https://drive.google.com/file/d/1Fi{i:030d}/view?usp=drivesdk",
+                   "iconLink": f"https://drive-thirdparty.googleusercontent.com/16/type/{pdf}"}
+                  for i in range(files)],
+    }
+
+
+def bench_payloads(args):
+    import gzip
+    import payloads
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    listing = synthetic_listing(args.folders, args.files)
+    compact = payloads.compact_listing(listing)
+
+    def encode_time(render):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            render()
+        return (time.perf_counter() - started) / args.repeat * 1e6
+
+    # What FastAPI does with a returned dict, vs handing it a pre-rendered response
+    before_us = encode_time(lambda: JSONResponse(jsonable_encoder(listing)))
+    after_us = encode_time(lambda: payloads.FastJSONResponse(payloads.compact_listing(listing)))
+
+    print(f"📉 Browse payload: {args.folders} folders + {args.files} files "
+          f"(orjson {'on' if payloads.orjson else 'off'}, brotli {'on' if payloads.brotli else 'off'})")
+    print(f"   {'':<8} {'raw':>9} {'gzip':>9} {'brotli':>9}")
+    for name, body in (("full", JSONResponse(listing).body), ("compact", payloads.dumps(compact))):
+        br = f"{len(payloads.brotli.compress(body, quality=4)):>9,}" if payloads.brotli else f"{'-':>9}"
+        print(f"   {name:<8} {len(body):>9,} {len(gzip.compress(body, 6)):>9,} {br}")
+    print(f"   encode   before {before_us:8.0f} µs (jsonable_encoder + json)   after {after_us:8.0f} µs "
+          f"(compact + {'orjson' if payloads.orjson else 'json'})  {before_us / after_us:.1f}x")
+
+
+# ==========================================
+# 🚀 COLD START
+# ==========================================
+STARTUP_PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.load_genai()
+main.drive_discovery()
+print(json.dumps({"import_ms": (imported - started) * 1000, "clients_ms": (time.perf_counter() - imported) * 1000}))
+"""
+
+
+def probe_startup(scratch, env, importtime=False):
+    """One fresh interpreter importing main.py; returns (timings, stderr)."""
+    probe = ["-X", "importtime", "-c", "import main"] if importtime else ["-c", STARTUP_PROBE]
+    result = subprocess.run([sys.executable] + probe, cwd=scratch, env=env, capture_output=True, text=True, check=True)
+    return (None if importtime else json.loads(result.stdout.strip().splitlines()[-1])), result.stderr
+
+
+def slowest_imports(importtime_log, top):
+    """Modules imported directly by main.py, by cumulative import time (ms)."""
+    found = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    "):  # one level below main
+            try:
+                found.append((int(cumulative) / 1000, name.strip()))
+            except ValueError:
+                continue  # The header line
+    return sorted(found, reverse=True)[:top]
+
+
+def bench_startup(args):
+    scratch = tempfile.mkdtemp(prefix="docs-bench-")
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=backend,
+               WHATSAPP_TOKEN="bench", PHONE_NUMBER_ID="bench-phone", GEMINI_API_KEY="bench")
+
+    probe_startup(scratch, env)  # Warm the OS page cache and .pyc files
+    runs = [probe_startup(scratch, env)[0] for _ in range(args.repeat)]
+    import_ms = statistics.median(r["import_ms"] for r in runs)
+    clients_ms = statistics.median(r["clients_ms"] for r in runs)
+
+    print(f"🚀 Cold start ({args.repeat} fresh interpreters, median)")
+    print(f"   import main        {import_ms:7.0f} ms")
+    print(f"   + Gemini/Drive     {clients_ms:7.0f} ms  (deferred: warmed after startup or on first use)")
+    print(f"   slowest direct imports:")
+    for ms, name in slowest_imports(probe_startup(scratch, env, importtime=True)[1], args.top):
+        print(f"      {ms:7.0f} ms  {name}")
+
+    if os.path.exists(os.path.join(scratch, "bot_memory.db")):
+        print("❌ Importing main wrote bot_memory.db; database setup belongs in the lifespan hook")
+        return False
+    if args.budget_ms and import_ms > args.budget_ms:
+        print(f"❌ Import took {import_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local benchmarks (no live credentials needed).")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p_upload = sub.add_parser("upload", help="upload_to_drive against a fake Drive upload endpoint")
+    p_upload.add_argument("--size-mb", type=int, default=32)
+    p_upload.add_argument("--chunk-mb", type=int, nargs="+", default=[1, 5, 16, 64])
+    p_upload.add_argument("--fail-every", type=int, default=0, help="inject a 503 every N chunk PUTs")
+    p_upload.add_argument("--repeat", type=int, default=3)
+
+    p_tracing = sub.add_parser("tracing", help="per-span overhead of the tracing layer")
+    p_tracing.add_argument("--calls", type=int, default=200_000)
+
+    p_load = sub.add_parser("load", help="replay synthetic traffic against the app with stubbed upstreams")
+    p_load.add_argument("--scenarios", nargs="+", default=["webhook-text", "browse", "dashboard-waterfall", "dashboard", "create-folders", "webhook-file"])
+    p_load.add_argument("--requests", type=int, default=200)
+    p_load.add_argument("--concurrency", type=int, default=16)
+    p_load.add_argument("--users", type=int, default=50)
+    p_load.add_argument("--graph-latency", type=float, default=0.05)
+    p_load.add_argument("--drive-latency", type=float, default=0.08)
+    p_load.add_argument("--gemini-latency", type=float, default=0.5)
+    p_load.add_argument("--timeout", type=float, default=120, help="seconds to wait for background pipelines")
+    p_load.add_argument("--quiet", action="store_true", help="silence the app's own prints")
+    p_load.add_argument("--max-block-ms", type=float, default=0,
+                        help="exit 1 if the event loop wakes up later than this (0 = report only)")
+
+    p_syllabus = sub.add_parser("syllabus", help="map-reduce syllabus parsing vs one big prompt")
+    p_syllabus.add_argument("--pages", type=int, default=80)
+    p_syllabus.add_argument("--chunk-pages", type=int, nargs="+", default=[0, 16, 8, 4], help="0 = single prompt")
+    p_syllabus.add_argument("--gemini-latency", type=float, default=0.5)
+    p_syllabus.add_argument("--seconds-per-unit", type=float, default=0.02, help="generation time per unit returned")
+    p_syllabus.add_argument("--max-reply-units", type=int, default=120, help="truncate replies past this (0 = off)")
+    p_syllabus.add_argument("--bad-json-every", type=int, default=0, help="malform every Nth reply")
+    p_syllabus.add_argument("--repeat", type=int, default=2)
+    p_syllabus.add_argument("--verbose", action="store_true", help="show the parser's own prints")
+
+    p_json = sub.add_parser("gemini-json", help="schema/streaming JSON decoding outcomes")
+    p_json.add_argument("--calls", type=int, default=40)
+    p_json.add_argument("--gemini-latency", type=float, default=0.2)
+    p_json.add_argument("--bad-json-every", type=int, default=3, help="cut every Nth reply short")
+
+    p_state = sub.add_parser("state", help="state store throughput and cross-process dedup")
+    p_state.add_argument("--ops", type=int, default=2000)
+    p_state.add_argument("--workers", type=int, default=4)
+    p_state.add_argument("--messages", type=int, default=500)
+
+    p_startup = sub.add_parser("startup", help="cold import time of the app, with an optional budget")
+    p_startup.add_argument("--repeat", type=int, default=5)
+    p_startup.add_argument("--top", type=int, default=8, help="how many of the slowest imports to list")
+    p_startup.add_argument("--budget-ms", type=float, default=0, help="exit 1 if the median import is slower (0 = report only)")
+
+    p_payloads = sub.add_parser("payloads", help="browse payload size and encode time, before vs after")
+    p_payloads.add_argument("--folders", type=int, default=10)
+    p_payloads.add_argument("--files", type=int, default=200)
+    p_payloads.add_argument("--repeat", type=int, default=300)
+
+    p_resort = sub.add_parser("resort", help="bulk re-sort of Imported Documents, interrupted and resumed")
+    p_resort.add_argument("--files", type=int, default=1000)
+    p_resort.add_argument("--drive-latency", type=float, default=0.08)
+    p_resort.add_argument("--gemini-latency", type=float, default=0.5)
+    p_resort.add_argument("--interrupt-after", type=int, default=3, help="rounds before the simulated restart")
+
+    p_import = sub.add_parser("import", help="onboarding import of an existing Drive: dry run, then apply")
+    p_import.add_argument("--folders", type=int, default=4, help="sub-folders per folder")
+    p_import.add_argument("--depth", type=int, default=3, help="levels of folders below My Drive")
+    p_import.add_argument("--files", type=int, default=400, help="files per listing query")
+    p_import.add_argument("--drive-latency", type=float, default=0.08)
+    p_import.add_argument("--gemini-latency", type=float, default=0.5)
+    p_import.add_argument("--moves-per-second", type=float, default=200)
+    p_import.add_argument("--rate-limit-every", type=int, default=40, help="403 every Nth move (0 = off)")
+
+    p_fulltext = sub.add_parser("fulltext", help="text extraction, FTS5 indexing rate and query latency")
+    p_fulltext.add_argument("--users", type=int, default=5)
+    p_fulltext.add_argument("--docs", type=int, default=500, help="documents per user")
+    p_fulltext.add_argument("--words", type=int, default=1500, help="words per document")
+    p_fulltext.add_argument("--vocab", type=int, default=20000)
+    p_fulltext.add_argument("--queries", type=int, default=500)
+    p_fulltext.add_argument("--extract-repeat", type=int, default=20)
+    p_fulltext.add_argument("--budget-ms", type=float, default=0, help="exit 1 if query p95 is slower (0 = report only)")
+
+    p_semantic = sub.add_parser("semantic", help="hashed TF-IDF ranking: build time, memory, latency, recall")
+    p_semantic.add_argument("--docs", type=int, default=100_000)
+    p_semantic.add_argument("--queries", type=int, default=300)
+    p_semantic.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024])
+    p_semantic.add_argument("--min-recall", type=float, default=0, help="exit 1 if hit@10 is lower (0 = report only)")
+
+    p_duplicates = sub.add_parser("duplicates", help="re-sent files answered with the existing link")
+    p_duplicates.add_argument("--files", type=int, default=200)
+    p_duplicates.add_argument("--distinct", type=int, default=80, help="different documents among them")
+    p_duplicates.add_argument("--drive-latency", type=float, default=0.05)
+    p_duplicates.add_argument("--gemini-latency", type=float, default=0.3)
+
+    p_outbox = sub.add_parser("outbox", help="outbound WhatsApp queue vs direct sends under Meta's rate limit")
+    p_outbox.add_argument("--users", type=int, default=200, help="file pipelines finishing at the same time")
+    p_outbox.add_argument("--meta-mps", type=int, default=80, help="messages/second the stub Graph API accepts")
+    p_outbox.add_argument("--mps", type=float, default=60, help="the outbox's pace (WHATSAPP_MPS)")
+    p_outbox.add_argument("--step-ms", type=float, default=200, help="up to this long between a pipeline's pings")
+    p_outbox.add_argument("--graph-latency", type=float, default=0.05)
+
+    p_fairness = sub.add_parser("fairness", help="per-sender throttling and fair pipeline scheduling under a flood")
+    p_fairness.add_argument("--flood", type=int, default=40, help="files the flooding number sends at once")
+    p_fairness.add_argument("--users", type=int, default=10, help="other users, one file each")
+    p_fairness.add_argument("--user-delay", type=float, default=0.5, help="seconds after the flood they send")
+    p_fairness.add_argument("--drive-latency", type=float, default=0.05)
+    p_fairness.add_argument("--gemini-latency", type=float, default=0.3)
+    p_fairness.add_argument("--timeout", type=float, default=120)
+
+    p_quota = sub.add_parser("quota", help="Drive calls through the quota manager vs direct, over Drive's limit")
+    p_quota.add_argument("--callers", type=int, default=60, help="listings requested at the same time")
+    p_quota.add_argument("--distinct", type=int, default=10, help="different folders among them")
+    p_quota.add_argument("--capacity", type=int, default=4, help="concurrent requests the stub Drive accepts")
+    p_quota.add_argument("--backoff", type=float, default=0.1, help="DRIVE_BACKOFF for the run")
+    p_quota.add_argument("--drive-latency", type=float, default=0.1)
+
+    p_folders = sub.add_parser("folders", help="folder map check and repair after folders change in Drive")
+    p_folders.add_argument("--subjects", type=int, default=8, help="subjects with 5 units each, besides Physics")
+    p_folders.add_argument("--drive-latency", type=float, default=0.05)
+    p_folders.add_argument("--gemini-latency", type=float, default=0.3)
+
+    p_routing = sub.add_parser("routing", help="routing Gemini's subject/unit answers: chained lookups vs table")
+    p_routing.add_argument("--subjects", type=int, default=8)
+    p_routing.add_argument("--cases", type=int, default=200, help="answers per style")
+    p_routing.add_argument("--repeat", type=int, default=20000)
+
+    args = parser.parse_args()
+    if args.bench == "upload":
+        bench_upload(args.size_mb, args.chunk_mb, args.fail_every, args.repeat)
+    elif args.bench == "tracing":
+        bench_tracing(args.calls)
+    elif args.bench == "load":
+        sys.exit(0 if bench_load(args) else 1)
+    elif args.bench == "syllabus":
+        bench_syllabus(args)
+    elif args.bench == "state":
+        sys.exit(0 if bench_state(args) else 1)
+    elif args.bench == "gemini-json":
+        bench_gemini_json(args)
+    elif args.bench == "resort":
+        sys.exit(0 if bench_resort(args) else 1)
+    elif args.bench == "import":
+        sys.exit(0 if bench_import(args) else 1)
+    elif args.bench == "fulltext":
+        sys.exit(0 if bench_fulltext(args) else 1)
+    elif args.bench == "semantic":
+        sys.exit(0 if bench_semantic(args) else 1)
+    elif args.bench == "duplicates":
+        sys.exit(0 if bench_duplicates(args) else 1)
+    elif args.bench == "outbox":
+        sys.exit(0 if bench_outbox(args) else 1)
+    elif args.bench == "fairness":
+        sys.exit(0 if bench_fairness(args) else 1)
+    elif args.bench == "quota":
+        sys.exit(0 if bench_quota(args) else 1)
+    elif args.bench == "folders":
+        sys.exit(0 if bench_folders(args) else 1)
+    elif args.bench == "routing":
+        sys.exit(0 if bench_routing(args) else 1)
+    elif args.bench == "payloads":
+        bench_payloads(args)
+    elif args.bench == "startup":
+        sys.exit(0 if bench_startup(args) else 1)
+    sys.exit(0)
@@ -1,12 +1,27 @@
 import sqlite3
 import json
 import os
+from tracing import traced
 
-DB_NAME = "bot_memory.db"
+# One file per host; every uvicorn worker on it opens the same database
+DB_NAME = os.getenv("DB_PATH", "bot_memory.db")
+BUSY_TIMEOUT_MS = 5000
+
+
+def connect():
+    """
+    Opens the shared database. WAL lets readers in other workers carry on while one
+    writes, and busy_timeout makes concurrent writers wait instead of failing.
+    """
+    conn = sqlite3.connect(DB_NAME, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous = NORMAL")  # Safe with WAL: no fsync per commit, only at checkpoints
+    return conn
 
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect()
+    conn.execute("PRAGMA journal_mode = WAL")  # Persistent: stored in the file itself
     c = conn.cursor()
 
     # 1. Create Table (Standard)
@@ -64,12 +79,79 @@ def init_db():
     if "picture" not in columns:
         c.execute("ALTER TABLE users ADD COLUMN picture TEXT")
 
+    # 3. Parsed syllabi, shared across users (keyed by file content hash)
+    c.execute('''
+              CREATE TABLE IF NOT EXISTS syllabus_cache
+              (
+                  content_hash TEXT PRIMARY KEY,
+                  subjects TEXT,
+                  source TEXT,
+                  parse_seconds REAL,
+                  hits INTEGER DEFAULT 0,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+              )
+              ''')
+
+    # 4. Shared key/value state for all workers (see state_store.py)
+    c.execute('''
+              CREATE TABLE IF NOT EXISTS kv_state
+              (
+                  namespace TEXT,
+                  key TEXT,
+                  value TEXT,
+                  expires_at REAL,
+                  PRIMARY KEY (namespace, key)
+              )
+              ''')
+
+    # 5. Full-text index of uploaded documents (see text_index.py)
+    c.execute('''
+              CREATE TABLE IF NOT EXISTS doc_files
+              (
+                  id INTEGER PRIMARY KEY,
+                  phone TEXT,
+                  file_id TEXT,
+                  folder_id TEXT,
+                  name TEXT,
+                  mime_type TEXT,
+                  link TEXT,
+                  indexed_at REAL,
+                  UNIQUE (phone, file_id)
+              )
+              ''')
+    try:
+        c.execute('''
+                  CREATE VIRTUAL TABLE IF NOT EXISTS doc_text USING fts5
+                  (
+                      phone, name, body,
+                      tokenize = 'porter unicode61 remove_diacritics 2'
+                  )
+                  ''')
+    except sqlite3.OperationalError as e:  # SQLite built without FTS5: search stays name-only
+        print(f"⚠️ Database: full-text index unavailable ({e})")
+
+    # 6. Drive md5Checksums of each user's files, for duplicate uploads (see file_hashes.py)
+    c.execute('''
+              CREATE TABLE IF NOT EXISTS file_hashes
+              (
+                  phone TEXT,
+                  file_id TEXT,
+                  md5 TEXT,
+                  name TEXT,
+                  link TEXT,
+                  seen_at REAL,
+                  PRIMARY KEY (phone, file_id)
+              )
+              ''')
+    c.execute("CREATE INDEX IF NOT EXISTS file_hashes_md5 ON file_hashes (phone, md5)")
+
     conn.commit()
     conn.close()
 
 
+@traced("db")
 def get_user(phone):
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     try:
@@ -84,8 +166,9 @@ def get_user(phone):
 
 
 # --- NEW FUNCTION FOR LOGIN FLOW ---
+@traced("db")
 def get_user_by_email(email):
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     try:
@@ -100,19 +183,20 @@ def get_user_by_email(email):
     return None
 
 
+@traced("db")
 def update_user(phone, key, value):
-    # Ensure user exists before updating
+    # Ensure user exists before updating (OR IGNORE: another worker may have just inserted it)
     if not get_user(phone):
-        conn = sqlite3.connect(DB_NAME)
+        conn = connect()
         c = conn.cursor()
-        c.execute("INSERT INTO users (phone) VALUES (?)", (phone,))
+        c.execute("INSERT OR IGNORE INTO users (phone) VALUES (?)", (phone,))
         conn.commit()
         conn.close()
 
     if isinstance(value, (dict, list)):
         value = json.dumps(value)
 
-    conn = sqlite3.connect(DB_NAME)
+    conn = connect()
     c = conn.cursor()
     try:
         query = f"UPDATE users SET {key} = ? WHERE phone = ?"
@@ -123,4 +207,73 @@ def update_user(phone, key, value):
     finally:
         conn.close()
 
-init_db()
\ No newline at end of file
+
+def json_field(user, key, default=None):
+    """A JSON column (folder_map, temp_syllabus_list, ...) decoded; `default` if empty or invalid."""
+    value = (user or {}).get(key)
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return default
+    return default if value is None else value
+
+
+# --- SYLLABUS CACHE ---
+@traced("db")
+def get_cached_syllabus(content_hash):
+    """Returns the cache row (subjects decoded) and counts the hit, or None."""
+    conn = connect()
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    try:
+        c.execute("SELECT * FROM syllabus_cache WHERE content_hash = ?", (content_hash,))
+        row = c.fetchone()
+        if not row:
+            return None
+        c.execute("UPDATE syllabus_cache SET hits = hits + 1 WHERE content_hash = ?", (content_hash,))
+        conn.commit()
+        entry = dict(row)
+        entry["subjects"] = json.loads(entry["subjects"])
+        return entry
+    except Exception as e:
+        print(f"❌ DB Error: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+@traced("db")
+def save_cached_syllabus(content_hash, subjects, source, parse_seconds):
+    conn = connect()
+    c = conn.cursor()
+    try:
+        c.execute(
+            "INSERT OR REPLACE INTO syllabus_cache (content_hash, subjects, source, parse_seconds) VALUES (?, ?, ?, ?)",
+            (content_hash, json.dumps(subjects), source, parse_seconds)
+        )
+        conn.commit()
+    except Exception as e:
+        print(f"❌ DB Error: {e}")
+    finally:
+        conn.close()
+
+
+@traced("db")
+def syllabus_cache_stats():
+    """Entries, total hits and the Gemini time those hits saved (seconds)."""
+    conn = connect()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * parse_seconds), 0) FROM syllabus_cache")
+        entries, hits, saved = c.fetchone()
+        # Every entry is one miss that went to Gemini; every hit skipped it
+        lookups = entries + hits
+        return {
+            "entries": entries,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "seconds_saved": round(saved, 1),
+        }
+    finally:
+        conn.close()
@@ -0,0 +1,256 @@
+"""
+Opt-in onboarding import: sorts the notes a new user already has in Drive into the
+generated workspace ("Smart Docs - <phone>"). run_import(phone, apply):
+
+1. Walks My Drive breadth-first. Each level's folders are listed PARENTS_PER_QUERY at a
+   time (paged files.list), IMPORT_WORKERS queries in parallel. The workspace itself,
+   folders shared with the user and files owned by someone else are skipped; the walk
+   stops at IMPORT_MAX_FILES files or IMPORT_MAX_DEPTH levels.
+2. Classifies the files with resort_job's helpers: a file-name match first, then one
+   Gemini prompt per IMPORT_BATCH of the names that didn't match.
+3. Dry run (the default): stores the plan, with per-subject counts and sample moves,
+   for the user to review. Nothing in Drive changes.
+4. Apply: moves the planned files (the stored plan if there is one, so Gemini isn't
+   asked twice) with batched files.update calls paced to IMPORT_MOVES_PER_SECOND,
+   checkpointing after every round so an interrupted import resumes where it stopped.
+
+Files nothing matched stay where they are. Jobs live in the state store ("drive_imports").
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import drive_index
+import resort_job
+import search_cache
+import text_index
+from database import get_user, json_field
+from drive_index import PARENTS_PER_QUERY, FOLDER_MIME
+from google_auth import authenticate_drive
+from state_store import get_state_store
+from tracing import traced, count, submit
+
+SHORTCUT_MIME = "application/vnd.google-apps.shortcut"
+
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))  # Listing queries / Gemini batches at once
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "20"))  # File names per Gemini prompt
+IMPORT_MAX_FILES = int(os.getenv("IMPORT_MAX_FILES", "5000"))
+IMPORT_MAX_DEPTH = 10
+# Drive allows only a few sustained writes per second per user; every move is one
+IMPORT_MOVES_PER_SECOND = float(os.getenv("IMPORT_MOVES_PER_SECOND", "3"))
+IMPORT_POOL = ThreadPoolExecutor(max_workers=IMPORT_WORKERS)
+
+IMPORT_JOB_TTL = 7 * 24 * 3600
+IMPORT_LOCK_TTL = 3 * 3600
+IMPORT_PLAN_MAX_AGE = 24 * 3600  # An older dry-run plan is walked again before applying
+PLAN_SAMPLE = 20
+
+
+@traced("drive")
+def list_children(connect, folder_ids):
+    """(folders, files) directly inside folder_ids and owned by the user, each with its "source" parent."""
+    service = connect()  # One client per worker thread: the HTTP layer isn't thread-safe
+    parents = " or ".join(f"'{fid}' in parents" for fid in folder_ids)
+    wanted = set(folder_ids)
+    folders, files, page_token = [], [], None
+    while True:
+        results = service.files().list(
+            q=f"({parents}) and trashed=false and 'me' in owners", pageSize=1000, pageToken=page_token,
+            fields="nextPageToken, files(id, name, mimeType, parents)"
+        ).execute()
+        for item in results.get("files", []):
+            source = next((p for p in item.pop("parents", []) if p in wanted), folder_ids[0])
+            if item.get("mimeType") == FOLDER_MIME:
+                folders.append(item)
+            elif item.get("mimeType") != SHORTCUT_MIME:
+                files.append({**item, "source": source})
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return folders, files
+
+
+def walk_drive(connect, skip_ids, on_level=None):
+    """Every file in My Drive outside skip_ids (at most IMPORT_MAX_FILES). Returns (files, folders scanned)."""
+    seen, level, files, scanned = set(skip_ids), ["root"], {}, 0
+    for _ in range(IMPORT_MAX_DEPTH):
+        chunks = [level[i:i + PARENTS_PER_QUERY] for i in range(0, len(level), PARENTS_PER_QUERY)]
+        futures = [submit(IMPORT_POOL, list_children, connect, chunk) for chunk in chunks]
+        scanned += len(level)
+
+        next_level = []
+        for future in futures:
+            folders, found = future.result()
+            next_level += [f["id"] for f in folders if f["id"] not in seen]
+            for f in found:
+                files.setdefault(f["id"], f)  # A file in two folders is moved once
+        if on_level:
+            on_level(len(files), scanned)
+
+        if len(files) >= IMPORT_MAX_FILES:
+            print(f"⚠️ Import capped at {IMPORT_MAX_FILES} files")
+            break
+        level = list(dict.fromkeys(next_level))
+        seen.update(level)
+        if not level:
+            break
+    return list(files.values())[:IMPORT_MAX_FILES], scanned
+
+
+def classify_files(files, targets):
+    """
+    {file_id: (subject, unit)} for every file that found a home: names are matched locally
+    first, then the leftovers go to Gemini in full IMPORT_BATCH prompts, IMPORT_WORKERS at a time.
+    """
+    placed, leftovers = {}, []
+    for f in files:
+        match = resort_job.local_match(f["name"], targets)
+        if match:
+            placed[f["id"]] = match
+        else:
+            leftovers.append(f)
+    count("resort_files", len(placed), method="local")
+
+    batches = [leftovers[i:i + IMPORT_BATCH] for i in range(0, len(leftovers), IMPORT_BATCH)]
+    futures = [submit(IMPORT_POOL, resort_job.classify_with_gemini, batch, targets) for batch in batches]
+    for batch, future in zip(batches, futures):
+        try:
+            by_gemini = future.result()
+            count("resort_files", len(by_gemini), method="gemini")
+            placed.update(by_gemini)
+        except Exception as e:
+            print(f"⚠️ Import batch failed ({len(batch)} files left in place): {e}")
+    count("resort_files", len(files) - len(placed), method="unsorted")
+    return placed
+
+
+def job_status(phone):
+    """The user's import without its move list, or None."""
+    job = get_state_store().get("drive_imports", phone)
+    if job is None:
+        return None
+    job.pop("moves", None)
+    return job
+
+
+def plan_import(phone, connect, folder_map, root_id, save):
+    """Steps 1-2: walks Drive and classifies. Returns the job with its move list."""
+    targets = resort_job.sort_targets(folder_map)
+    skip_ids = {root_id, *drive_index.folder_owners(folder_map)}
+    job = {"status": "scanning", "files_found": 0, "folders_scanned": 0, "started_at": time.time()}
+    save(job)
+
+    # 1. Walk
+    started = time.perf_counter()
+    files, job["folders_scanned"] = walk_drive(
+        connect, skip_ids, on_level=lambda found, scanned: save({**job, "files_found": found,
+                                                                         "folders_scanned": scanned}))
+    job["files_found"] = len(files)
+    job["scan_seconds"] = round(time.perf_counter() - started, 2)
+
+    # 2. Classify
+    started = time.perf_counter()
+    placed = classify_files(files, targets)
+    moves, by_subject = [], {}
+    for f in files:
+        match = placed.get(f["id"])
+        if not match:
+            continue
+        subject, unit = match
+        target = targets[subject]["units"].get(unit) or targets[subject]["id"]
+        moves.append([f["id"], target, f["source"], f["name"], subject, unit])
+        by_subject[subject] = by_subject.get(subject, 0) + 1
+    job["classify_seconds"] = round(time.perf_counter() - started, 2)
+
+    job.update(status="planned", moves=moves, planned=len(moves), unsorted=len(files) - len(moves),
+               by_subject=by_subject, position=0, moved=0, failed=0,
+               sample=[{"name": m[3], "subject": m[4], "unit": m[5]} for m in moves[:PLAN_SAMPLE]])
+    print(f"🧭 Import plan for {phone}: {len(moves)}/{len(files)} files sortable "
+          f"({job['folders_scanned']} folders, {job['scan_seconds']}s scan)")
+    return job
+
+
+def apply_plan(phone, service, job, save):
+    """
+    Step 4: moves the planned files round by round, saving the position after each.
+    Returns False if it stopped early because the server is shutting down.
+    """
+    job["status"] = "moving"
+    job.setdefault("move_seconds", 0.0)
+    per_round = resort_job.MOVE_BATCH
+    while job["position"] < job["planned"]:
+        if resort_job.SHUTDOWN.is_set():
+            print(f"⏸️ Import for {phone} paused at {job['position']}/{job['planned']} (shutting down)")
+            return False
+        started = time.perf_counter()
+        round_moves = job["moves"][job["position"]:job["position"] + per_round]
+        failed = resort_job.move_files(service, [tuple(m[:3]) for m in round_moves],
+                                       per_second=IMPORT_MOVES_PER_SECOND)
+
+        text_index.update_folders(phone, [(m[0], m[1]) for m in round_moves if m[0] not in failed])
+        drive_index.invalidate(phone)
+        for folder_id in {m[1] for m in round_moves}:
+            search_cache.invalidate_folder(phone, folder_id)
+
+        job["moved"] += len(round_moves) - len(failed)
+        job["failed"] += len(failed)
+        job["position"] += len(round_moves)
+        job["move_seconds"] += time.perf_counter() - started
+        job["files_per_minute"] = round(job["position"] / job["move_seconds"] * 60, 1) if job["move_seconds"] else 0.0
+        save(job)
+        print(f"   🧭 {job['position']}/{job['planned']} | moved {job['moved']} | "
+              f"{job['files_per_minute']:.0f} files/min")
+    return True
+
+
+def run_import(phone, apply=False, connect=None, notify=None):
+    """
+    Plans (and with apply=True, carries out) the import of the user's existing Drive.
+    An unfinished apply resumes; apply reuses a stored plan instead of walking again.
+    notify(phone, job) is called at the end. Returns the job status.
+    """
+    state = get_state_store()
+    if not state.add("import_lock", phone, ttl=IMPORT_LOCK_TTL):
+        print(f"⏳ Import already running for {phone}")
+        return job_status(phone)
+
+    def save(job):
+        state.set("drive_imports", phone, job, ttl=IMPORT_JOB_TTL)
+
+    try:
+        user = get_user(phone)
+        folder_map = json_field(user, "folder_map", {})
+        root_id = user.get("root_folder_id") if user else None
+        if not root_id or not resort_job.sort_targets(folder_map):
+            return None
+
+        connect = connect or (lambda: authenticate_drive(phone))
+        job = state.get("drive_imports", phone)
+        fresh_plan = job and job["status"] == "planned" and time.time() - job["started_at"] < IMPORT_PLAN_MAX_AGE
+        if not (job and job["status"] == "moving") and not (apply and fresh_plan):
+            job = plan_import(phone, connect, folder_map, root_id, save)
+        else:
+            print(f"🧭 Using the stored import plan for {phone} at {job['position']}/{job['planned']}")
+
+        if apply and job["planned"]:
+            if not apply_plan(phone, connect(), job, save):
+                save(job)  # Still "moving": resumes from its position next time
+                return job_status(phone)
+            job.update(status="done", moves=[], finished_at=time.time())
+            count("drive_imports", result="applied")
+        else:
+            count("drive_imports", result="planned")
+        save(job)
+
+        if notify:
+            notify(phone, job_status(phone))
+        return job_status(phone)
+
+    except Exception as e:
+        print(f"❌ Import failed for {phone}: {e}")
+        count("drive_imports", result="failed")
+        job = state.get("drive_imports", phone) or {}
+        if job.get("status") != "moving":  # A half-done apply keeps its checkpoint to resume from
+            save({**job, "status": "failed", "error": str(e)})
+        raise
+
+    finally:
+        state.delete("import_lock", phone)
@@ -0,0 +1,202 @@
+"""
+Cached views of a user's Drive tree, kept in the shared state store:
+
+- the dashboard index: the root folder's listing plus file count and total size for
+  every folder_map entry (subject folder + its units), for INDEX_TTL seconds;
+- folder listings for browsing, for LISTING_TTL seconds. A tree request loads one
+  level per files.list call (many parents per query), and every browse prefetches the
+  listings of the folder's sub-folders in the background, so the next click is a hit.
+
+Both are built with a handful of paged files.list calls instead of one call per folder.
+Anything that adds files or folders calls invalidate(phone). Building the index also
+refreshes the user's md5Checksums for duplicate detection (file_hashes.py).
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import file_hashes
+from state_store import get_state_store
+from tracing import traced, span, count, submit
+
+INDEX_TTL = int(os.getenv("DRIVE_INDEX_TTL", "300"))
+
+# Drive rejects very long `q` strings; 40 "'<id>' in parents" clauses stay well under it
+PARENTS_PER_QUERY = 40
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+LISTING_FIELDS = "id, name, mimeType, webViewLink, iconLink"
+
+LISTING_TTL = int(os.getenv("DRIVE_LISTING_TTL", "120"))
+TREE_MAX_DEPTH = 4
+PREFETCH_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("DRIVE_PREFETCH_WORKERS", "2")))
+
+
+def folder_owners(folder_map):
+    """{folder_id: subject} for every subject folder and unit folder in the map."""
+    owners = {}
+    for subject, entry in folder_map.items():
+        if isinstance(entry, dict):
+            if entry.get("id"):
+                owners[entry["id"]] = subject
+            for unit_id in (entry.get("units") or {}).values():
+                owners[unit_id] = subject
+        elif entry:
+            owners[entry] = subject  # Utility folders are stored as a bare ID
+    return owners
+
+
+def list_folder(service, folder_id):
+    """One folder's children, split into folders and files (folders first, by name)."""
+    with span("drive", "browse.files.list"):
+        results = service.files().list(
+            q=f"'{folder_id}' in parents and trashed=false",
+            fields=f"files({LISTING_FIELDS})",
+            orderBy="folder, name"
+        ).execute()
+
+    folders, files = [], []
+    for item in results.get("files", []):
+        (folders if item["mimeType"] == FOLDER_MIME else files).append(item)
+    return {"folders": folders, "files": files}
+
+
+@traced("drive")
+def list_folders(service, folder_ids):
+    """{folder_id: listing} for many folders, PARENTS_PER_QUERY folders per (paged) files.list call."""
+    listings = {fid: {"folders": [], "files": []} for fid in folder_ids}
+    for start in range(0, len(folder_ids), PARENTS_PER_QUERY):
+        parents = " or ".join(f"'{fid}' in parents" for fid in folder_ids[start:start + PARENTS_PER_QUERY])
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=f"({parents}) and trashed=false", orderBy="folder, name", pageSize=1000, pageToken=page_token,
+                fields=f"nextPageToken, files({LISTING_FIELDS}, parents)"
+            ).execute()
+            for item in results.get("files", []):
+                for parent in item.pop("parents", []):
+                    if parent in listings:
+                        listing = listings[parent]
+                        (listing["folders"] if item["mimeType"] == FOLDER_MIME else listing["files"]).append(item)
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+    return listings
+
+
+def _listing_key(phone, folder_id, generation):
+    return f"{phone}:{generation}:{folder_id}"
+
+
+def load_listings(phone, folder_ids, connect, depth=1):
+    """
+    Listings for folder_ids and their sub-folders down to `depth` levels (1 = just these
+    folders), from the cache where possible. Each level costs at most one batched Drive
+    query for the folders that missed; connect() is only called if something did.
+    """
+    state = get_state_store()
+    generation = state.get("drive_generation", phone, 0)
+    listings, level, service = {}, list(dict.fromkeys(folder_ids)), None
+
+    for _ in range(max(1, min(depth, TREE_MAX_DEPTH))):
+        missing = []
+        for fid in level:
+            cached = state.get("drive_listing", _listing_key(phone, fid, generation))
+            if cached is None:
+                missing.append(fid)
+            else:
+                listings[fid] = cached
+        count("drive_listing_lookups", len(level) - len(missing), result="hit")
+        count("drive_listing_lookups", len(missing), result="miss")
+
+        if missing:
+            service = service or connect()
+            for fid, listing in list_folders(service, missing).items():
+                state.set("drive_listing", _listing_key(phone, fid, generation), listing, ttl=LISTING_TTL)
+                listings[fid] = listing
+
+        level = [f["id"] for fid in level for f in listings[fid]["folders"] if f["id"] not in listings]
+        if not level:
+            break
+    return listings
+
+
+def prefetch_children(phone, listing, connect):
+    """Loads the listings of a folder's sub-folders in the background (the likely next clicks)."""
+    child_ids = [f["id"] for f in listing["folders"]]
+    if child_ids:
+        submit(PREFETCH_POOL, load_listings, phone, child_ids, connect)
+
+
+@traced("drive")
+def subject_stats(service, folder_map, seen=None):
+    """
+    {subject: {"files": n, "bytes": n}} from the files directly inside each subject's folders.
+    Every file listed is also appended to `seen` if given.
+    """
+    owners = folder_owners(folder_map)
+    stats = {subject: {"files": 0, "bytes": 0} for subject in folder_map}
+    folder_ids = list(owners)
+
+    for start in range(0, len(folder_ids), PARENTS_PER_QUERY):
+        parents = " or ".join(f"'{fid}' in parents" for fid in folder_ids[start:start + PARENTS_PER_QUERY])
+        query = f"({parents}) and trashed=false and mimeType != '{FOLDER_MIME}'"
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=query, pageSize=1000, pageToken=page_token,
+                fields="nextPageToken, files(id, name, mimeType, parents, size, md5Checksum, webViewLink)"
+            ).execute()
+            for item in results.get("files", []):
+                if item.get("mimeType") == FOLDER_MIME:
+                    continue
+                if seen is not None:
+                    seen.append(item)
+                subject = next((owners[p] for p in item.get("parents", []) if p in owners), None)
+                if subject is not None:
+                    stats[subject]["files"] += 1
+                    stats[subject]["bytes"] += int(item.get("size", 0))  # Google Docs have no size
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+    return stats
+
+
+def get_index(phone, root_folder_id, folder_map, connect):
+    """
+    The cached index for this user, or a fresh one. connect() returns a Drive service
+    and is only called on a miss, so a warm dashboard makes no Drive calls at all.
+    """
+    state = get_state_store()
+    index = state.get("drive_index", phone)
+    if index is not None:
+        count("drive_index_lookups", result="hit")
+        return index
+    count("drive_index_lookups", result="miss")
+
+    service = connect()
+    started, seen = time.time(), []
+    index = {
+        "root": list_folder(service, root_folder_id) if root_folder_id else {"folders": [], "files": []},
+        "subjects": subject_stats(service, folder_map, seen),
+        "built_at": time.time(),
+    }
+    state.set("drive_index", phone, index, ttl=INDEX_TTL)
+    file_hashes.replace_all(phone, seen, started)
+    return index
+
+
+def sync_checksums(phone, folder_map, connect):
+    """Sync for file_hashes: re-reads the user's md5Checksums unless an index build did so recently."""
+    if not file_hashes.needs_sync(phone):
+        return
+    started, seen = time.time(), []
+    subject_stats(connect(), folder_map, seen)
+    file_hashes.replace_all(phone, seen, started)
+
+
+def invalidate(phone):
+    """Drops the user's index and folder listings; the next load rebuilds them."""
+    state = get_state_store()
+    state.delete("drive_index", phone)
+    # Listings are keyed by generation: a new one orphans all of them (they expire on their own)
+    state.set("drive_generation", phone, state.get("drive_generation", phone, 0) + 1)
@@ -0,0 +1,228 @@
+"""
+One executor for every Drive API call. Clients built by google_auth.build_drive_service
+create QuotaHttpRequest objects, so each `.execute()` in the codebase (folder creation,
+browse listings, search, uploads, the duplicate check, ...) goes through run():
+
+1. Coalescing: identical GET requests (same user, same URL) already in flight are not
+   sent again; callers share the first one's answer (each gets its own copy). Clients
+   built without a user never coalesce: they could belong to different users.
+2. Concurrency: at most DRIVE_USER_CONCURRENCY requests per user and DRIVE_CONCURRENCY
+   overall are in flight. Both limits adapt AIMD-style: a rate-limit reply halves the
+   limit it hit (userRateLimitExceeded -> that user's, anything else -> the global one;
+   once per round: calls sent before the cut don't cut it again), every success adds
+   1/limit back, up to the configured maximum.
+3. Retries: rate limits (403 rateLimitExceeded / userRateLimitExceeded, 429) and 5xx
+   are retried DRIVE_RETRIES times with exponential backoff and jitter, instead of
+   reaching the user as an error.
+
+Resumable upload chunks (next_chunk) keep their own resume logic in upload_to_drive
+and batch requests (resort_job.move_files) their own retries; both still take a slot.
+
+Metrics: docs_manager_drive_calls_total{op} (requests sent to Drive, i.e. quota used),
+docs_manager_drive_requests_total{op, result}, docs_manager_drive_rate_limited_total{op},
+the drive_concurrency_limit / drive_in_flight gauges and the "drive_quota" wait histogram.
+"""
+import os
+import copy
+import time
+import random
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from tracing import observe, count, gauge
+
+DRIVE_CONCURRENCY = int(os.getenv("DRIVE_CONCURRENCY", "32"))
+DRIVE_USER_CONCURRENCY = int(os.getenv("DRIVE_USER_CONCURRENCY", "6"))
+DRIVE_RETRIES = int(os.getenv("DRIVE_RETRIES", "5"))
+DRIVE_BACKOFF = float(os.getenv("DRIVE_BACKOFF", "0.5"))  # Seconds before the first retry; doubles each time
+DRIVE_BACKOFF_MAX = 30.0
+
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+RETRYABLE_STATUS = {500, 502, 503, 504}
+
+
+def _content(error):
+    content = getattr(error, "content", b"") or b""
+    return content.decode("utf-8", "replace") if isinstance(content, bytes) else content
+
+
+def is_rate_limited(error):
+    """A Drive 429, or a 403 whose reason is a rate limit (other 403s are permission errors)."""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return status == 429 or (status == 403 and any(reason in _content(error) for reason in RATE_LIMIT_REASONS))
+
+
+class AdaptiveLimiter:
+    """A concurrency limit between 1 and `maximum` that halves on rate limits and creeps back on success."""
+
+    def __init__(self, maximum, scope):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.scope = scope
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Waits for a free slot. Returns when it got it (pass that to release)."""
+        with self.cond:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.cond.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, acquired_at, rate_limited=False):
+        with self.cond:
+            self.in_flight -= 1
+            if rate_limited:
+                # Calls sent before the last cut were sent at the old limit: one cut covers them all
+                if acquired_at >= self.last_decrease:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = time.monotonic()
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+_global = AdaptiveLimiter(DRIVE_CONCURRENCY, "global")
+_users = {}  # phone -> AdaptiveLimiter
+_users_lock = threading.Lock()
+_in_flight_calls = {}  # coalescing key -> _Shared
+_in_flight_lock = threading.Lock()
+
+
+def _user_limiter(user):
+    with _users_lock:
+        limiter = _users.get(user)
+        if limiter is None:
+            limiter = _users[user] = AdaptiveLimiter(DRIVE_USER_CONCURRENCY, "user")
+        return limiter
+
+
+def _gauges():
+    gauge("drive_concurrency_limit", round(_global.limit, 2), scope="global")
+    gauge("drive_in_flight", _global.in_flight)
+
+
+@contextmanager
+def slot(user=None):
+    """Holds a per-user and a global slot. Yields a list; append "user" or "global" to it if Drive rate-limited the call."""
+    started = time.perf_counter()
+    user_limiter = _user_limiter(user) if user else None
+    user_acquired = user_limiter.acquire() if user_limiter else None
+    global_acquired = _global.acquire()
+    observe("drive_quota", "wait", time.perf_counter() - started)
+    _gauges()
+    outcome = []
+    try:
+        yield outcome
+    finally:
+        limited = outcome[-1] if outcome else None  # None, "user" or "global"
+        _global.release(global_acquired, limited == "global")
+        if user_limiter:
+            user_limiter.release(user_acquired, limited == "user")
+        _gauges()
+
+
+def limited_scope(error):
+    """Which limit a rate-limit error is about: "user" or "global"."""
+    return "user" if "userRateLimitExceeded" in _content(error) else "global"
+
+
+class _Shared:
+    """The result (or error) of a coalesced call, for the callers waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def run(user, op, send, coalesce_key=None):
+    """
+    send() with coalescing, concurrency limits and retries. `op` is the Drive method
+    ID (e.g. "drive.files.list") for the metrics.
+    """
+    if coalesce_key is not None:
+        with _in_flight_lock:
+            shared = _in_flight_calls.get(coalesce_key)
+            leader = shared is None
+            if leader:
+                shared = _in_flight_calls[coalesce_key] = _Shared()
+        if not leader:
+            shared.done.wait()
+            count("drive_requests", op=op, result="coalesced")
+            if shared.error is not None:
+                raise shared.error
+            return copy.deepcopy(shared.result)  # Callers edit listings in place
+        try:
+            shared.result = _send_with_retries(user, op, send)
+            return copy.deepcopy(shared.result)
+        except Exception as e:
+            shared.error = e
+            raise
+        finally:
+            with _in_flight_lock:
+                del _in_flight_calls[coalesce_key]
+            shared.done.set()
+    return _send_with_retries(user, op, send)
+
+
+def _send_with_retries(user, op, send):
+    from googleapiclient.errors import HttpError
+    for attempt in range(DRIVE_RETRIES + 1):
+        with slot(user) as outcome:
+            count("drive_calls", op=op)
+            try:
+                result = send()
+                count("drive_requests", op=op, result="ok")
+                return result
+            except HttpError as e:
+                rate_limited = is_rate_limited(e)
+                retryable = rate_limited or e.resp.status in RETRYABLE_STATUS
+                if rate_limited:
+                    outcome.append(limited_scope(e))
+                    count("drive_rate_limited", op=op)
+                if not retryable or attempt == DRIVE_RETRIES:
+                    count("drive_requests", op=op, result="rate_limited" if rate_limited else "error")
+                    raise
+        # Slots are given back while waiting
+        count("drive_requests", op=op, result="retried")
+        delay = min(DRIVE_BACKOFF * 2 ** attempt, DRIVE_BACKOFF_MAX)
+        time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+@lru_cache(maxsize=None)
+def request_class():
+    """QuotaHttpRequest, defined on first use (googleapiclient is slow to import)."""
+    from googleapiclient.http import HttpRequest
+
+    class QuotaHttpRequest(HttpRequest):
+        """HttpRequest whose execute() goes through run()."""
+
+        def __init__(self, *args, quota_user=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.quota_user = quota_user
+
+        def execute(self, http=None, num_retries=0):
+            if self.resumable:  # Goes through next_chunk, which takes the slot
+                return super().execute(http=http, num_retries=num_retries)
+            # run() does the retrying (num_retries would retry behind the limiter's back)
+            send = lambda: super(QuotaHttpRequest, self).execute(http=http)
+            # Only one user's own clients share answers; a client without a user shares with nobody
+            key = (self.quota_user, self.uri) if self.method == "GET" and self.quota_user else None
+            return run(self.quota_user, self.methodId or "drive", send, coalesce_key=key)
+
+        def next_chunk(self, http=None, num_retries=0):
+            with slot(self.quota_user):
+                count("drive_calls", op="drive.upload.chunk")
+                return super().next_chunk(http=http, num_retries=num_retries)
+
+    return QuotaHttpRequest
+
+
+def request_builder(user):
+    """The requestBuilder for a Drive client acting for `user` (a phone number, or None)."""
+    def build(*args, **kwargs):
+        return request_class()(*args, quota_user=user, **kwargs)
+    return build
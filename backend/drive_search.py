@@ -1,10 +1,46 @@
+import text_index
+import semantic_index
 from google_auth import authenticate_drive
+from tracing import traced
+
+# Enough for a few "more" pages on WhatsApp (5 per message) from a single Drive call
+SEARCH_LIMIT = 25
+
+
+def merge_hits(name_matches, *ranked_matches, limit=SEARCH_LIMIT):
+    """
+    Drive's name matches first, then each local ranking's files in order (full-text, then
+    semantic); snippets from the full-text hits are kept either way.
+    """
+    snippets = {f["id"]: f["snippet"] for hits in ranked_matches for f in hits if f.get("snippet")}
+    merged = {f["id"]: {**f, "snippet": snippets[f["id"]]} if f["id"] in snippets else f for f in name_matches}
+    for hits in ranked_matches:
+        for f in hits:
+            merged.setdefault(f["id"], f)
+    return list(merged.values())[:limit]
+
+
+def local_matches(phone_number, query_text, folder_id=None):
+    """Full-text hits, then files that are merely similar to the query (no Drive calls)."""
+    return (text_index.search(phone_number, query_text, folder_id),
+            semantic_index.search(phone_number, query_text, folder_id))
 
 
 def search_drive_files(phone_number, query_text, folder_id=None):
+    """Matching files only (see search_drive)."""
+    return search_drive(phone_number, query_text, folder_id)[0]
+
+
+@traced("drive")
+def search_drive(phone_number, query_text, folder_id=None, limit=SEARCH_LIMIT):
     """
     Searches for files matching ALL keywords in the query, regardless of order.
     Example: "Adhar Saini" -> Finds "Important Documents_Aadhar Card_Aryavansh Saini.pdf"
+    Files whose contents match (text_index) or that rank as similar (semantic_index) are
+    added after the name matches; both are local.
+
+    Returns (files, scope): scope is folder_id when the matches came from that folder,
+    "global" when they came from the whole Drive (search_cache invalidates by it).
     """
     try:
         # 1. Authenticate
@@ -23,7 +59,7 @@ def search_drive_files(phone_number, query_text, folder_id=None):
 
         if not keywords:
             print("⚠️ Query is empty after cleaning.")
-            return []
+            return [], "global"
 
         # 4. Build Dynamic Query
         # We want: (name contains 'word1') AND (name contains 'word2') ...
@@ -55,28 +91,29 @@ def search_drive_files(phone_number, query_text, folder_id=None):
 
             results = service.files().list(
                 q=q_specific,
-                pageSize=5,
+                pageSize=limit,
                 fields="files(id, name, webViewLink, mimeType)"
             ).execute()
 
-            files = results.get('files', [])
+            files = merge_hits(results.get('files', []), *local_matches(phone_number, query_text, folder_id),
+                               limit=limit)
             if files:
                 print(f"   ✅ Found {len(files)} matches in '{folder_name_log}'.")
-                return files
+                return files, folder_id
 
         # 7. ATTEMPT 2: Global Search (Fallback)
         print("   👉 Global Fallback Search...")
         results_global = service.files().list(
             q=q_base,
-            pageSize=10,
+            pageSize=limit,
             fields="files(id, name, webViewLink, mimeType)"
         ).execute()
 
-        files = results_global.get('files', [])
+        files = merge_hits(results_global.get('files', []), *local_matches(phone_number, query_text), limit=limit)
         print(f"   ✅ Found {len(files)} matches globally.")
 
-        return files
+        return files, "global"
 
     except Exception as e:
         print(f"❌ SEARCH ERROR: {e}")
-        return []
\ No newline at end of file
+        return [], None  # Not cached: the next attempt searches again
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+Duplicate-upload detection: users resend the same PDFs, and every copy used to become
+another Drive file.
+
+Drive reports an md5Checksum for every uploaded (non-Google-Docs) file. We keep a
+per-user table of them (file_hashes, created in database.init_db), fed from two places:
+
+- sync: every dashboard index build already lists all files in the user's subject and
+  unit folders (drive_index.subject_stats); the same calls return their checksums;
+- our own uploads, recorded as soon as they're saved.
+
+Before uploading, the pipeline hashes the local file and calls find_duplicate(). A hit
+is checked with one files.get (it may have been trashed or deleted in Drive since) and
+the user gets the existing file's link instead of a second copy.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+from database import connect
+from payloads import FILE_LINK
+from state_store import get_state_store
+from tracing import traced, count
+
+# How often a user's checksums are re-read from Drive when nothing else rebuilt the index
+CHECKSUM_SYNC_TTL = int(os.getenv("CHECKSUM_SYNC_TTL", str(6 * 3600)))
+
+
+def file_md5(file_path):
+    """Hex md5 of a local file, the same digest Drive reports as md5Checksum."""
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@traced("db")
+def record(phone, file_id, md5, name, link=None):
+    """Remembers one of our own uploads."""
+    conn = connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (phone, file_id, md5, name, link, seen_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (phone, file_id, md5, name, link or FILE_LINK.format(id=file_id), time.time())
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"❌ Checksum Error: {e}")
+    finally:
+        conn.close()
+
+
+@traced("db")
+def replace_all(phone, files, started):
+    """
+    Sync: files = files.list items (id, name, md5Checksum, webViewLink) listed since `started`.
+    Rows seen before the listing began and missing from it are gone from the workspace;
+    uploads recorded while it ran are kept.
+    """
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM file_hashes WHERE phone = ? AND seen_at < ?", (phone, started))
+        conn.executemany(
+            "INSERT OR REPLACE INTO file_hashes (phone, file_id, md5, name, link, seen_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(phone, f["id"], f["md5Checksum"], f.get("name"), f.get("webViewLink") or FILE_LINK.format(id=f["id"]),
+              started) for f in files if f.get("md5Checksum")]
+        )
+        conn.commit()
+        get_state_store().set("checksum_sync", phone, started, ttl=CHECKSUM_SYNC_TTL)
+    except sqlite3.Error as e:
+        print(f"❌ Checksum Error: {e}")
+    finally:
+        conn.close()
+
+
+def needs_sync(phone):
+    """True if the user's checksums haven't been read from Drive within CHECKSUM_SYNC_TTL."""
+    return get_state_store().get("checksum_sync", phone) is None
+
+
+def forget(phone, file_id):
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM file_hashes WHERE phone = ? AND file_id = ?", (phone, file_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@traced("db")
+def candidates(phone, md5):
+    """[(file_id, name, link)] of the user's files with this checksum, newest first."""
+    conn = connect()
+    try:
+        return conn.execute(
+            "SELECT file_id, name, link FROM file_hashes WHERE phone = ? AND md5 = ? ORDER BY seen_at DESC",
+            (phone, md5)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def find_duplicate(phone, md5, connect_drive):
+    """
+    {"id", "name", "webViewLink"} of a live Drive file with this checksum, or None.
+    connect_drive() is only called if the table has a candidate to check. If Drive can't
+    be asked, the file counts as new: a second copy beats a lost upload.
+    """
+    rows = candidates(phone, md5)
+    if not rows:
+        count("duplicate_checks", result="new")
+        return None
+
+    from googleapiclient.errors import HttpError
+    try:
+        service = connect_drive()
+    except Exception as e:
+        print(f"⚠️ Duplicate check skipped: {e}")
+        return None
+    for file_id, name, link in rows:
+        try:
+            item = service.files().get(fileId=file_id, fields="id, name, trashed, md5Checksum, webViewLink").execute()
+        except HttpError as e:
+            if e.resp.status != 404:
+                print(f"⚠️ Duplicate check skipped: {e}")
+                return None
+            item = None
+        if item and not item.get("trashed") and item.get("md5Checksum") == md5:
+            count("duplicate_checks", result="duplicate")
+            return {"id": item["id"], "name": item.get("name") or name, "webViewLink": item.get("webViewLink") or link}
+        forget(phone, file_id)  # Trashed, deleted or overwritten since we saw it
+
+    count("duplicate_checks", result="stale")
+    return None
@@ -1,7 +1,9 @@
 # Import the function from our new file
 from google_auth import authenticate_drive
+from tracing import traced
 
 
+@traced("drive")
 def create_folder(service, name, parent_id=None):
     """Creates a folder and returns its ID."""
     file_metadata = {
@@ -16,6 +18,7 @@ def create_folder(service, name, parent_id=None):
     return file.get('id')
 
 
+@traced("drive")
 def build_drive_structure(user_phone, syllabus_list):
     # 1. Authenticate (Pass the user_phone so we get the correct token!)
     service = authenticate_drive(user_phone)
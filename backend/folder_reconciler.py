@@ -0,0 +1,249 @@
+"""
+Keeps a user's folder_map in line with their Drive. If they rename, trash or delete a
+subject/unit folder, the map still points at the old ID and the next upload only fails
+at the end, after the Gemini call and the upload itself.
+
+reconcile(phone) checks every ID in the map (plus the workspace root) with batched
+files.get calls, BATCH_SIZE per HTTP request, then repairs the map:
+
+- renamed: the ID is alive under a new name; the map (and the syllabus) take the new name;
+- re-linked: the ID is gone, but its parent has a live folder with the old name (the user
+  deleted it and made a new one): the map points at that one;
+- recreated: nothing to link to; the folder is created again (a subject's units with it).
+
+IDs the check couldn't answer for (rate limits, 5xx) are left alone. A clean (or repaired)
+map is stamped "verified" in the state store for FOLDER_MAP_VERIFY_TTL; while the stamp
+matches the map, hot paths use the IDs without asking Drive. Any other write to the map
+changes its digest and so drops the stamp.
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import drive_index
+import drive_quota
+import search_cache
+from database import get_user, update_user, json_field
+from drive_index import FOLDER_MIME
+from folder_creator import create_folder
+from google_auth import authenticate_drive
+from state_store import get_state_store
+from tracing import traced, span, count, submit
+
+FOLDER_MAP_VERIFY_TTL = int(os.getenv("FOLDER_MAP_VERIFY_TTL", str(6 * 3600)))
+BATCH_SIZE = 100  # Drive's limit of calls per batch request
+RECONCILE_LOCK_TTL = 300
+RECONCILE_POOL = ThreadPoolExecutor(max_workers=2)
+
+
+def _digest(root_id, folder_map):
+    return hashlib.sha1(json.dumps([root_id, folder_map], sort_keys=True).encode()).hexdigest()
+
+
+def is_verified(phone, root_id, folder_map):
+    """True if this exact map was checked against Drive within FOLDER_MAP_VERIFY_TTL."""
+    return get_state_store().get("folder_map_verified", phone) == _digest(root_id, folder_map)
+
+
+def _entries(folder_map):
+    """[(subject, unit or None, folder_id)] for every folder in the map."""
+    entries = []
+    for subject, entry in folder_map.items():
+        if isinstance(entry, dict):
+            entries.append((subject, None, entry.get("id")))
+            entries += [(subject, unit, unit_id) for unit, unit_id in (entry.get("units") or {}).items()]
+        else:
+            entries.append((subject, None, entry))  # Utility folders are stored as a bare ID
+    return [e for e in entries if e[2]]
+
+
+@traced("drive")
+def fetch_folders(service, folder_ids):
+    """
+    {folder_id: {"id", "name", "trashed", "mimeType"} or None (404)} from batched files.get.
+    IDs whose check failed for another reason are left out.
+    """
+    found, scopes = {}, []
+
+    def on_reply(request_id, response, exception):
+        if exception is None:
+            found[request_id] = response
+        elif getattr(getattr(exception, "resp", None), "status", None) == 404:
+            found[request_id] = None
+        else:
+            if drive_quota.is_rate_limited(exception):
+                scopes.append(drive_quota.limited_scope(exception))
+            print(f"⚠️ Folder check failed for {request_id}: {exception}")
+
+    ids = list(dict.fromkeys(folder_ids))
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch, user = service.new_batch_http_request(callback=on_reply), None
+        for folder_id in ids[start:start + BATCH_SIZE]:
+            request = service.files().get(fileId=folder_id, fields="id, name, trashed, mimeType")
+            user = getattr(request, "quota_user", None)
+            batch.add(request, request_id=folder_id)
+        scopes.clear()
+        with span("drive", "folders.batch_get"), drive_quota.slot(user) as outcome:
+            count("drive_calls", op="drive.batch")
+            batch.execute()
+            outcome.extend(scopes[-1:])
+    return found
+
+
+def _alive(item):
+    return bool(item) and not item.get("trashed") and item.get("mimeType", FOLDER_MIME) == FOLDER_MIME
+
+
+def _rename_key(mapping, old, new):
+    """A copy of dict `mapping` with key old renamed to new, in the same position."""
+    return {new if key == old else key: value for key, value in mapping.items()}
+
+
+def repair(service, phone, root_id, folder_map, syllabus, found):
+    """
+    Applies renames, re-links and re-creations to copies of the map and syllabus.
+    Returns (root_id, folder_map, syllabus, [(kind, path, old_id, new_id)]).
+    """
+    folder_map = json.loads(json.dumps(folder_map))
+    syllabus = json.loads(json.dumps(syllabus))
+    changes = []
+
+    # 1. The workspace root: without it there is nowhere to stage uploads
+    if root_id and root_id in found and not _alive(found[root_id]):
+        new_root = create_folder(service, f"Smart Docs - {phone}")
+        changes.append(("recreated", "(root)", root_id, new_root))
+        root_id = new_root
+
+    def dead(folder_id):
+        return folder_id in found and not _alive(found[folder_id])
+
+    def listings(parent_ids):
+        """{parent_id: {lowercase name: folder_id}} of the live sub-folders, one batched files.list."""
+        parent_ids = list(dict.fromkeys(p for p in parent_ids if p))
+        if not parent_ids:
+            return {}
+        return {pid: {f["name"].lower(): f["id"] for f in listing["folders"]}
+                for pid, listing in drive_index.list_folders(service, parent_ids).items()}
+
+    taken = {e[2] for e in _entries(folder_map)}
+
+    def relink_or_create(name, parent_id, children, old_id, path):
+        """A live replacement for old_id: a same-named sibling we don't use yet, or a new folder."""
+        new_id = children.get(name.lower())
+        kind = "relinked"
+        if not new_id or new_id in taken:
+            new_id, kind = create_folder(service, name, parent_id=parent_id), "recreated"
+        taken.add(new_id)
+        changes.append((kind, path, old_id, new_id))
+        return new_id
+
+    # 2. Subjects (and utility folders)
+    lost_subject = any(dead(folder_id) for _, unit, folder_id in _entries(folder_map) if unit is None)
+    root_children = listings([root_id]).get(root_id, {}) if lost_subject and root_id else {}
+    fresh_subjects = set()
+    for subject in list(folder_map):
+        entry = folder_map[subject]
+        folder_id = entry.get("id") if isinstance(entry, dict) else entry
+        if not folder_id:
+            continue
+        if dead(folder_id):
+            new_id = relink_or_create(subject, root_id, root_children, folder_id, subject)
+            if changes[-1][0] == "recreated":
+                fresh_subjects.add(subject)
+            if isinstance(entry, dict):
+                entry["id"] = new_id
+            else:
+                folder_map[subject] = new_id
+            continue
+        name = (found.get(folder_id) or {}).get("name")
+        if name and name != subject and name not in folder_map:
+            changes.append(("renamed", f"{subject} -> {name}", folder_id, folder_id))
+            folder_map = _rename_key(folder_map, subject, name)
+            if subject in syllabus:
+                syllabus = _rename_key(syllabus, subject, name)
+
+    # 3. Units, with one listing for every subject that lost one (new subject folders are empty)
+    dead_units = [(s, u) for s, entry in folder_map.items() if isinstance(entry, dict)
+                  for u, uid in (entry.get("units") or {}).items() if dead(uid) or s in fresh_subjects]
+    subject_children = listings([folder_map[s]["id"] for s, _ in dead_units if s not in fresh_subjects])
+    for subject, unit in dead_units:
+        entry = folder_map[subject]
+        old_id = entry["units"][unit]
+        children = subject_children.get(entry["id"], {})
+        entry["units"][unit] = relink_or_create(unit, entry["id"], children, old_id, f"{subject} > {unit}")
+    for subject, entry in folder_map.items():
+        if not isinstance(entry, dict):
+            continue
+        for unit, unit_id in list((entry.get("units") or {}).items()):
+            name = (found.get(unit_id) or {}).get("name")
+            if name and name != unit and name not in entry["units"] and _alive(found.get(unit_id)):
+                changes.append(("renamed", f"{subject} > {unit} -> {name}", unit_id, unit_id))
+                entry["units"] = _rename_key(entry["units"], unit, name)
+                units = syllabus.get(subject)
+                if isinstance(units, list) and unit in units:
+                    units[units.index(unit)] = name
+    return root_id, folder_map, syllabus, changes
+
+
+def reconcile(phone, connect=None):
+    """
+    Checks the user's folder_map against Drive and saves a repaired one if needed.
+    Returns the (possibly repaired) map, or None if the check couldn't run.
+    """
+    state = get_state_store()
+    if not state.add("folder_map_lock", phone, ttl=RECONCILE_LOCK_TTL):
+        count("folder_map_checks", result="busy")
+        return None  # Another worker is on it
+    try:
+        user = get_user(phone) or {}
+        root_id, folder_map = user.get("root_folder_id"), json_field(user, "folder_map", {})
+        syllabus = json_field(user, "temp_syllabus_list", {})
+        if not folder_map:
+            return folder_map
+
+        service = (connect or (lambda: authenticate_drive(phone)))()
+        folder_ids = [fid for fid in [root_id] + [e[2] for e in _entries(folder_map)] if fid]
+        found = fetch_folders(service, folder_ids)
+        new_root, new_map, new_syllabus, changes = repair(service, phone, root_id, folder_map, syllabus, found)
+
+        if changes:
+            # Saved only if nothing else rewrote the map meanwhile (e.g. new subjects were added)
+            current = get_user(phone) or {}
+            if _digest(current.get("root_folder_id"), json_field(current, "folder_map", {})) != _digest(root_id, folder_map):
+                count("folder_map_checks", result="conflict")
+                return json_field(current, "folder_map", {})
+            update_user(phone, "folder_map", new_map)
+            if new_syllabus != syllabus:
+                update_user(phone, "temp_syllabus_list", new_syllabus)
+            if new_root != root_id:
+                update_user(phone, "root_folder_id", new_root)
+            drive_index.invalidate(phone)
+            for kind, path, old_id, new_id in changes:
+                count("folder_map_repairs", kind=kind)
+                if old_id and old_id != new_id:
+                    search_cache.invalidate_folder(phone, old_id)
+                print(f"🩹 Folder map {phone}: {kind} {path} ({old_id} -> {new_id})")
+
+        # IDs the check couldn't answer for stay unverified: the next hot path tries again
+        if len(found) == len(set(folder_ids)):
+            state.set("folder_map_verified", phone, _digest(new_root, new_map), ttl=FOLDER_MAP_VERIFY_TTL)
+        count("folder_map_checks", result="repaired" if changes else "ok")
+        return new_map
+    except Exception as e:
+        print(f"⚠️ Folder map check failed for {phone}: {e}")
+        count("folder_map_checks", result="error")
+        return None
+    finally:
+        state.delete("folder_map_lock", phone)
+
+
+def verify_async(phone, user, connect=None):
+    """
+    None if the user's map is verified (use it as is), else a Future of reconcile(), started
+    in the background. Callers that need the IDs take .result() as late as possible.
+    """
+    root_id, folder_map = user.get("root_folder_id"), json_field(user, "folder_map", {})
+    if not folder_map or is_verified(phone, root_id, folder_map):
+        count("folder_map_checks", result="cached")
+        return None
+    return submit(RECONCILE_POOL, reconcile, phone, connect)
@@ -0,0 +1,189 @@
+"""
+Structured (JSON) replies from Gemini, shared by the sorter, the search intent
+parser and the syllabus parser.
+
+- Every call sends a response schema, so the model is constrained to our shape.
+- Replies are streamed and decoded incrementally: each top-level field is handed
+  to on_field() as soon as its value is complete, before the rest arrives.
+- A reply that still doesn't parse (fences, prose, cut off mid-way) is repaired
+  locally by keeping every complete field; only missing required fields trigger
+  a retry (even in a reply that parsed), and the retry keeps what the first
+  attempt already got.
+
+Outcomes are counted as docs_manager_gemini_json_total{call,result}
+(result = ok / repaired / retried / failed).
+"""
+import os
+import json
+import time
+import threading
+from tracing import span, observe, count
+
+MODEL_NAME = "gemini-2.5-flash"
+
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def load_genai():
+    """
+    google.generativeai, imported and configured on first use. The import alone is
+    about half of the app's cold start, and most requests never touch Gemini.
+    """
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("❌ Missing GEMINI_API_KEY in .env file")
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+            _genai = genai
+    return _genai
+
+
+class GeminiJSONError(ValueError):
+    """The reply couldn't be decoded into the required fields, even after retrying."""
+
+
+class FieldStream:
+    """
+    Incremental decoder for one streamed JSON object.
+    feed() takes the next piece of text and returns the top-level fields completed by it.
+    Anything before the first "{" (```json fences, prose) and after the matching "}" is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.closed = False
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, piece):
+        self.text += piece
+        completed = {}
+        text = self.text
+        while self._pos < len(text) and not self.closed:
+            ch = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif not self._stack:
+                if ch == "{":
+                    self._stack.append(ch)
+                    self._member_start = self._pos + 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    completed.update(self._close_member(self._pos))
+                    self.closed = True
+            elif ch == "," and len(self._stack) == 1:
+                completed.update(self._close_member(self._pos))
+                self._member_start = self._pos + 1
+            self._pos += 1
+        self.fields.update(completed)
+        return completed
+
+    def _close_member(self, end):
+        member = self.text[self._member_start:end].strip()
+        if not member:
+            return {}
+        try:
+            return json.loads("{" + member + "}")
+        except ValueError:
+            return {}  # A malformed member is dropped; its neighbours still count
+
+
+def _parse_whole(text):
+    """The full reply as JSON (fences stripped), or None."""
+    text = text.replace("```json", "").replace("```", "").strip()
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _chunk_text(chunk):
+    # chunk.text raises on chunks without parts (e.g. the final finish_reason-only chunk)
+    return "".join(part.text for candidate in chunk.candidates[:1] for part in candidate.content.parts)
+
+
+def _stream_once(model, contents, schema, call, on_field):
+    """One streamed request. Returns (parsed or None, fields decoded so far)."""
+    config = {"response_mime_type": "application/json", "response_schema": schema}
+    decoder = FieldStream()
+    started = time.perf_counter()
+    first_field = True
+
+    response = model.generate_content(contents, generation_config=config, stream=True)
+    for chunk in response:
+        for key, value in decoder.feed(_chunk_text(chunk)).items():
+            if first_field:
+                observe("gemini", f"{call}.first_field", time.perf_counter() - started)
+                first_field = False
+            if on_field and on_field(key, value):
+                # The caller has what it needs: stop reading the rest of the reply
+                return dict(decoder.fields), decoder.fields
+
+    return _parse_whole(decoder.text), decoder.fields
+
+
+def generate_json(contents, schema, call, required=(), on_field=None, retries=1, model=None):
+    """
+    Streams `contents` through Gemini constrained to `schema` and returns the decoded dict.
+
+    call     -- short name for metrics and logs ("sort", "search_intent", "syllabus")
+    required -- top-level fields that must be present; missing ones are re-requested
+    on_field -- on_field(key, value) for each top-level field as it completes; return True
+                to stop early and use the fields received so far
+    Raises GeminiJSONError when the required fields still aren't there after `retries`.
+    """
+    model = model or load_genai().GenerativeModel(MODEL_NAME)
+    contents = contents if isinstance(contents, list) else [contents]
+    result = {}
+
+    for attempt in range(retries + 1):
+        prompt = contents
+        if attempt:
+            missing = [key for key in required if key not in result]
+            prompt = contents + [
+                f"Your previous reply was not valid JSON or left out fields. Return the full JSON again; "
+                f"it must include: {', '.join(missing)}."
+            ]
+
+        with span("gemini", f"{call}.generate"):
+            parsed, fields = _stream_once(model, prompt, schema, call, on_field)
+
+        if parsed is not None:
+            # A retry only fills what the earlier attempt couldn't decode
+            result = dict(parsed, **result) if attempt else parsed
+            if all(key in result for key in required):
+                count("gemini_json", call=call, result="retried" if attempt else "ok")
+                return result
+        else:
+            for key, value in fields.items():
+                result.setdefault(key, value)
+            if all(key in result for key in required):
+                count("gemini_json", call=call, result="repaired")
+                print(f"🩹 Repaired {call} reply from its complete fields: {sorted(result)}")
+                return result
+
+        # Valid JSON can still leave out a field the schema marks required: that is retried too
+        print(f"⚠️ Incomplete {call} reply (attempt {attempt + 1}/{retries + 1}), "
+              f"missing {[key for key in required if key not in result]}")
+
+    count("gemini_json", call=call, result="failed")
+    raise GeminiJSONError(f"{call}: no valid JSON with {list(required)} after {retries + 1} attempts")
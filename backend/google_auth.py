@@ -1,12 +1,73 @@
 import json
 import os
+import threading
+import httplib2
+import google_auth_httplib2
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from database import get_user
 from dotenv import load_dotenv
+from tracing import traced
 
 load_dotenv() # Make sure we can read .env
 
+# Point Drive at a local stand-in (e.g. the benchmark stubs) instead of www.googleapis.com
+GOOGLE_API_ROOT = os.getenv("GOOGLE_API_ROOT")
+
+
+# Socket timeout (seconds) of RootOverrideHttp; same as googleapiclient's default for real Drive clients
+DRIVE_HTTP_TIMEOUT = float(os.getenv("DRIVE_HTTP_TIMEOUT", "60"))
+
+
+class RootOverrideHttp(httplib2.Http):
+    """Sends requests meant for www.googleapis.com to `base_url` instead."""
+
+    def __init__(self, base_url):
+        # Without a timeout, a stand-in that stops answering holds the calling worker forever
+        super().__init__(timeout=DRIVE_HTTP_TIMEOUT)
+        self.base_url = base_url.rstrip("/")
+        # Same as googleapiclient.http.build_http: 308 means "resume incomplete", not a redirect
+        self.redirect_codes = self.redirect_codes - {308}
+
+    def request(self, uri, *args, **kwargs):
+        uri = uri.replace("https://www.googleapis.com", self.base_url)
+        return super().request(uri, *args, **kwargs)
+
+
+_drive_discovery = None
+_drive_discovery_lock = threading.Lock()
+
+
+def drive_discovery():
+    """
+    The Drive v3 discovery document, parsed once. build() re-reads and re-parses
+    its ~200 KB of JSON on every call, which is most of the CPU cost of a client.
+    """
+    global _drive_discovery
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    with _drive_discovery_lock:
+        if _drive_discovery is None:
+            doc = json.loads(get_static_doc("drive", "v3"))
+            # build_from_document fills in default parameters on first use; do it under the lock
+            build_from_document(doc, http=httplib2.Http())
+            _drive_discovery = doc
+    return _drive_discovery
+
+
+def build_drive_service(creds, phone=None):
+    """
+    Drive v3 client for these credentials (honours GOOGLE_API_ROOT). Its requests go
+    through drive_quota, counted against `phone`'s limits.
+    """
+    from googleapiclient.discovery import build_from_document  # Imported on first use (slow)
+    from drive_quota import request_builder
+    if GOOGLE_API_ROOT:
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=RootOverrideHttp(GOOGLE_API_ROOT))
+        return build_from_document(drive_discovery(), http=http, requestBuilder=request_builder(phone))
+    return build_from_document(drive_discovery(), credentials=creds, requestBuilder=request_builder(phone))
+
+
+@traced("drive")
 def authenticate_drive(phone_number):
     """
     Authenticates using the token stored in the SQLite database for a specific user.
@@ -38,4 +99,4 @@ def authenticate_drive(phone_number):
         client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
     )
 
-    return build('drive', 'v3', credentials=creds)
\ No newline at end of file
+    return build_drive_service(creds, phone_number)
\ No newline at end of file
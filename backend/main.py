@@ -1,36 +1,116 @@
 import os
 import time
+import asyncio
+import threading
 import requests
 import json
-from fastapi import FastAPI, Request, BackgroundTasks, Response
+import hashlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from dotenv import load_dotenv
 
-import io
-from googleapiclient.http import MediaIoBaseDownload
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # --- IMPORTS FROM OUR NEW MODULES ---
-from database import get_user, update_user, get_user_by_email
+from database import init_db, get_user, update_user, get_user_by_email, json_field
+from state_store import get_state_store
 from syllabus_parser import parse_syllabus_with_gemini
-from test_sorting import ask_gemini_to_sort, upload_to_drive, authenticate_drive
-from drive_search import search_drive_files
+from test_sorting import ask_gemini_to_sort, upload_to_drive, finalize_drive_upload, authenticate_drive
+from google_auth import build_drive_service, drive_discovery
+from gemini_json import load_genai
+from drive_search import search_drive
+import search_cache
+import drive_index
+import resort_job
+import drive_import
+import text_index
+import file_hashes
+import folder_reconciler
+import routing_table
+import outbox
+import admission
+from tracing import traced, span, observe, count, submit, set_request_id, current_request_id, new_request_id, render_metrics
 from test_sorting import parse_search_intent # Or wherever you pasted the function above
 
 from folder_creator import build_drive_structure
 from fastapi.responses import JSONResponse, RedirectResponse
 
 from starlette.middleware.sessions import SessionMiddleware
+from payloads import CompressionMiddleware, FastJSONResponse, compact_listing, dumps
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
 from fastapi import UploadFile, File
+from starlette.concurrency import run_in_threadpool
+import anyio.to_thread
 import shutil
 
 from fastapi.middleware.cors import CORSMiddleware
-from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 
 
 load_dotenv()
-app = FastAPI()
+
+# --- CONCURRENCY MODEL ---
+# Our clients (SQLite, requests -> Graph API, googleapiclient, Gemini SDK) are all blocking,
+# so they never run on the event loop: sync routes (`def`) and run_in_threadpool() both use
+# Starlette's threadpool, sized here. Async routes only await request bodies and the pool.
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "40"))
+
+# The loop should wake up on time; if it is late by more than this, something blocked it
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "100"))
+event_loop_lag = {"max_ms": 0.0}
+
+# --- STARTUP ---
+# Importing this module stays cheap (no SDK imports, no network, no DB writes); the work
+# happens in lifespan(). WARM_CLIENTS=0 skips preloading the Gemini/Drive clients
+# (they then load on first use).
+WARM_CLIENTS = os.getenv("WARM_CLIENTS", "1") == "1"
+
+
+async def watch_event_loop(interval=0.05):
+    """Measures how late the event loop wakes up (histogram: component="event_loop")."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = time.perf_counter() - started - interval
+        observe("event_loop", "lag", lag)
+        event_loop_lag["max_ms"] = max(event_loop_lag["max_ms"], lag * 1000)
+        if lag * 1000 > LOOP_LAG_WARN_MS:
+            count("event_loop_blocked")
+            print(f"🐢 Event loop blocked for {lag * 1000:.0f} ms")
+
+
+def warm_clients():
+    """Loads the Gemini SDK and the Drive discovery doc so the first real call doesn't pay for it."""
+    started = time.perf_counter()
+    try:
+        load_genai()
+        drive_discovery()
+        print(f"🔥 Clients warmed in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"⚠️ Client warm-up skipped: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 1. Tables and migrations, before the first request touches them
+    await run_in_threadpool(init_db)
+
+    # 2. Threadpool size + event loop watchdog
+    anyio.to_thread.current_default_thread_limiter().total_tokens = BLOCKING_WORKERS
+    watcher = asyncio.create_task(watch_event_loop())
+
+    # 3. Heavy clients load in the background; the server accepts requests meanwhile
+    if WARM_CLIENTS:
+        run_in_background(warm_clients)
+    yield
+    watcher.cancel()
+    # 4. Long jobs pause at a checkpoint (they resume on the next start); no new ones start
+    await run_in_threadpool(drain_background_jobs, BACKGROUND_DRAIN_SECONDS)
+    # 5. Replies still queued for WhatsApp go out before the process exits
+    await run_in_threadpool(outbox.drain)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 1. KEEP THIS: Required for Google OAuth (to remember user during redirects)
 app.add_middleware(SessionMiddleware, secret_key="super-secret-random-string",max_age=3600,
@@ -55,18 +135,79 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+# JSON listings compress ~5-10x; small replies (webhook acks) aren't worth it
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+
+# 3. TRACING: one request ID per call (echoed back as X-Request-ID) + a latency span per route
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    request_id = set_request_id(request.headers.get("x-request-id") or new_request_id())
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = await call_next(request)
+        status = "ok" if response.status_code < 500 else "error"
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        name = f"{request.method} {route.path if route else 'unmatched'}"
+        observe("http", name, time.perf_counter() - started, status)
+
 # --- CONFIG ---
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v17.0")
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
 
 if not WHATSAPP_TOKEN or not PHONE_NUMBER_ID:
     raise ValueError("❌ Missing Keys! Check your .env file.")
 
-# --- MEMORY FOR BUTTONS ---
-pending_actions = {}
+# --- SHARED STATE (visible to every worker; see state_store.py) ---
+# Namespaces: "pending_actions" (buttons), "syllabus_jobs" (polled by the setup wizard),
+# "seen_messages" (WhatsApp retries webhooks; each message ID is handled once)
+state = get_state_store()
+SYLLABUS_JOB_TTL = 3600  # seconds a job stays pollable after its last update
+SEEN_MESSAGE_TTL = 24 * 3600
+
+# Pipeline stages that overlap (classify / upload / extract): short tasks, kept free of long jobs
+PIPELINE_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("PIPELINE_WORKERS", "8")))
+# Long-running jobs (syllabus parses, re-sorts, Drive imports) run here, so they never hold up uploads
+BACKGROUND_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("BACKGROUND_WORKERS", "4")))
+# On shutdown, running jobs get this long to reach a checkpoint; queued ones are dropped
+BACKGROUND_DRAIN_SECONDS = float(os.getenv("BACKGROUND_DRAIN_SECONDS", "10"))
+background_jobs = set()  # Futures on BACKGROUND_POOL that haven't finished
+queued_resorts = {}  # phone -> future of a re-sort that hasn't started yet
+background_lock = threading.RLock()
+
+
+def run_in_background(fn, *args, **kwargs):
+    """Submits fn to BACKGROUND_POOL; lifespan() waits for it (up to BACKGROUND_DRAIN_SECONDS) on shutdown."""
+    future = submit(BACKGROUND_POOL, fn, *args, **kwargs)
+    with background_lock:
+        background_jobs.add(future)
+
+    def forget(done):
+        with background_lock:
+            background_jobs.discard(done)
+
+    future.add_done_callback(forget)
+    return future
+
+
+def drain_background_jobs(timeout):
+    """Stops taking background work and waits up to `timeout` seconds for running jobs."""
+    resort_job.SHUTDOWN.set()  # Re-sorts and imports stop at their next checkpoint
+    BACKGROUND_POOL.shutdown(wait=False, cancel_futures=True)
+    with background_lock:
+        running = list(background_jobs)
+    _, not_done = wait(running, timeout=timeout)
+    if not_done:
+        print(f"⚠️ {len(not_done)} background job(s) still running after {timeout:.0f}s")
 
 from pydantic import BaseModel
 
@@ -77,18 +218,61 @@ class SetupRequest(BaseModel):
     subjects: list[str]  # e.g., ["Physics", "Chemistry", "Maths"]
 
 # --- HELPER: Send Text ---
-def send_message(to, text):
-    url = f"https://graph.facebook.com/v17.0/{PHONE_NUMBER_ID}/messages"
+@traced("graph")
+def post_message(data):
+    """One Graph API send, called from the outbox's delivery threads."""
+    url = f"{GRAPH_API_URL}/{PHONE_NUMBER_ID}/messages"
     headers = {
         "Authorization": f"Bearer {WHATSAPP_TOKEN}",
         "Content-Type": "application/json"
     }
-    requests.post(url, headers=headers, json={
+    return requests.post(url, headers=headers, json=data)
+
+
+def send_message(to, text, priority=outbox.RESULT, coalesce=None):
+    """Queues a text message (see outbox.py); progress pings pass priority=outbox.PROGRESS."""
+    outbox.enqueue(to, {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "text",
         "text": {"body": text}
-    })
+    }, post_message, priority, coalesce)
+
+
+# --- HELPER: Search results, one page per message ---
+def send_search_page(to, query, files, offset):
+    """
+    Sends files[offset:offset + PAGE_SIZE] and saves a cursor so "more" continues from there.
+    query = {"query": text, "parent_id": folder or None, "intent": parsed intent}.
+    """
+    page = files[offset:offset + search_cache.PAGE_SIZE]
+    if not page:
+        send_message(to, "✅ That's all the results.")
+        return
+
+    if offset == 0:
+        response_msg = f"📂 **Found {len(files)} files:**\n\n"
+    else:
+        response_msg = f"📂 **Results {offset + 1}-{offset + len(page)} of {len(files)}:**\n\n"
+    for f in page:
+        icon = "📄"
+        if "image" in f['mimeType']:
+            icon = "🖼️"
+        elif "pdf" in f['mimeType']:
+            icon = "📕"
+        elif "folder" in f['mimeType']:
+            icon = "📁"
+
+        response_msg += f"{icon} *{f['name']}*\n"
+        if f.get('snippet'):
+            response_msg += f"💬 {f['snippet']}\n"  # Where the query matched inside the file
+        response_msg += f"🔗 {f['webViewLink']}\n\n"
+
+    next_offset = offset + len(page)
+    if next_offset < len(files):
+        response_msg += f"➕ Reply *more* for the next {min(search_cache.PAGE_SIZE, len(files) - next_offset)}."
+    send_message(to, response_msg)
+    search_cache.save_cursor(to, query["query"], query["parent_id"], next_offset, query["intent"])
 
 
 # --- HELPER: Send Buttons ---
@@ -96,11 +280,6 @@ def send_buttons(to, text, buttons):
     """
     buttons = [{"id": "yes", "title": "Save"}, {"id": "no", "title": "Discard"}]
     """
-    url = f"https://graph.facebook.com/v17.0/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
     button_actions = [{"type": "reply", "reply": {"id": b["id"], "title": b["title"]}} for b in buttons]
 
     data = {
@@ -113,13 +292,36 @@ def send_buttons(to, text, buttons):
             "action": {"buttons": button_actions}
         }
     }
-    requests.post(url, headers=headers, json=data)
+    outbox.enqueue(to, data, post_message)
+
+
+# --- HELPER: Upload Progress Pings (Big Files Only) ---
+BIG_FILE_BYTES = int(os.getenv("BIG_FILE_MB", "8")) * 1024 * 1024
+
+
+def make_upload_progress_notifier(to, step=0.25):
+    """
+    Returns an on_progress callback for upload_to_drive that tells the user
+    how far a big upload got, once per `step` (25%, 50%, 75%).
+    """
+    next_mark = step
+
+    def notify(progress):
+        nonlocal next_mark
+        if progress >= 1 or progress < next_mark:
+            return
+        send_message(to, f"⏫ Uploading... {int(progress * 100)}%", outbox.PROGRESS)
+        while next_mark <= progress:
+            next_mark += step
+
+    return notify
 
 
 # --- HELPER: Download Media ---
+@traced("graph")
 def download_media(media_id, filename):
     try:
-        url_info = f"https://graph.facebook.com/v17.0/{media_id}"
+        url_info = f"{GRAPH_API_URL}/{media_id}"
         headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
         r = requests.get(url_info, headers=headers)
         media_url = r.json().get('url')
@@ -208,15 +410,17 @@ def auth_callback(request: Request):
     }
 
     try:
-        response = requests.post(token_url, data=data)
+        with span("google", "oauth.token_exchange"):
+            response = requests.post(token_url, data=data)
         new_tokens = response.json()
         access_token = new_tokens.get("access_token")
 
         # 2. Fetch Google Profile
-        user_info = requests.get(
-            "https://www.googleapis.com/oauth2/v1/userinfo",
-            headers={"Authorization": f"Bearer {access_token}"}
-        ).json()
+        with span("google", "oauth.userinfo"):
+            user_info = requests.get(
+                "https://www.googleapis.com/oauth2/v1/userinfo",
+                headers={"Authorization": f"Bearer {access_token}"}
+            ).json()
 
         google_email = user_info.get("email")
         user_name = user_info.get("name", "Student")
@@ -299,7 +503,7 @@ def auth_callback(request: Request):
 
 
 @app.post("/api/complete-setup")
-async def complete_setup(data: SetupRequest):
+def complete_setup(data: SetupRequest):
     print(f"🚀 Starting Setup for {data.phone} with subjects: {data.subjects}")
 
     # A. Validate User
@@ -323,6 +527,7 @@ async def complete_setup(data: SetupRequest):
 
         # D. Update Database
         update_user(data.phone, "folder_map", new_map)
+        drive_index.invalidate(data.phone)
         update_user(data.phone, "root_folder_id", root_id)
         update_user(data.phone, "status", "ACTIVE")  # <--- Important! This unlocks the dashboard.
 
@@ -341,37 +546,89 @@ def get_dashboard_data(request: Request):
     user = get_user(phone)
     if not user: return JSONResponse({"error": "User not found"}, status_code=404)
 
-    return {
+    return FastJSONResponse({
         "phone": phone,
         "name": user.get("name"),
         "picture": user.get("picture"),
         "status": user.get("status"),
-        "syllabus": user.get("temp_syllabus_list", {}),
-        "folder_map": user.get("folder_map", {}),
+        "syllabus": json_field(user, "temp_syllabus_list", {}),
+        "folder_map": json_field(user, "folder_map", {}),
         # 👇 ADD THIS LINE HERE 👇
         "root_folder_id": user.get("root_folder_id")
-    }
+    })
 
 
-@app.get("/api/drive/browse")
-def browse_drive(request: Request, folder_id: str = None):
-    # 1. Auth Check
+# Browsers may reuse the dashboard for this long, then revalidate with If-None-Match
+DASHBOARD_MAX_AGE = 30
+
+
+@app.get("/api/dashboard")
+def get_dashboard(request: Request, compact: bool = False):
+    """
+    Everything the dashboard's first paint needs in one response: profile, decoded
+    syllabus + folder map, the root folder listing and per-subject unit/file/byte counts.
+    Drive data comes from drive_index (cached per user), so a warm load makes no Drive calls.
+    compact=1 leaves out the Drive links the client can rebuild (see payloads.compact_listing).
+    """
     phone = request.session.get("user_phone")
+    if not phone: return JSONResponse({"error": "Not logged in"}, status_code=401)
+
     user = get_user(phone)
-    if not user or not user.get("google_token"):
-        return JSONResponse({"error": "Auth required"}, 401)
+    if not user: return JSONResponse({"error": "User not found"}, status_code=404)
 
-    # 2. Setup Drive Service
-    token_info = user['google_token']
+    syllabus = json_field(user, "temp_syllabus_list", {})
+    folder_map = json_field(user, "folder_map", {})
+    root_folder_id = user.get("root_folder_id")
 
-    # --- FIX: Convert String to JSON if needed ---
-    if isinstance(token_info, str):
+    # 1. Drive listing + counts (skipped until setup has created the folders)
+    index = {"root": {"folders": [], "files": []}, "subjects": {}, "built_at": None}
+    if root_folder_id and user.get("google_token"):
         try:
-            token_info = json.loads(token_info)
+            index = drive_index.get_index(phone, root_folder_id, folder_map, lambda: authenticate_drive(phone))
         except Exception as e:
-            print(f"❌ Token Parsing Error: {e}")
-            return JSONResponse({"error": "Invalid Token Format"}, 500)
-    # --------------------------------------------
+            print(f"⚠️ Dashboard Drive index failed: {e}")
+        # Folders renamed or deleted in Drive are repaired in the background for the next upload
+        folder_reconciler.verify_async(phone, user)
+
+    # 2. One entry per subject: units from the syllabus/folders, files and bytes from the index
+    subjects = {}
+    for name in dict.fromkeys(list(folder_map) + list(syllabus)):
+        entry = folder_map.get(name)
+        unit_folders = entry.get("units", {}) if isinstance(entry, dict) else {}
+        units = syllabus.get(name) or list(unit_folders)
+        stats = index["subjects"].get(name, {})
+        subjects[name] = {"units": len(units), "files": stats.get("files", 0), "bytes": stats.get("bytes", 0)}
+
+    body = {
+        "phone": phone,
+        "name": user.get("name"),
+        "picture": user.get("picture"),
+        "status": user.get("status"),
+        "root_folder_id": root_folder_id,
+        "syllabus": syllabus,
+        "folder_map": folder_map,
+        "root": compact_listing(index["root"]) if compact else index["root"],
+        "subjects": subjects,
+    }
+
+    # 3. Conditional GET: same content -> 304 with no body (a rebuilt but unchanged index still matches)
+    etag = '"' + hashlib.sha1(dumps(body)).hexdigest() + '"'
+    body["indexed_at"] = index["built_at"]
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={DASHBOARD_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(body, headers=headers)
+
+
+def drive_connector(user):
+    """
+    A callable that builds this user's Drive service, or None if the stored token is broken.
+    Browse and tree only call it on a cache miss.
+    """
+    token_info = json_field(user, "google_token", {})
+    if not isinstance(token_info, dict) or not token_info.get("access_token"):
+        print(f"❌ Token Parsing Error for {user.get('phone')}")
+        return None
 
     creds = Credentials(
         token=token_info['access_token'],
@@ -380,7 +637,21 @@ def browse_drive(request: Request, folder_id: str = None):
         client_id=os.getenv("GOOGLE_CLIENT_ID"),
         client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
     )
-    service = build('drive', 'v3', credentials=creds)
+    return lambda: build_drive_service(creds, user.get("phone"))
+
+
+@app.get("/api/drive/browse")
+def browse_drive(request: Request, folder_id: str = None, compact: bool = False):
+    # 1. Auth Check
+    phone = request.session.get("user_phone")
+    user = get_user(phone)
+    if not user or not user.get("google_token"):
+        return JSONResponse({"error": "Auth required"}, 401)
+
+    # 2. Setup Drive Service (built lazily: cached listings don't need it)
+    connect = drive_connector(user)
+    if not connect:
+        return JSONResponse({"error": "Invalid Token Format"}, 500)
 
     # 3. Determine which folder to look in
     target_id = folder_id
@@ -391,32 +662,131 @@ def browse_drive(request: Request, folder_id: str = None):
         return {"folders": [], "files": []}
 
     try:
-        # 4. Query Drive
-        query = f"'{target_id}' in parents and trashed=false"
-        results = service.files().list(
-            q=query,
-            fields="files(id, name, mimeType, webViewLink, iconLink)",
-            orderBy="folder, name"
-        ).execute()
-
-        items = results.get('files', [])
-
-        # 5. Separate logic
-        folders = []
-        files = []
-        for item in items:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                folders.append(item)
-            else:
-                files.append(item)
-
-        return {"folders": folders, "files": files}
+        # 4. Cached listing or Drive (folders and files come back separated)
+        listing = drive_index.load_listings(phone, [target_id], connect)[target_id]
+
+        # 5. Warm the sub-folders in the background: they are the likely next clicks
+        drive_index.prefetch_children(phone, listing, connect)
+        return FastJSONResponse(compact_listing(listing) if compact else listing)
+
+    except Exception as e:
+        print(f"Drive API Error: {e}")
+        return JSONResponse({"error": str(e)}, 500)
+
+
+@app.get("/api/drive/tree")
+def drive_tree(request: Request, folder_id: str = None, depth: int = 2, compact: bool = False):
+    """
+    The subject/unit hierarchy from folder_map plus the listings of `folder_id` (default:
+    the root) and its sub-folders down to `depth` levels, so the explorer can navigate
+    that far from memory. The level below that is prefetched on the server.
+    """
+    phone = request.session.get("user_phone")
+    user = get_user(phone)
+    if not user or not user.get("google_token"):
+        return JSONResponse({"error": "Auth required"}, 401)
+
+    connect = drive_connector(user)
+    if not connect:
+        return JSONResponse({"error": "Invalid Token Format"}, 500)
+
+    target_id = folder_id or user.get("root_folder_id")
+    depth = max(1, min(depth, drive_index.TREE_MAX_DEPTH))
+    tree = {"folder_id": target_id, "depth": depth, "folder_map": json_field(user, "folder_map", {}), "listings": {}}
+    if not target_id:
+        return tree
+
+    try:
+        tree["listings"] = drive_index.load_listings(phone, [target_id], connect, depth=depth)
+
+        # Folders on the deepest level have no listing yet: fetch them before they are clicked
+        frontier = [f for listing in tree["listings"].values() for f in listing["folders"]
+                    if f["id"] not in tree["listings"]]
+        drive_index.prefetch_children(phone, {"folders": frontier}, connect)
+        if compact:
+            tree["listings"] = {fid: compact_listing(listing) for fid, listing in tree["listings"].items()}
+        return FastJSONResponse(tree)
 
     except Exception as e:
         print(f"Drive API Error: {e}")
         return JSONResponse({"error": str(e)}, 500)
 
 
+# --- RE-SORT "IMPORTED DOCUMENTS" (see resort_job.py) ---
+def notify_resort_done(phone, job):
+    if job["moved"]:
+        send_message(phone, f"🗂️ *Tidied up!*\nMoved {job['moved']} files out of Imported Documents "
+                            f"into your subjects ({job['unsorted']} still unsorted).")
+
+
+def start_resort(phone):
+    """
+    Runs (or resumes) the user's re-sort job in the background. A start that is still
+    waiting for a worker covers this one too (it reads the folder map when it begins).
+    """
+    def forget(done):
+        with background_lock:
+            if queued_resorts.get(phone) is done:
+                del queued_resorts[phone]
+
+    with background_lock:
+        queued = queued_resorts.get(phone)
+        if queued is not None and not queued.running() and not queued.done():
+            count("resort_jobs", result="coalesced")
+            return
+        future = queued_resorts[phone] = run_in_background(resort_job.run_resort, phone, notify=notify_resort_done)
+    future.add_done_callback(forget)
+
+
+@app.post("/api/resort-imported")
+def resort_imported(request: Request):
+    phone = request.session.get("user_phone")
+    if not phone: return JSONResponse({"error": "Not logged in"}, status_code=401)
+    start_resort(phone)
+    return {"status": "started", "job": resort_job.job_status(phone)}
+
+
+@app.get("/api/resort-imported")
+def resort_imported_status(request: Request):
+    phone = request.session.get("user_phone")
+    if not phone: return JSONResponse({"error": "Not logged in"}, status_code=401)
+    return {"job": resort_job.job_status(phone)}
+
+
+# --- ONBOARDING IMPORT OF AN EXISTING DRIVE (see drive_import.py) ---
+def notify_import_done(phone, job):
+    if job["status"] == "planned" and job["planned"]:
+        top = ", ".join(f"{subject} ({n})" for subject, n in
+                        sorted(job["by_subject"].items(), key=lambda item: -item[1])[:3])
+        send_message(phone, f"🧭 *Found {job['files_found']} files in your Drive.*\n"
+                            f"{job['planned']} can be sorted into your subjects: {top}.\n"
+                            f"Open your dashboard to review and apply the import.")
+    elif job["status"] == "done" and job["moved"]:
+        send_message(phone, f"📥 *Import complete!*\nMoved {job['moved']} of your existing files "
+                            f"into your subject folders.")
+
+
+def start_import(phone, apply):
+    """Plans (apply=False) or carries out the user's Drive import in the background."""
+    run_in_background(drive_import.run_import, phone, apply=apply, notify=notify_import_done)
+
+
+@app.post("/api/import-drive")
+def import_drive(request: Request, apply: bool = False):
+    """Opt-in: apply=false only builds a dry-run plan; apply=true moves the files."""
+    phone = request.session.get("user_phone")
+    if not phone: return JSONResponse({"error": "Not logged in"}, status_code=401)
+    start_import(phone, apply)
+    return {"status": "started", "apply": apply, "job": drive_import.job_status(phone)}
+
+
+@app.get("/api/import-drive")
+def import_drive_status(request: Request):
+    phone = request.session.get("user_phone")
+    if not phone: return JSONResponse({"error": "Not logged in"}, status_code=401)
+    return {"job": drive_import.job_status(phone)}
+
+
 @app.get("/logout")
 def logout(request: Request):
     # 1. Clear the session cookie
@@ -426,6 +796,7 @@ def logout(request: Request):
     return RedirectResponse(f"{frontend_url}/login")
 
 
+@traced("drive")
 def append_folders_to_drive(phone, root_folder_id, new_structure):
     """
     Creates ONLY the folders in 'new_structure' inside the EXISTING 'root_folder_id'.
@@ -483,6 +854,11 @@ async def create_folders_web(request: Request):
     form = await request.form()
     selected_subjects = form.getlist("selected_subjects")  # List of subjects to create
 
+    # The rest is SQLite + Drive + Graph API calls
+    return await run_in_threadpool(create_folders_for_user, phone, selected_subjects)
+
+
+def create_folders_for_user(phone, selected_subjects):
     # 2. Get User Data
     user = get_user(phone)
     root_id = user.get("root_folder_id")
@@ -535,6 +911,10 @@ async def create_folders_web(request: Request):
 
         # Save to DB
         update_user(phone, "folder_map", existing_map)
+        drive_index.invalidate(phone)
+
+        # The new subjects may be where earlier unsorted uploads belong
+        start_resort(phone)
 
         return JSONResponse({"status": "success", "message": "New subjects added successfully"})
 
@@ -569,12 +949,11 @@ async def create_folders_web(request: Request):
             update_user(phone, "folder_map", new_map)
             update_user(phone, "root_folder_id", new_root_id)
             update_user(phone, "status", "ACTIVE")
+            drive_index.invalidate(phone)
 
-            # Message 1: Confirmation
-            send_message(phone, "✅ *Setup Complete!*\nYour dashboard and folders are ready.")
-
-            # Message 2: How to use (Onboarding)
+            # One message: confirmation + how to use (Onboarding)
             intro_msg = (
+                "✅ *Setup Complete!*\nYour dashboard and folders are ready.\n\n"
                 "🚀 *How to use me:*\n\n"
                 "1️⃣ *Save Files:* Send any image or PDF here. I will analyze it and auto-sort it into the correct Subject folder.\n\n"
                 "2️⃣ *Find Files:* Just ask things like _'Get Physics notes'_ or _'Find Unit 1 papers'_ and I'll fetch them instantly!"
@@ -588,127 +967,254 @@ async def create_folders_web(request: Request):
             return JSONResponse({"error": str(e)}, status_code=500)
 
 
+def run_syllabus_job(job_id, phone, file_path):
+    """Parses one uploaded syllabus in the background and fills in its job record."""
+    job = state.get("syllabus_jobs", job_id)
+
+    def save(**fields):
+        job.update(fields)
+        state.set("syllabus_jobs", job_id, job, ttl=SYLLABUS_JOB_TTL)
+
+    def on_progress(stage, percent):
+        save(stage=stage, progress=percent)
+
+    save(status="parsing")
+    try:
+        # Parse (Assuming returns dict: {"Maths": [...], "Physics": [...]})
+        subjects_data = parse_syllabus_with_gemini(file_path, on_progress=on_progress)
+
+        # Save to DB
+        update_user(phone, "temp_syllabus_list", subjects_data)
+        update_user(phone, "status", "EDITING_LIST")
+
+        save(status="done", stage="done", progress=100, subjects=subjects_data, finished_at=time.time())
+    except Exception as e:
+        print(f"❌ Syllabus Job Error: {e}")
+        save(status="error", stage="failed", error=str(e), finished_at=time.time())
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
 @app.post("/upload-syllabus")
 async def upload_syllabus_web(request: Request, file: UploadFile = File(...)):
+    """
+    Saves the file and queues the Gemini parse, answering right away with a job ID.
+    The wizard polls GET /upload-syllabus/{job_id} until status is "done".
+    """
     phone = request.session.get("user_phone")
     if not phone: return JSONResponse({"error": "Not logged in"}, status_code=401)
 
-    # 1. Save file locally
-    temp_filename = f"syllabus_{phone}.pdf"
+    # 1. Save file locally, in 1 MB chunks and off the event loop
+    job_id = new_request_id()
+    temp_filename = f"syllabus_{phone}_{job_id}.pdf"
     with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        await run_in_threadpool(shutil.copyfileobj, file.file, buffer, 1024 * 1024)
 
-    # 2. Parse (Assuming returns dict: {"Maths": [...], "Physics": [...]})
-    subjects_data = parse_syllabus_with_gemini(temp_filename)
+    # 2. Queue the parse (the job record expires on its own once nobody updates it)
+    job = {"phone": phone, "status": "queued", "stage": "queued", "progress": 0}
+    await run_in_threadpool(state.set, "syllabus_jobs", job_id, job, SYLLABUS_JOB_TTL)
+    run_in_background(run_syllabus_job, job_id, phone, temp_filename)
 
-    # 3. Save to DB
-    update_user(phone, "temp_syllabus_list", subjects_data)
-    update_user(phone, "status", "EDITING_LIST")
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
+
+@app.get("/upload-syllabus/{job_id}")
+def syllabus_job_status(request: Request, job_id: str):
+    phone = request.session.get("user_phone")
+    job = state.get("syllabus_jobs", job_id)
+    if not job or job["phone"] != phone:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
 
-    # ✅ CORRECT: Send the full dictionary (Subjects + Units)
-    return JSONResponse(content={"subjects": subjects_data})
+    # ✅ Once done, "subjects" holds the full dictionary (Subjects + Units)
+    return {k: v for k, v in job.items() if k != "phone"}
 
 
 
 # ==========================================
 # 🤖 LOGIC 3: SORTING FILES (Active Mode)
 # ==========================================
-def process_file_background(media_id, sender, temp_filename):
-    print(f"🔄 Processing file for {sender}...")
+def timed_stage(timings, stage, fn, *args, **kwargs):
+    """Runs one pipeline stage and records how long it took (seconds) under `stage`."""
+    started = time.perf_counter()
+    try:
+        with span("pipeline", stage):
+            return fn(*args, **kwargs)
+    finally:
+        timings[stage] = time.perf_counter() - started
 
-    if download_media(media_id, temp_filename):
-        try:
-            # 1. LOAD USER MAP
-            user = get_user(sender)
-            my_folders = user.get("folder_map", {})
-            if isinstance(my_folders, str):
-                try:
-                    my_folders = json.loads(my_folders)
-                except:
-                    my_folders = {}
-
-            if not my_folders:
-                send_message(sender, "⚠️ No folders set up. Please go to the dashboard.")
-                return
-
-            # 2. ASK GEMINI TO SORT
-            decision = ask_gemini_to_sort(temp_filename, my_folders)
-
-            subj = decision.get('subject')
-            unit = decision.get('unit')
-            new_name = decision.get('suggested_filename', temp_filename)
-
-            target_folder_id = None
-            save_location_name = ""
-
-            # 3. DETERMINE TARGET FOLDER (Auto-Sort Logic)
-
-            # Case A: Exact Match (Subject + Unit found)
-            if subj in my_folders and unit in my_folders[subj].get('units', {}):
-                target_folder_id = my_folders[subj]['units'][unit]
-                save_location_name = f"{subj} > {unit}"
-
-            # Case B: Subject Match Only (Unit unknown/missing) -> Save to Subject Root
-            elif subj in my_folders:
-                target_folder_id = my_folders[subj]['id']
-                save_location_name = f"{subj} (Root)"
-
-            # Case C: Fallback / Utility Folders
-            elif subj in ["Important Documents", "Screenshots", "Identity Cards", "Personal"]:
-                # Check if these exist in the user's map (they should, from setup)
-                if subj in my_folders:
-                    target_folder_id = my_folders[subj]  # Might be string ID or dict depending on setup
-                    if isinstance(target_folder_id, dict): target_folder_id = target_folder_id.get('id')
-                    save_location_name = subj
-
-            # Case D: No idea -> 'Imported Documents'
-            if not target_folder_id:
-                if "Imported Documents" in my_folders:
-                    target = my_folders["Imported Documents"]
-                    target_folder_id = target.get('id') if isinstance(target, dict) else target
-                    save_location_name = "Imported Documents"
-                else:
-                    # Last resort: Root Folder
-                    target_folder_id = user.get("root_folder_id")
-                    save_location_name = "Home Folder"
 
-            # 4. EXECUTE SAVE (No Buttons!)
-            if target_folder_id:
-                # Authenticate Drive
-                drive_service = authenticate_drive(sender)
+def stage_upload(sender, file_path, staging_folder_id, on_progress=None):
+    """Uploads the raw file into the staging folder before we know its final name/folder."""
+    drive_service = authenticate_drive(sender)
+    file_id = upload_to_drive(drive_service, file_path, os.path.basename(file_path), staging_folder_id,
+                              on_progress=on_progress)
+    return drive_service, file_id
 
-                # Upload
-                upload_to_drive(drive_service, temp_filename, new_name, target_folder_id)
 
-                # Notify User
-                send_message(sender, f"✅ **Auto-Saved!**\n📂 *{save_location_name}*\n📄 _{new_name}_")
-            else:
-                send_message(sender, "❌ Error: Could not determine where to save this file.")
+def _is_not_found(error):
+    from googleapiclient.errors import HttpError
+    return isinstance(error, HttpError) and error.resp.status == 404
 
-        except Exception as e:
-            print(f"❌ Auto-Save Error: {e}")
-            import traceback
-            traceback.print_exc()
-            send_message(sender, "❌ Failed to save file.")
-
-        finally:
-            # Cleanup temp file
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-    else:
+
+def discard_staged_upload(upload):
+    """Deletes a staged upload (stage_upload's future) that never made it into its folder."""
+    try:
+        drive_service, file_id = upload.result()
+    except Exception:
+        return  # The upload failed itself: nothing was staged
+    try:
+        drive_service.files().delete(fileId=file_id).execute()
+        print(f"🧹 Removed staged upload {file_id}")
+    except Exception as e:
+        print(f"⚠️ Could not remove staged upload {file_id}: {e}")
+
+
+def process_file_background(media_id, sender, temp_filename, request_id=None):
+    """
+    Download -> duplicate check -> (Gemini classify || Drive upload into the workspace root) -> rename + move.
+
+    Drive only needs the bytes, not the decision, so the upload runs while Gemini
+    is thinking and the AI's answer is applied afterwards with one metadata update.
+    End-to-end time is roughly download + max(gemini, upload) instead of the sum.
+    If the pipeline fails before the move, the staged copy is deleted again.
+    """
+    set_request_id(request_id)
+    print(f"🔄 Processing file for {sender}... [{current_request_id()}]")
+    timings = {}
+    started = time.perf_counter()
+
+    # Only queued: a quick result replaces it before it's sent (outbox.py)
+    send_message(sender, "🤖 Analyzing document...", outbox.PROGRESS)
+
+    if not timed_stage(timings, "download", download_media, media_id, temp_filename):
         send_message(sender, "❌ Failed to download file from WhatsApp.")
+        return
+
+    classify = upload = extract = None
+    saved = False  # True once the staged upload has its final name and folder
+    try:
+        # 1. LOAD USER MAP
+        user = get_user(sender)
+        my_folders = user.get("folder_map", {})
+        if isinstance(my_folders, str):
+            try:
+                my_folders = json.loads(my_folders)
+            except:
+                my_folders = {}
+
+        if not my_folders:
+            send_message(sender, "⚠️ No folders set up. Please go to the dashboard.")
+            return
+        routes = routing_table.table_for(user.get("folder_map"))
+
+        # Folders renamed or deleted in Drive get fixed while we work (no Drive call if recently checked)
+        connect = lambda: authenticate_drive(sender)
+        folder_check = folder_reconciler.verify_async(sender, user, connect)
+
+        # 2. DUPLICATE CHECK: bytes already in the user's Drive get their link back, not a second copy
+        md5 = timed_stage(timings, "hash", file_hashes.file_md5, temp_filename)
+        duplicate = timed_stage(timings, "duplicate_check", file_hashes.find_duplicate, sender, md5, connect)
+        submit(drive_index.PREFETCH_POOL, drive_index.sync_checksums, sender, my_folders, connect)
+        if duplicate:
+            timed_stage(timings, "notify_done", send_message, sender,
+                        f"♻️ **Already saved!**\n📄 _{duplicate['name']}_\n🔗 {duplicate['webViewLink']}")
+            return
+
+        # 3. FAN OUT: Gemini sorts while Drive receives the bytes (big scans report progress)
+        staging_folder_id = user.get("root_folder_id") or "root"
+        progress_cb = None
+        if os.path.getsize(temp_filename) >= BIG_FILE_BYTES:
+            progress_cb = make_upload_progress_notifier(sender)
+
+        classify = submit(PIPELINE_POOL, timed_stage, timings, "gemini", ask_gemini_to_sort, temp_filename, routes)
+        upload = submit(PIPELINE_POOL, timed_stage, timings, "drive_upload", stage_upload,
+                        sender, temp_filename, staging_folder_id, progress_cb)
+        # The text for full-text search comes from the same local bytes
+        extract = submit(PIPELINE_POOL, timed_stage, timings, "extract_text", text_index.extract_text, temp_filename)
+
+        try:
+            decision = classify.result()
+        except Exception as e:
+            # The bytes are (being) saved anyway, so a failed AI call just means the fallback folder
+            print(f"⚠️ Sorting failed, using fallback folder: {e}")
+            decision = {}
+
+        new_name = decision.get('suggested_filename', temp_filename)
+
+        # 4. DETERMINE TARGET FOLDER (with the repaired map if it needed one)
+        repaired = timed_stage(timings, "folder_check", folder_check.result) if folder_check else None
+        if repaired:
+            routes = routing_table.table_for(repaired)
+        target_folder_id, save_location_name = routes.route(decision, staging_folder_id)
+
+        # 5. JOIN: rename + move the staged upload (No Buttons!)
+        drive_service, file_id = upload.result()
+        try:
+            timed_stage(timings, "finalize", finalize_drive_upload,
+                        drive_service, file_id, new_name, target_folder_id, staging_folder_id)
+        except Exception as e:
+            if not _is_not_found(e):
+                raise
+            # The folder went away after the map was last checked: repair it and move the file once more
+            print(f"🩹 Target folder {target_folder_id} is gone, repairing the folder map for {sender}")
+            routes = routing_table.table_for(folder_reconciler.reconcile(sender, connect) or routes)
+            target_folder_id, save_location_name = routes.route(decision, staging_folder_id)
+            timed_stage(timings, "finalize", finalize_drive_upload,
+                        drive_service, file_id, new_name, target_folder_id, staging_folder_id)
+        saved = True
+
+        # 6. BOOKKEEPING: the file is in Drive now; a failure here mustn't be reported as a failed save
+        try:
+            drive_index.invalidate(sender)
+            search_cache.invalidate_folder(sender, target_folder_id)
+            timed_stage(timings, "index_text", text_index.index_file,
+                        sender, file_id, new_name, target_folder_id, extract.result())
+            file_hashes.record(sender, file_id, md5, new_name)
+        except Exception as e:
+            print(f"⚠️ Saved {file_id} but couldn't index it: {e}")
+
+        # Notify User
+        timed_stage(timings, "notify_done", send_message, sender,
+                    f"✅ **Auto-Saved!**\n📂 *{save_location_name}*\n📄 _{new_name}_")
 
+    except Exception as e:
+        print(f"❌ Auto-Save Error: {e}")
+        import traceback
+        traceback.print_exc()
+        # Don't leave a "file_<sender>_<media>" copy behind in the workspace root
+        if upload and not saved:
+            discard_staged_upload(upload)
+        send_message(sender, "❌ Failed to save file.")
+
+    finally:
+        # All three branches read the temp file; let them finish before deleting it
+        wait([f for f in (classify, upload, extract) if f])
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
 
+        total = time.perf_counter() - started
+        stages = " ".join(f"{k}={v:.2f}s" for k, v in timings.items())
+        print(f"⏱️ Pipeline {sender} [{current_request_id()}]: {stages} | total={total:.2f}s (sum={sum(timings.values()):.2f}s)")
 
 
 # ==========================================
 # 👂 WEBHOOK LISTENER
 # ==========================================
 @app.post("/webhook")
-async def receive_whatsapp(request: Request, background_tasks: BackgroundTasks):
+async def receive_whatsapp(request: Request):
     try:
         data = await request.json()
+    except Exception as e:
+        print(f"❌ Webhook Error: {e}")
+        return Response(content="Internal Error", status_code=200)
+
+    # Handling a message means SQLite, Gemini, Drive and Graph API calls: keep them off the loop
+    return await run_in_threadpool(handle_webhook, data)
 
+
+def handle_webhook(data):
+    try:
         # ---------------------------------------------------------
         # 🛡️ 1. SAFETY CHECKS (Prevent Crashing on Status Updates)
         # ---------------------------------------------------------
@@ -742,6 +1248,10 @@ async def receive_whatsapp(request: Request, background_tasks: BackgroundTasks):
         sender = msg['from']
         msg_type = msg['type']
 
+        # 🔁 Meta re-delivers webhooks it thinks failed: handle each message once, on any worker
+        if msg.get('id') and not state.add("seen_messages", msg['id'], ttl=SEEN_MESSAGE_TTL):
+            return Response(content="Duplicate ignored", status_code=200)
+
         # 🛡️ SAFETY CHECK: Handle users who aren't in DB yet
         user = get_user(sender)
 
@@ -752,6 +1262,14 @@ async def receive_whatsapp(request: Request, background_tasks: BackgroundTasks):
             status = "NEW"
             user = {}
 
+        # 🚦 Per-sender limit on texts (files are limited where they're queued, below)
+        if msg_type == 'text':
+            accepted, notice = admission.admit_text(sender)
+            if notice:
+                send_message(sender, notice)
+            if not accepted:
+                return Response(content="Throttled", status_code=200)
+
             # ============================================================
         # 🚀 3. VERIFICATION INTERCEPTOR
         # ============================================================
@@ -814,47 +1332,45 @@ async def receive_whatsapp(request: Request, background_tasks: BackgroundTasks):
             if msg_type == 'text':
                 text_body = msg.get('text', {}).get('body', '')
 
-                # A. Load Folder Map safely
-                my_folders = user.get("folder_map", {})
-                if isinstance(my_folders, str):
-                    try:
-                        my_folders = json.loads(my_folders)
-                    except:
-                        my_folders = {}
-
-                # B. Check Intent
-                intent = parse_search_intent(text_body, my_folders)
+                # A. "more" -> the next page of the last search (from the cache: no Gemini, no Drive)
+                cursor = search_cache.get_cursor(sender) if search_cache.is_more_request(text_body) else None
+                if cursor:
+                    cached = search_cache.get(sender, cursor["query"])
+                    if cached:
+                        files_found = cached["files"]
+                    else:
+                        # A new upload made the results stale: same query again, Drive only
+                        files_found, scope = search_drive(sender, cursor["query"], cursor["parent_id"])
+                        search_cache.put(sender, cursor["query"], cursor["intent"], files_found, scope)
+                    send_search_page(sender, cursor, files_found, cursor["offset"])
+                    return Response(content="OK", status_code=200)
+
+                # B. Load Folder Map (compiled once per version)
+                routes = routing_table.table_for(user.get("folder_map"))
+
+                # C. Check Intent (a repeated query reuses the cached intent and results)
+                cached = search_cache.get(sender, text_body)
+                intent = cached["intent"] if cached else parse_search_intent(text_body, routes)
                 is_search = intent.get("is_search")
-                subject_match = intent.get("subject")
 
                 if is_search:
-                    send_message(sender, f"🔍 Searching for '{text_body}'...")
-
-                    # C. Determine Folder ID
-                    parent_id = None
-                    if subject_match and subject_match in my_folders:
-                        parent_id = my_folders[subject_match]['id']
+                    # D. Determine Folder ID (near misses like "physcis" or "dbms" still match)
+                    _, parent_id = routes.subject_folder(intent.get("subject"))
 
-                    # D. Call Search
-                    files_found = search_drive_files(sender, text_body, parent_id)
+                    # E. Call Search
+                    if cached:
+                        files_found = cached["files"]
+                    else:
+                        send_message(sender, f"🔍 Searching for '{text_body}'...", outbox.PROGRESS)
+                        files_found, scope = search_drive(sender, text_body, parent_id)
+                        search_cache.put(sender, text_body, intent, files_found, scope)
 
                     if not files_found:
                         send_message(sender, "❌ No files found.")
                     else:
-                        # E. Format Results
-                        response_msg = f"📂 **Found {len(files_found)} files:**\n\n"
-                        for f in files_found[:5]:
-                            icon = "📄"
-                            if "image" in f['mimeType']:
-                                icon = "🖼️"
-                            elif "pdf" in f['mimeType']:
-                                icon = "📕"
-                            elif "folder" in f['mimeType']:
-                                icon = "📁"
-
-                            response_msg += f"{icon} *{f['name']}*\n🔗 {f['webViewLink']}\n\n"
-
-                        send_message(sender, response_msg)
+                        # F. Format Results (first page; "more" sends the rest)
+                        query = {"query": text_body, "parent_id": parent_id, "intent": intent}
+                        send_search_page(sender, query, files_found, 0)
 
                 else:
                     send_message(sender, "📤 Send me a file to save, or ask 'Find Adhar Card'.")
@@ -874,35 +1390,46 @@ async def receive_whatsapp(request: Request, background_tasks: BackgroundTasks):
                         elif "word" in mime:
                             ext = ".docx"
 
-                    temp_filename = f"file_{sender}{ext}"
+                    # One temp file per media: a sender's files can be in the pipeline side by side
+                    temp_filename = f"file_{sender}_{media_id}{ext}"
 
-                    send_message(sender, "🤖 Analyzing document...")
-                    background_tasks.add_task(process_file_background, media_id, sender, temp_filename)
+                    # Queued fairly across senders (admission.py); the pipeline sends "Analyzing document..."
+                    accepted, notice = admission.admit_file(sender, process_file_background, media_id, sender,
+                                                            temp_filename, request_id=current_request_id())
+                    if notice:
+                        # Not a progress ping: "Analyzing document..." would replace it in the outbox
+                        send_message(sender, notice)
 
             # 3. BUTTON CLICKS
             elif msg_type == 'interactive':
                 btn_id = msg['interactive']['button_reply']['id']
 
-                if sender in pending_actions:
-                    action = pending_actions[sender]
+                action = state.get("pending_actions", sender)
+                if action:
 
                     if btn_id == "save_file":
-                        send_message(sender, "🚀 Uploading to Drive...")
+                        send_message(sender, "🚀 Uploading to Drive...", outbox.PROGRESS)
                         try:
                             drive_service = authenticate_drive(sender)
-                            upload_to_drive(drive_service, action['local_path'], action['new_name'],
-                                            action['drive_folder_id'])
+                            file_id = upload_to_drive(drive_service, action['local_path'], action['new_name'],
+                                                      action['drive_folder_id'])
+                            drive_index.invalidate(sender)
+                            search_cache.invalidate_folder(sender, action['drive_folder_id'])
+                            text_index.index_file(sender, file_id, action['new_name'], action['drive_folder_id'],
+                                                  text_index.extract_text(action['local_path']))
+                            file_hashes.record(sender, file_id, file_hashes.file_md5(action['local_path']),
+                                               action['new_name'])
                             send_message(sender, f"✅ Saved to *{action['subject']}*")
                         except Exception as e:
                             send_message(sender, f"❌ Upload failed: {e}")
 
                         if os.path.exists(action['local_path']): os.remove(action['local_path'])
-                        del pending_actions[sender]
+                        state.delete("pending_actions", sender)
 
                     elif btn_id == "discard_file":
                         send_message(sender, "🚫 Discarded.")
                         if os.path.exists(action['local_path']): os.remove(action['local_path'])
-                        del pending_actions[sender]
+                        state.delete("pending_actions", sender)
 
     except Exception as e:
         print(f"❌ Webhook Error: {e}")
@@ -913,6 +1440,12 @@ async def receive_whatsapp(request: Request, background_tasks: BackgroundTasks):
 
 
 
+# --- METRICS (Prometheus text format) ---
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 # --- VERIFY WEBHOOK ---
 @app.get("/webhook")
 async def verify(request: Request):
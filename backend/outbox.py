@@ -0,0 +1,228 @@
+"""
+Outbound WhatsApp queue. send_message() and friends used to POST to the Graph API on
+the caller's thread, so a burst of pipelines hit Meta's per-number throughput limit
+with no pacing at all, and every status ping cost a full message.
+
+enqueue() returns at once; OUTBOX_WORKERS threads deliver in this order:
+
+- priority: RESULT (answers, saved-file replies) before PROGRESS ("Analyzing...",
+  "Uploading... 50%");
+- per recipient, first in first out, one message in flight at a time (WhatsApp shows
+  them in the order they arrive);
+- paced by a token bucket at WHATSAPP_MPS messages/second for this process (Meta's
+  Cloud API tier is 80/s per business number by default; split it between uvicorn workers).
+
+Coalescing: a message with a coalesce key (PROGRESS pings share "status" unless given
+one) replaces the recipient's queued message with the same key, and a RESULT drops that recipient's queued PROGRESS pings (the result says
+more than they would). Throttling replies (HTTP 429, Meta codes in THROTTLE_CODES) are
+retried with backoff; other errors are counted and dropped.
+
+Metrics: docs_manager_whatsapp_messages_total{result, priority}, the "whatsapp" span
+histograms (queue_wait, delivery) and the docs_manager_whatsapp_queue_depth gauge.
+"""
+import os
+import time
+import heapq
+import itertools
+import threading
+from tracing import observe, count, gauge, set_request_id, current_request_id
+
+RESULT, PROGRESS = 0, 1
+PRIORITY_NAMES = {RESULT: "result", PROGRESS: "progress"}
+
+WHATSAPP_MPS = float(os.getenv("WHATSAPP_MPS", "20"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_RETRIES = 5
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", "1.0"))  # Seconds, doubled per retry
+# 130429: throughput reached, 131056: too many messages to one user, 80007: account rate limit
+THROTTLE_CODES = {130429, 131056, 80007}
+
+_heap = []  # (priority, seq, message); cancelled messages stay until popped
+_depth = [0]  # Messages queued or being delivered
+_queued = {}  # (to, coalesce key) -> message still waiting
+_busy = {}  # to -> the message being delivered (or waiting to be retried) for that recipient
+_cond = threading.Condition()
+_seq = itertools.count()
+_workers = []
+
+
+class TokenBucket:
+    """`rate` tokens a second, at most `burst` saved up."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Blocks until a token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# A quarter second of burst: any rolling second stays within 1.25x WHATSAPP_MPS
+_bucket = TokenBucket(WHATSAPP_MPS, max(1.0, WHATSAPP_MPS / 4))
+
+
+class Message:
+    __slots__ = ("to", "payload", "deliver", "priority", "key", "enqueued_at", "not_before", "attempts",
+                 "request_id", "cancelled")
+
+    def __init__(self, to, payload, deliver, priority, key, request_id):
+        self.to, self.payload, self.deliver, self.priority, self.key = to, payload, deliver, priority, key
+        self.enqueued_at = time.perf_counter()
+        self.not_before = 0.0
+        self.attempts = 0
+        self.request_id = request_id
+        self.cancelled = False
+
+
+def _track(change):
+    _depth[0] += change
+    gauge("whatsapp_queue_depth", _depth[0])
+
+
+def enqueue(to, payload, deliver, priority=RESULT, coalesce=None):
+    """Queues payload for `to`; deliver(payload) does the POST and returns the response."""
+    if priority == PROGRESS and coalesce is None:
+        coalesce = "status"
+    _start()
+    with _cond:
+        if coalesce is not None:
+            queued = _queued.get((to, coalesce))
+            if queued is not None:
+                # Same slot: the newer text wins, the place in line stays
+                queued.payload = payload
+                count("whatsapp_messages", result="coalesced", priority=PRIORITY_NAMES[priority])
+                return
+        if priority == RESULT:
+            for key, queued in list(_queued.items()):
+                if key[0] == to and queued.priority == PROGRESS:
+                    queued.cancelled = True
+                    del _queued[key]
+                    _track(-1)
+                    count("whatsapp_messages", result="coalesced", priority="progress")
+
+        message = Message(to, payload, deliver, priority, coalesce, current_request_id())
+        if coalesce is not None:
+            _queued[(to, coalesce)] = message
+        heapq.heappush(_heap, (priority, next(_seq), message))
+        count("whatsapp_messages", result="queued", priority=PRIORITY_NAMES[priority])
+        _track(1)
+        _cond.notify()
+
+
+def _next():
+    """The best message whose recipient is free and whose backoff is over (waits for one). Holds _cond."""
+    while True:
+        skipped, found, wake_at = [], None, None
+        while _heap:
+            entry = heapq.heappop(_heap)
+            message = entry[2]
+            if message.cancelled:
+                continue
+            owner = _busy.get(message.to)
+            if owner is not None and owner is not message:
+                skipped.append(entry)
+            elif message.not_before > time.monotonic():
+                wake_at = min(wake_at or message.not_before, message.not_before)
+                skipped.append(entry)
+            else:
+                found = message
+                break
+        for entry in skipped:
+            heapq.heappush(_heap, entry)
+        if found is not None:
+            _busy[found.to] = found
+            if found.key is not None and _queued.get((found.to, found.key)) is found:
+                del _queued[(found.to, found.key)]  # Too late to merge into once it's being sent
+            return found
+        _cond.wait(timeout=None if wake_at is None else max(wake_at - time.monotonic(), 0.001))
+
+
+def _throttled(response):
+    if response is None:
+        return False
+    if response.status_code == 429:
+        return True
+    try:
+        return response.json().get("error", {}).get("code") in THROTTLE_CODES
+    except ValueError:
+        return False
+
+
+def _send(message):
+    """One delivery attempt. Returns True when the message is done with (sent or given up on)."""
+    priority = PRIORITY_NAMES[message.priority]
+    if message.attempts == 0:
+        observe("whatsapp", "queue_wait", time.perf_counter() - message.enqueued_at)
+    _bucket.take()
+    message.attempts += 1
+    started = time.perf_counter()
+    try:
+        response = message.deliver(message.payload)
+        error = None
+    except Exception as e:  # Network errors: worth another try
+        response, error = None, e
+    observe("whatsapp", "delivery", time.perf_counter() - started,
+            "ok" if response is not None and response.ok else "error")
+
+    if response is not None and response.ok:
+        count("whatsapp_messages", result="sent", priority=priority)
+        return True
+    if (error is not None or _throttled(response)) and message.attempts <= OUTBOX_RETRIES:
+        count("whatsapp_messages", result="retried", priority=priority)
+        message.not_before = time.monotonic() + OUTBOX_BACKOFF * 2 ** (message.attempts - 1)
+        return False
+    detail = error or (response.status_code, response.text[:200])
+    print(f"❌ WhatsApp message to {message.to} failed: {detail}")
+    count("whatsapp_messages", result="failed", priority=priority)
+    return True
+
+
+def _work():
+    while True:
+        with _cond:
+            message = _next()
+        set_request_id(message.request_id)
+        done = _send(message)
+        with _cond:
+            if done:
+                del _busy[message.to]
+                _track(-1)
+            else:
+                heapq.heappush(_heap, (message.priority, next(_seq), message))
+                # Keeps _busy: later messages to this recipient wait behind the retry
+            _cond.notify_all()
+
+
+def _start():
+    if _workers:
+        return
+    with _cond:
+        while len(_workers) < OUTBOX_WORKERS:
+            worker = threading.Thread(target=_work, name=f"outbox-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def drain(timeout=5.0):
+    """Waits (up to timeout seconds) for the queue to empty, e.g. before shutdown. True if it did."""
+    deadline = time.monotonic() + timeout
+    with _cond:
+        while _depth[0]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _cond.wait(timeout=min(remaining, 0.05))
+    return True
@@ -0,0 +1,129 @@
+"""
+Smaller, cheaper API responses for the dashboard and explorer endpoints.
+
+- CompressionMiddleware: brotli (if the `brotli` package is installed) or gzip for
+  responses over a size threshold, whichever the client accepts.
+- FastJSONResponse: serializes with orjson when it is installed (stdlib json otherwise)
+  and skips FastAPI's jsonable_encoder pass, which costs more than the encoding itself.
+- compact_listing(): drops webViewLink/iconLink when they are the standard Drive URLs
+  for the item's id/mimeType; frontend/src/api/drive.js rebuilds them (expandLinks).
+"""
+import gzip
+import json
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Plain json.dumps; same output, slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+# The URLs Drive returns for ordinary files and folders (anything else is sent as is)
+FILE_LINK = "https://drive.google.com/file/d/{id}/view?usp=drivesdk"
+FOLDER_LINK = "https://drive.google.com/drive/folders/{id}"
+ICON_LINK = "https://drive-thirdparty.googleusercontent.com/16/type/{mimeType}"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+# --- JSON ---
+def dumps(content):
+    """Compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+# --- DRIVE LINKS ---
+def compact_item(item):
+    """A file/folder dict without the links the client can rebuild from id and mimeType."""
+    item = dict(item)
+    view = (FOLDER_LINK if item.get("mimeType") == FOLDER_MIME else FILE_LINK).format(id=item.get("id"))
+    if item.get("webViewLink") == view:
+        del item["webViewLink"]
+    if item.get("iconLink") == ICON_LINK.format(mimeType=item.get("mimeType")):
+        del item["iconLink"]
+    return item
+
+
+def compact_listing(listing):
+    return {
+        "folders": [compact_item(f) for f in listing.get("folders", [])],
+        "files": [compact_item(f) for f in listing.get("files", [])],
+    }
+
+
+# --- COMPRESSION ---
+def pick_encoding(accept_encoding):
+    accepted = set()
+    for token in accept_encoding.split(","):
+        name, _, params = token.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete (non-streamed) responses of at least minimum_size bytes.
+    Streamed bodies, already-encoded responses and non-text types pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality  # 4 is about gzip's speed at a smaller size
+
+    def compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = pick_encoding(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if not encoding:
+            return await self.app(scope, receive, send)
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # Held until we know the body
+                return
+            if start is None:
+                return await send(message)
+
+            held, start = start, None
+            headers = MutableHeaders(scope=held)
+            body = message.get("body", b"") if message["type"] == "http.response.body" else b""
+            if (message["type"] != "http.response.body" or message.get("more_body")
+                    or len(body) < self.minimum_size or "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)):
+                await send(held)
+                return await send(message)
+
+            body = self.compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(held)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
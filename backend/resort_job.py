@@ -0,0 +1,349 @@
+"""
+Bulk re-sorting of the "Imported Documents" fallback folder.
+
+process_file_background drops anything it can't classify there (Case D). Once the
+user adds subjects, most of it has a home. run_resort(phone):
+
+1. Snapshots the folder's files (paged files.list) into a checkpoint.
+2. Classifies them in batches of RESORT_BATCH, RESORT_WORKERS batches at a time:
+   a local pass matches file names against the folder map first, and only the
+   leftovers of each batch go to Gemini, as one prompt of file names.
+3. Moves the classified files with batched files.update calls (addParents /
+   removeParents), up to MOVE_BATCH per HTTP request.
+4. Saves the checkpoint after every round. An interrupted job (restart, crash)
+   resumes from there the next time it is started.
+
+Progress and files/minute are kept in the shared state store (namespace "resort_jobs").
+"""
+import os
+import re
+import json
+import time
+import random
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import drive_index
+import drive_quota
+import search_cache
+import text_index
+from database import get_user, json_field
+from drive_quota import is_rate_limited, limited_scope
+from gemini_json import generate_json
+from google_auth import authenticate_drive
+from state_store import get_state_store
+from tracing import traced, span, count, submit
+
+FALLBACK_FOLDER = "Imported Documents"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+RESORT_BATCH = int(os.getenv("RESORT_BATCH", "20"))  # File names per Gemini prompt
+RESORT_WORKERS = int(os.getenv("RESORT_WORKERS", "4"))  # Batches classified at once
+MOVE_BATCH = 100  # Drive's limit of calls per batch request
+MOVE_RETRIES = 4
+MOVE_BACKOFF = float(os.getenv("MOVE_BACKOFF", "1.0"))  # Seconds before the first retry; doubles each time
+RESORT_POOL = ThreadPoolExecutor(max_workers=RESORT_WORKERS)
+
+RESORT_JOB_TTL = 7 * 24 * 3600
+RESORT_LOCK_TTL = 600  # Renewed every round; a crashed worker's lock expires after this
+# Set when the server shuts down: long jobs (this one, drive_import) stop at their next
+# checkpoint and resume from it the next time they are started
+SHUTDOWN = threading.Event()
+
+RESORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "files": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "subject": {"type": "string"},
+                    "unit": {"type": "string"},
+                },
+                "required": ["index", "subject"],
+            },
+        },
+    },
+    "required": ["files"],
+}
+
+
+def _words(text):
+    return " ".join(re.sub(r"[_\-.]+", " ", text).casefold().split())
+
+
+def sort_targets(folder_map):
+    """{subject: {"id": folder, "units": {unit: folder}}} for every folder except the fallback."""
+    targets = {}
+    for subject, entry in folder_map.items():
+        if subject == FALLBACK_FOLDER:
+            continue
+        if isinstance(entry, dict) and entry.get("id"):
+            targets[subject] = {"id": entry["id"], "units": entry.get("units") or {}}
+        elif isinstance(entry, str) and entry:
+            targets[subject] = {"id": entry, "units": {}}
+    return targets
+
+
+def _find_unit(text, units):
+    """The longest unit name that appears in text as whole words, or None."""
+    padded = f" {text} "
+    found = [u for u in units if f" {_words(u)} " in padded]
+    return max(found, key=len) if found else None
+
+
+def local_match(name, targets):
+    """
+    (subject, unit or None) from the file name alone, or None:
+    our own "Subject_Unit_Topic.pdf" names, or a name that mentions exactly one subject.
+    """
+    stem = os.path.splitext(name)[0]
+    parts = stem.split("_")
+    by_name = {_words(s): s for s in targets}
+
+    # 1. Named by the upload pipeline
+    subject = by_name.get(_words(parts[0]))
+    if subject and len(parts) > 1:
+        return subject, _find_unit(_words(parts[1]), targets[subject]["units"])
+
+    # 2. Mentions one subject somewhere
+    text = _words(stem)
+    mentioned = [s for key, s in by_name.items() if f" {key} " in f" {text} "]
+    if len(mentioned) == 1:
+        return mentioned[0], _find_unit(text, targets[mentioned[0]]["units"])
+    return None
+
+
+@traced("gemini")
+def classify_with_gemini(files, targets):
+    """{file_id: (subject, unit or None)} for the files Gemini could place, from their names."""
+    syllabus_lite = {subject: list(t["units"]) for subject, t in targets.items()}
+    listing = "\n".join(f"{i}. {f['name']}" for i, f in enumerate(files))
+    prompt = f"""
+    You are a File Name Sorter.
+    Match each file name below to one of these Subjects and Units:
+    {json.dumps(syllabus_lite)}
+
+    Files:
+    {listing}
+
+    Return JSON: {{"files": [{{"index": 0, "subject": "Exact Subject Name", "unit": "Exact Unit Name"}}]}}
+    Use "None" as the subject when a name gives no clue; leave unit empty if unsure.
+    """
+    reply = generate_json(prompt, RESORT_SCHEMA, "resort", required=("files",))
+
+    placed = {}
+    for item in reply.get("files", []):
+        index, subject = item.get("index"), item.get("subject")
+        if not isinstance(index, int) or not 0 <= index < len(files) or subject not in targets:
+            continue
+        unit = item.get("unit") if item.get("unit") in targets[subject]["units"] else None
+        placed[files[index]["id"]] = (subject, unit)
+    return placed
+
+
+def classify_batch(files, targets):
+    """Local pass first, then one Gemini call for whatever is left. Returns {file_id: (subject, unit)}."""
+    placed, leftovers = {}, []
+    for f in files:
+        match = local_match(f["name"], targets)
+        if match:
+            placed[f["id"]] = match
+        else:
+            leftovers.append(f)
+    count("resort_files", len(placed), method="local")
+
+    if leftovers:
+        by_gemini = classify_with_gemini(leftovers, targets)
+        count("resort_files", len(by_gemini), method="gemini")
+        placed.update(by_gemini)
+    count("resort_files", len(files) - len(placed), method="unsorted")
+    return placed
+
+
+@traced("drive")
+def list_folder_files(service, folder_id):
+    """Every file (not sub-folder) directly inside folder_id: [{"id", "name", "mimeType"}]."""
+    files, page_token = [], None
+    while True:
+        results = service.files().list(
+            q=f"'{folder_id}' in parents and trashed=false and mimeType != '{FOLDER_MIME}'",
+            fields="nextPageToken, files(id, name, mimeType)", pageSize=1000, pageToken=page_token
+        ).execute()
+        files += [{"id": f["id"], "name": f["name"], "mimeType": f.get("mimeType")}
+                  for f in results.get("files", []) if f.get("mimeType") != FOLDER_MIME]
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return files
+
+
+@traced("drive")
+def move_files(service, moves, source_id=None, per_second=0):
+    """
+    moves = [(file_id, target_folder_id)] out of source_id, or [(file_id, target_folder_id, source_id)].
+    One batch request per MOVE_BATCH files, paced to at most per_second moves (0 = unpaced);
+    rate-limited moves are retried with exponential backoff. Each batch request holds one
+    drive_quota slot, and its rate limits cut the limit like any other call's. Returns the
+    IDs that failed to move.
+    """
+    pending = {move[0]: (move[1], move[2] if len(move) > 2 else source_id) for move in moves}
+    failed = []
+
+    for attempt in range(MOVE_RETRIES + 1):
+        limited, scopes = {}, []
+
+        def on_reply(request_id, response, exception):
+            if exception is None:
+                return
+            rate_limited = is_rate_limited(exception)
+            if rate_limited:
+                scopes.append(limited_scope(exception))
+            if rate_limited and attempt < MOVE_RETRIES:
+                limited[request_id] = pending[request_id]
+            else:
+                print(f"⚠️ Move failed for {request_id}: {exception}")
+                failed.append(request_id)
+
+        items = list(pending.items())
+        for start in range(0, len(items), MOVE_BATCH):
+            chunk = items[start:start + MOVE_BATCH]
+            started = time.monotonic()
+            batch, user = service.new_batch_http_request(callback=on_reply), None
+            for file_id, (folder_id, parent_id) in chunk:
+                request = service.files().update(fileId=file_id, addParents=folder_id,
+                                                 removeParents=parent_id, fields="id")
+                user = getattr(request, "quota_user", None)
+                batch.add(request, request_id=file_id)
+            scopes.clear()
+            with span("drive", "resort.batch_update"), drive_quota.slot(user) as outcome:
+                count("drive_calls", op="drive.batch")
+                batch.execute()
+                outcome.extend(scopes[-1:])
+            if per_second:
+                time.sleep(max(0.0, len(chunk) / per_second - (time.monotonic() - started)))
+
+        if not limited:
+            break
+        count("drive_rate_limited", len(limited), op="move")
+        print(f"⏳ {len(limited)} moves rate-limited, retrying (attempt {attempt + 1})")
+        time.sleep(MOVE_BACKOFF * 2 ** attempt + random.random() * MOVE_BACKOFF)
+        pending = limited
+    return failed
+
+
+def job_status(phone):
+    """The user's job without its file snapshot, or None."""
+    job = get_state_store().get("resort_jobs", phone)
+    if job is None:
+        return None
+    job.pop("files", None)
+    return job
+
+
+def hold_lock(state, phone, owner):
+    """Renews this run's resort_lock. False if it expired and another run holds it now."""
+    held = []
+
+    def renew(current):
+        held.append(current in (None, owner))
+        return owner if held[-1] else current
+
+    # Compare-and-set in one step: two runs can't both find the lock free (or their own) and keep it
+    state.update("resort_lock", phone, renew, ttl=RESORT_LOCK_TTL)
+    return held[-1]
+
+
+def run_resort(phone, connect=None, notify=None):
+    """
+    Re-sorts the user's fallback folder, resuming an unfinished job if there is one.
+    connect() returns a Drive service (default: the user's stored token);
+    notify(phone, job) is called when the job finishes. Returns the job status.
+    """
+    state = get_state_store()
+    owner = uuid.uuid4().hex  # Only this run renews or releases the lock
+    if not state.add("resort_lock", phone, owner, ttl=RESORT_LOCK_TTL):
+        print(f"⏳ Re-sort already running for {phone}")
+        return job_status(phone)
+
+    try:
+        folder_map = json_field(get_user(phone), "folder_map", {})
+        fallback = folder_map.get(FALLBACK_FOLDER)
+        source_id = fallback.get("id") if isinstance(fallback, dict) else fallback
+        targets = sort_targets(folder_map)
+        if not source_id or not targets:
+            return None
+
+        service = (connect or (lambda: authenticate_drive(phone)))()
+
+        # 1. Resume the checkpoint, or snapshot the folder for a new job
+        job = state.get("resort_jobs", phone)
+        if not job or job["status"] != "running":
+            files = list_folder_files(service, source_id)
+            job = {"status": "running", "files": files, "total": len(files), "position": 0,
+                   "moved": 0, "unsorted": 0, "failed": 0, "seconds": 0.0, "files_per_minute": 0.0,
+                   "started_at": time.time()}
+            print(f"🗂️ Re-sorting {len(files)} files in {FALLBACK_FOLDER} for {phone}")
+        else:
+            print(f"🗂️ Resuming re-sort for {phone} at {job['position']}/{job['total']}")
+
+        while job["position"] < job["total"]:
+            if SHUTDOWN.is_set():
+                print(f"⏸️ Re-sort for {phone} paused at {job['position']}/{job['total']} (shutting down)")
+                return job_status(phone)
+            # A long job outlives one lock TTL: renew it at each checkpoint, stop if another run took over
+            if not hold_lock(state, phone, owner):
+                print(f"⚠️ Re-sort lock for {phone} was taken over at {job['position']}/{job['total']}, stopping")
+                count("resort_jobs", result="lock_lost")
+                return job_status(phone)
+            started = time.perf_counter()
+            round_files = job["files"][job["position"]:job["position"] + RESORT_BATCH * RESORT_WORKERS]
+
+            # 2. Classify this round's batches in parallel
+            batches = [round_files[i:i + RESORT_BATCH] for i in range(0, len(round_files), RESORT_BATCH)]
+            futures = [submit(RESORT_POOL, classify_batch, batch, targets) for batch in batches]
+            placed = {}
+            for batch, future in zip(batches, futures):
+                try:
+                    placed.update(future.result())
+                except Exception as e:
+                    print(f"⚠️ Re-sort batch failed ({len(batch)} files left in place): {e}")
+                    job["failed"] += len(batch)
+                    placed.update({f["id"]: None for f in batch})
+
+            # 3. Move what found a home
+            moves = []
+            for file_id, match in placed.items():
+                if match:
+                    subject, unit = match
+                    moves.append((file_id, targets[subject]["units"].get(unit) or targets[subject]["id"]))
+            failed = move_files(service, moves, source_id) if moves else []
+            if moves:
+                text_index.update_folders(phone, [m for m in moves if m[0] not in failed])
+                drive_index.invalidate(phone)
+                for folder_id in {source_id, *(folder_id for _, folder_id in moves)}:
+                    search_cache.invalidate_folder(phone, folder_id)
+
+            # 4. Checkpoint
+            job["moved"] += len(moves) - len(failed)
+            job["failed"] += len(failed)
+            job["unsorted"] += sum(1 for f in round_files if f["id"] not in placed)
+            job["position"] += len(round_files)
+            job["seconds"] += time.perf_counter() - started
+            job["files_per_minute"] = round(job["position"] / job["seconds"] * 60, 1) if job["seconds"] else 0.0
+            state.set("resort_jobs", phone, job, ttl=RESORT_JOB_TTL)
+            print(f"   🗂️ {job['position']}/{job['total']} | moved {job['moved']} | "
+                  f"{job['files_per_minute']:.0f} files/min")
+
+        # Done: keep the counts, drop the snapshot
+        job.update(status="done", files=[], finished_at=time.time())
+        state.set("resort_jobs", phone, job, ttl=RESORT_JOB_TTL)
+        count("resort_jobs", result="done")
+        if notify:
+            notify(phone, job)
+        return job_status(phone)
+
+    finally:
+        if state.get("resort_lock", phone) == owner:
+            state.delete("resort_lock", phone)
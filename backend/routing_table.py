@@ -0,0 +1,192 @@
+"""
+Where a sorted file goes. Gemini answers with a subject and unit name; they used to be
+looked up in folder_map as-is, so "physics", "Unit-1" or "Unit I" all fell through to
+"Imported Documents".
+
+table_for(folder_map) compiles the map once per version (keyed by its JSON, so any
+change to the map is a new table) into:
+
+- subjects and units by normalized name (case, spacing, "_-." separators, "&");
+- aliases: "unit1" / "unit i" / "u1" / "1" for "Unit 1", the title after "Unit 1:",
+  a multi-word subject's initials ("dbms"). An alias two folders share is dropped;
+- a fuzzy fallback (difflib) over the same keys, for typos and near misses;
+- the prompt summaries (sort_prompt: subjects with their units, subjects_prompt: names).
+
+route() is then a couple of dict lookups; only a name nothing matched exactly pays for
+the fuzzy pass (~0.5 ms, remembered per table). Tables are cached per process
+(ROUTING_CACHE_SIZE maps).
+"""
+import os
+import re
+import json
+import difflib
+import threading
+from collections import OrderedDict
+from tracing import count
+
+FALLBACK_FOLDER = "Imported Documents"
+ROUTING_CACHE_SIZE = int(os.getenv("ROUTING_CACHE_SIZE", "1024"))
+FUZZY_CUTOFF = 0.8  # difflib ratio; "physcis" -> "physics" is 0.86, "maths" -> "math" 0.89
+FUZZY_MEMO = 256  # Near-match answers remembered per table (Gemini repeats its spellings)
+
+ROMAN = ["i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x", "xi", "xii"]
+NUMBERED = re.compile(r"^(unit|module|chapter|part|week|lab)\s*([0-9]+|[ivx]+)\b\s*[:\-]?\s*(.*)$")
+
+_tables = OrderedDict()  # folder_map JSON -> RoutingTable, least recently used first
+_lock = threading.Lock()
+
+
+def normalize(name):
+    """Lowercase words, no separators: "Unit-1 " -> "unit 1", "Maths_&_Stats" -> "maths and stats"."""
+    text = str(name or "").casefold().replace("&", " and ")
+    return " ".join(re.sub(r"[_\-.:,'\"()]+", " ", text).split())
+
+
+def _numbers(key):
+    """The numbers in a normalized name ("unit 3" -> ("3",)); near matches must agree on them."""
+    return tuple(w for w in key.split() if w.isdigit() or w in ROMAN)
+
+
+def _unit_aliases(name):
+    """Other ways to say a numbered unit: "Unit 3: Optics" -> unit3, unit iii, u3, 3, iii, optics."""
+    match = NUMBERED.match(normalize(name))
+    if not match:
+        return []
+    word, number, title = match.groups()
+    if number.isdigit():
+        numbers = [number] + ([ROMAN[int(number) - 1]] if 0 < int(number) <= len(ROMAN) else [])
+    elif number in ROMAN:
+        numbers = [number, str(ROMAN.index(number) + 1)]
+    else:
+        return []
+    aliases = [alias for n in numbers for alias in (f"{word} {n}", f"{word}{n}", f"{word[0]}{n}", n)]
+    return aliases + ([title] if title else [])
+
+
+def _subject_aliases(name):
+    """A multi-word subject's initials ("Database Management Systems" -> dbms) and its squashed form."""
+    words = normalize(name).replace(" and ", " ").split()
+    aliases = ["".join(words)]
+    if len(words) > 1:
+        aliases.append("".join(w[0] for w in words))
+    return aliases
+
+
+class _Lookup:
+    """Exact normalized names first, then unambiguous aliases, then a fuzzy match over both."""
+
+    def __init__(self, names, make_aliases):
+        self.exact = {}
+        for name in names:
+            self.exact.setdefault(normalize(name), name)
+        aliases, clashes = {}, set()
+        for name in names:
+            for alias in make_aliases(name):
+                if alias in self.exact or alias in clashes:
+                    continue
+                if alias in aliases and aliases[alias] != name:
+                    clashes.add(alias)
+                    del aliases[alias]
+                else:
+                    aliases[alias] = name
+        self.aliases = aliases
+        self.keys = {}  # numbers -> keys: "unit 7" must not come out as "unit 1", however similar
+        for key in list(self.exact) + list(aliases):
+            self.keys.setdefault(_numbers(key), []).append(key)
+        self.fuzzy = {}  # normalized name -> folder name or None
+
+    def find(self, name):
+        """(folder name, "exact" | "alias" | "fuzzy") or (None, "miss")."""
+        key = normalize(name)
+        if not key:
+            return None, "miss"
+        if key in self.exact:
+            return self.exact[key], "exact"
+        if key in self.aliases:
+            return self.aliases[key], "alias"
+        # Tables are shared across threads: the memo is only ever a cache, never read back after a write
+        name = self.fuzzy.get(key, False)
+        if name is False:
+            close = difflib.get_close_matches(key, self.keys.get(_numbers(key), []), n=1, cutoff=FUZZY_CUTOFF)
+            name = (self.exact.get(close[0]) or self.aliases[close[0]]) if close else None
+            if len(self.fuzzy) >= FUZZY_MEMO:
+                self.fuzzy.clear()
+            self.fuzzy[key] = name
+        return (name, "fuzzy") if name else (None, "miss")
+
+
+class RoutingTable:
+    """A compiled folder_map: folder IDs by subject/unit, their lookups and the prompt summaries."""
+
+    def __init__(self, folder_map):
+        self.subject_ids, self.unit_ids = {}, {}
+        for subject, entry in folder_map.items():
+            if isinstance(entry, dict):
+                self.subject_ids[subject] = entry.get("id")
+                self.unit_ids[subject] = dict(entry.get("units") or {})
+            else:
+                self.subject_ids[subject] = entry  # Utility folders are stored as a bare ID
+                self.unit_ids[subject] = {}
+        self.subjects = _Lookup(list(self.subject_ids), _subject_aliases)
+        self.units = {subject: _Lookup(list(units), _unit_aliases) for subject, units in self.unit_ids.items()}
+
+        self.sort_prompt = json.dumps({subject: list(units) for subject, units in self.unit_ids.items()})
+        self.subjects_prompt = json.dumps(list(self.subject_ids))
+
+    def subject_folder(self, name):
+        """(subject, folder ID) for a subject name as Gemini wrote it, or (None, None)."""
+        subject, _ = self.subjects.find(name)
+        return (subject, self.subject_ids.get(subject)) if subject else (None, None)
+
+    def route(self, decision, staging_folder_id):
+        """
+        (folder ID, name for the reply) for Gemini's {"subject", "unit"}: the unit folder,
+        else the subject folder, else "Imported Documents", else the staging folder.
+        """
+        subject, how = self.subjects.find(decision.get("subject"))
+        if subject and subject != FALLBACK_FOLDER and self.subject_ids.get(subject):
+            unit, unit_how = self.units[subject].find(decision.get("unit")) if self.unit_ids[subject] else (None, "miss")
+            if unit:
+                count("routing", result="unit", match=how if unit_how == "exact" else unit_how)
+                return self.unit_ids[subject][unit], f"{subject} > {unit}"
+            count("routing", result="subject", match=how)
+            # Subjects with units say which part of them; utility folders are just named
+            return self.subject_ids[subject], f"{subject} (Root)" if self.unit_ids[subject] else subject
+
+        count("routing", result="fallback", match=how)
+        if self.subject_ids.get(FALLBACK_FOLDER):
+            return self.subject_ids[FALLBACK_FOLDER], FALLBACK_FOLDER
+        # Last resort: leave it where it was staged (Root Folder)
+        return staging_folder_id, "Home Folder"
+
+
+def table_for(folder_map):
+    """
+    The compiled table for a folder_map: the users row's JSON text (cheapest: it is the
+    cache key as is) or the decoded dict. Compiled on first use, then cached. A table
+    passed in is returned as is.
+    """
+    if isinstance(folder_map, RoutingTable):
+        return folder_map
+    if isinstance(folder_map, str):
+        key = folder_map
+    else:
+        key = json.dumps(folder_map or {}, sort_keys=True)
+    with _lock:
+        table = _tables.get(key)
+        if table is not None:
+            _tables.move_to_end(key)
+            count("routing_tables", result="hit")
+            return table
+
+    try:
+        decoded = json.loads(key) if isinstance(folder_map, str) else folder_map
+    except ValueError:
+        decoded = {}
+    table = RoutingTable(decoded if isinstance(decoded, dict) else {})
+    count("routing_tables", result="build")
+    with _lock:
+        _tables[key] = table
+        while len(_tables) > ROUTING_CACHE_SIZE:
+            _tables.popitem(last=False)
+    return table
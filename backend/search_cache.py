@@ -0,0 +1,72 @@
+"""
+Per-user cache of WhatsApp search results, so a repeated query ("physics notes")
+skips both the Gemini intent call and the Drive search.
+
+Entries live in the shared state store for SEARCH_CACHE_TTL seconds, keyed by the
+normalized query text. Each remembers the scope its results came from (a folder ID,
+or "global" for the whole Drive) and that scope's generation; an upload into a
+folder bumps the generation of that folder and of "global", which retires exactly
+the entries it could have changed.
+
+The last search's position is kept as a cursor, so replying "more" pages through
+the cached result set instead of searching again.
+"""
+import os
+from state_store import get_state_store
+from tracing import count
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+CURSOR_TTL = 600
+PAGE_SIZE = 5
+
+MORE_WORDS = {"more", "more results", "next", "show more"}
+
+
+def normalize(query):
+    return " ".join(query.lower().split())
+
+
+def is_more_request(text):
+    return normalize(text) in MORE_WORDS
+
+
+def _generation(phone, scope):
+    return get_state_store().get("search_generation", f"{phone}:{scope}", 0)
+
+
+def get(phone, query):
+    """The cached {"intent", "files", "scope"} for this query, or None if absent or stale."""
+    entry = get_state_store().get("search_results", f"{phone}:{normalize(query)}")
+    if entry is None or entry["generation"] != _generation(phone, entry["scope"]):
+        count("search_cache_lookups", result="miss")
+        return None
+    count("search_cache_lookups", result="hit")
+    return entry
+
+
+def put(phone, query, intent, files, scope):
+    """Caches a search's results (scope None = the search failed; not cached)."""
+    if scope is None:
+        return
+    get_state_store().set("search_results", f"{phone}:{normalize(query)}", {
+        "intent": intent, "files": files, "scope": scope, "generation": _generation(phone, scope),
+    }, ttl=SEARCH_CACHE_TTL)
+
+
+def invalidate_folder(phone, folder_id):
+    """A file landed in folder_id: retire that folder's entries and every whole-Drive one."""
+    state = get_state_store()
+    for scope in dict.fromkeys((folder_id, "global")):
+        if scope:
+            key = f"{phone}:{scope}"
+            state.set("search_generation", key, state.get("search_generation", key, 0) + 1)
+
+
+def save_cursor(phone, query, parent_id, offset, intent):
+    get_state_store().set("search_cursor", phone, {
+        "query": query, "parent_id": parent_id, "offset": offset, "intent": intent,
+    }, ttl=CURSOR_TTL)
+
+
+def get_cursor(phone):
+    return get_state_store().get("search_cursor", phone)
@@ -0,0 +1,251 @@
+"""
+Local ranking for searches whose words don't line up with file names
+("last year's dbms question paper" vs "DBMS_Unit 3_PYQ 2023.pdf"), with no external calls.
+
+Every file in text_index (name, subject/unit path, start of its text) becomes a hashed
+TF-IDF vector: words plus character 3-grams (which survive typos and word-form changes)
+are hashed into SEMANTIC_DIM signed buckets, weighted by sublinear tf x idf and
+L2-normalized. A user's vectors form one float32 matrix kept in memory, so a query is a
+single matrix-vector product plus a top-k partition.
+
+Matrices are built on first use and cached per process (at most SEMANTIC_CACHE_MB).
+text_index bumps the user's "doc_generation" when it adds a file and "doc_layout" when
+files move or are replaced. New files are appended to the cached matrix (with its idf);
+it is rebuilt from scratch after a layout change or once the appended part grows past
+REBUILD_RATIO. NumPy is optional: without it search() returns nothing and search stays
+name + full-text.
+"""
+import os
+import re
+import zlib
+import threading
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from database import connect, get_user, json_field
+from state_store import get_state_store
+from text_index import STOPWORDS
+from tracing import traced, count
+
+SEMANTIC_DIM = int(os.getenv("SEMANTIC_DIM", "512"))  # 100k files x 512 x 4 bytes = 205 MB
+SEMANTIC_CACHE_MB = int(os.getenv("SEMANTIC_CACHE_MB", "512"))
+SEMANTIC_MIN_SCORE = 0.2  # Cosine below this is noise at this dimension
+IDF_BITS = 18  # Document frequencies are counted over 2^18 feature buckets (before folding)
+REBUILD_RATIO = 0.25
+
+NAME_WEIGHT, PATH_WEIGHT, BODY_WEIGHT = 1.0, 0.6, 0.2
+NGRAM_WEIGHT = 1.0  # Same as a whole word: 3-grams are what survives a typo
+BODY_CHARS = 2000  # The start of a file's text says what it is about; the rest adds noise
+BODY_WORDS = 50
+
+_matrices = OrderedDict()  # phone -> cached index, least recently used first
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def numpy_module():
+    """numpy, imported on first use (it costs ~100 ms at startup), or None if not installed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _words(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _hash(feature):
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+def features(name, path="", body=""):
+    """[(hash, weight)] for a file: words and 3-grams of its name and path, words of its text."""
+    out = []
+    for text, weight in ((name, NAME_WEIGHT), (path, PATH_WEIGHT)):
+        for word in _words(text):
+            out.append((_hash("w:" + word), weight))
+            padded = f"#{word}#"
+            out += [(_hash("g:" + padded[i:i + 3]), weight * NGRAM_WEIGHT) for i in range(len(padded) - 2)]
+    for word in list(dict.fromkeys(_words(body[:BODY_CHARS])))[:BODY_WORDS]:
+        out.append((_hash("w:" + word), BODY_WEIGHT))
+    return out
+
+
+def folder_paths(folder_map):
+    """{folder_id: "Subject Unit"} so a file's location counts as part of its description."""
+    paths = {}
+    for subject, entry in folder_map.items():
+        if isinstance(entry, dict):
+            if entry.get("id"):
+                paths[entry["id"]] = subject
+            for unit, unit_id in (entry.get("units") or {}).items():
+                paths[unit_id] = f"{subject} {unit}"
+        elif entry:
+            paths[entry] = subject
+    return paths
+
+
+def _flatten(docs, first_row=0):
+    """(row, hash, weight) arrays for docs = [(name, path, body)]."""
+    np = numpy_module()
+    rows, hashes, weights = array("I"), array("I"), array("f")
+    for i, (name, path, body) in enumerate(docs, first_row):
+        feats = features(name, path, body)
+        rows.extend([i] * len(feats))
+        hashes.extend(h for h, _ in feats)
+        weights.extend(w for _, w in feats)
+    return (np.frombuffer(rows, dtype=np.uint32), np.frombuffer(hashes, dtype=np.uint32),
+            np.frombuffer(weights, dtype=np.float32))
+
+
+def _vectors(rows, hashes, weights, n_rows, idf, dim, first_row=0):
+    """Folds the (row, hash, weight) triples into an L2-normalized float32 matrix of n_rows."""
+    np = numpy_module()
+    key = (rows.astype(np.uint64) << np.uint64(32)) | hashes.astype(np.uint64)
+    unique, inverse = np.unique(key, return_inverse=True)
+    tf = np.bincount(inverse.ravel(), weights=weights, minlength=len(unique))
+    u_rows = (unique >> np.uint64(32)).astype(np.int64) - first_row
+    u_hash = (unique & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    sign = np.where(u_hash >> 31, 1.0, -1.0)  # Signed hashing: collisions cancel out on average
+    values = np.log1p(tf) * idf[u_hash >> (32 - IDF_BITS)] * sign
+    matrix = np.zeros((n_rows, dim), dtype=np.float32)
+    np.add.at(matrix, (u_rows, (u_hash % dim).astype(np.int64)), values.astype(np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-9)
+    return matrix
+
+
+def build(docs, dim=SEMANTIC_DIM):
+    """(matrix, idf) for docs = [(name, path, body)]."""
+    np = numpy_module()
+    if not docs:
+        return np.zeros((0, dim), dtype=np.float32), np.ones(2 ** IDF_BITS, dtype=np.float32)
+    rows, hashes, weights = _flatten(docs)
+    pairs = np.unique((rows.astype(np.uint64) << np.uint64(32)) | hashes.astype(np.uint64))
+    df = np.bincount(((pairs & np.uint64(0xFFFFFFFF)) >> np.uint64(32 - IDF_BITS)).astype(np.int64),
+                     minlength=2 ** IDF_BITS)
+    idf = (np.log((len(docs) + 1) / (df + 1)) + 1).astype(np.float32)
+    return _vectors(rows, hashes, weights, len(docs), idf, dim), idf
+
+
+def query_vector(text, idf, dim=SEMANTIC_DIM):
+    text = " ".join(w for w in _words(text) if w not in STOPWORDS)
+    rows, hashes, weights = _flatten([(text, "", "")])
+    return _vectors(rows, hashes, weights, 1, idf, dim)[0]
+
+
+def top_matches(matrix, vector, limit, mask=None):
+    """[(row, score)] of the best rows by cosine (one matrix-vector product), best first."""
+    np = numpy_module()
+    scores = matrix @ vector
+    if mask is not None:
+        scores = np.where(mask, scores, -1.0)
+    limit = min(limit, len(scores))
+    if not limit:
+        return []
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best])]
+    return [(int(row), float(scores[row])) for row in best]
+
+
+# --- PER-USER CACHE ---
+def _load_docs(phone, after_id=0):
+    """[(id, folder_id, name, body start)] for the user's indexed files newer than after_id."""
+    conn = connect()
+    try:
+        return conn.execute(
+            "SELECT f.id, f.folder_id, f.name, substr(t.body, 1, ?) FROM doc_files f "
+            "JOIN doc_text t ON t.rowid = f.id WHERE f.phone = ? AND f.id > ? ORDER BY f.id",
+            (BODY_CHARS, phone, after_id)
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def _evict():
+    budget = SEMANTIC_CACHE_MB * 1024 * 1024
+    while _matrices and sum(e["matrix"].nbytes + e["idf"].nbytes for e in _matrices.values()) > budget:
+        _matrices.popitem(last=False)
+
+
+def user_index(phone):
+    """The user's cached index, built or extended to match the latest doc_generation."""
+    np = numpy_module()
+    state = get_state_store()
+    generation, layout = state.get("doc_generation", phone, 0), state.get("doc_layout", phone, 0)
+    with _lock:
+        entry = _matrices.get(phone)
+        if entry is not None:
+            _matrices.move_to_end(phone)
+            if entry["generation"] == generation and entry["layout"] == layout:
+                count("semantic_index_lookups", result="hit")
+                return entry
+
+    paths = folder_paths(json_field(get_user(phone), "folder_map", {}))
+    new_rows = _load_docs(phone, entry["max_id"]) if entry is not None and entry["layout"] == layout else None
+
+    if new_rows is not None and len(entry["ids"]) + len(new_rows) <= entry["base_rows"] * (1 + REBUILD_RATIO):
+        # 1. Only new files since our copy was built: embed those with the existing idf
+        if new_rows:
+            first = len(entry["ids"])
+            rows, hashes, weights = _flatten([(name, paths.get(folder, ""), body or "")
+                                              for _, folder, name, body in new_rows], first)
+            added = _vectors(rows, hashes, weights, len(new_rows), entry["idf"], SEMANTIC_DIM, first)
+            entry = {**entry, "matrix": np.vstack([entry["matrix"], added]),
+                     "ids": np.concatenate([entry["ids"], np.array([r[0] for r in new_rows], dtype=np.int64)]),
+                     "folders": np.concatenate([entry["folders"], np.array([r[1] or "" for r in new_rows], dtype=object)]),
+                     "max_id": new_rows[-1][0]}
+        entry = {**entry, "generation": generation}
+        count("semantic_index_lookups", result="append")
+    else:
+        # 2. Full build (first use, moved/replaced files, or too much appended with a stale idf)
+        all_rows = _load_docs(phone)
+        matrix, idf = build([(name, paths.get(folder, ""), body or "") for _, folder, name, body in all_rows])
+        entry = {"generation": generation, "layout": layout, "matrix": matrix, "idf": idf,
+                 "ids": np.array([r[0] for r in all_rows], dtype=np.int64),
+                 "folders": np.array([r[1] or "" for r in all_rows], dtype=object),
+                 "max_id": all_rows[-1][0] if all_rows else 0, "base_rows": max(len(all_rows), 1)}
+        count("semantic_index_lookups", result="build")
+
+    with _lock:
+        _matrices[phone] = entry
+        _evict()
+    return entry
+
+
+@traced("search")
+def search(phone, query_text, folder_id=None, limit=10):
+    """
+    Files ranked by similarity to the query: [{"id", "name", "mimeType", "webViewLink", "score"}],
+    best first, only those scoring at least SEMANTIC_MIN_SCORE. [] without numpy or on errors.
+    """
+    np = numpy_module()
+    if np is None or not query_text.strip():
+        return []
+    try:
+        entry = user_index(phone)
+        if not len(entry["ids"]):
+            return []
+        vector = query_vector(query_text, entry["idf"])
+        mask = entry["folders"] == folder_id if folder_id else None
+        best = [(entry["ids"][row], score) for row, score in top_matches(entry["matrix"], vector, limit, mask)
+                if score >= SEMANTIC_MIN_SCORE]
+        if not best:
+            return []
+
+        conn = connect()
+        try:
+            ids = [int(doc_id) for doc_id, _ in best]
+            rows = {r[0]: r[1:] for r in conn.execute(
+                f"SELECT id, file_id, name, mime_type, link FROM doc_files WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+        finally:
+            conn.close()
+        # A file replaced since the matrix was built has a new row; its old one is skipped here
+        return [{"id": rows[i][0], "name": rows[i][1], "mimeType": rows[i][2], "webViewLink": rows[i][3],
+                 "score": round(score, 3)} for i, score in zip(ids, (s for _, s in best)) if i in rows]
+    except Exception as e:
+        print(f"❌ Semantic search error: {e}")
+        return []
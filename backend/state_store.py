@@ -0,0 +1,179 @@
+"""
+Shared state that used to live in module-level dicts in main.py: pending button
+actions, syllabus parse jobs and the WhatsApp message IDs we have already handled.
+Kept here, every uvicorn worker (and every process on the host) sees the same values.
+
+STATE_BACKEND=sqlite (default) stores it in the WAL-mode database file next to the
+users table. STATE_BACKEND=memory is a Redis-style in-process stand-in for a single
+worker (and the shape a Redis-backed store would implement):
+
+    get(namespace, key, default=None)
+    set(namespace, key, value, ttl=None)
+    add(namespace, key, value=True, ttl=None) -> True if the key was new
+    update(namespace, key, fn, default=None, ttl=None) -> fn(current value or default),
+        stored in one step (no other writer can get in between the read and the write)
+    delete(namespace, key)
+
+Values are anything json.dumps can take; ttl is in seconds.
+"""
+import os
+import json
+import time
+import threading
+from database import connect
+from tracing import traced
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+
+# Expired rows are swept every this many writes (reads skip them in the meantime)
+SWEEP_EVERY = 500
+
+
+class MemoryStateStore:
+    """Single-process store with Redis-like TTL semantics."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, namespace, key):
+        entry = self._data.get((namespace, key))
+        if entry and entry[1] is not None and entry[1] <= time.time():
+            del self._data[(namespace, key)]
+            return None
+        return entry
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._live(namespace, key)
+        return json.loads(entry[0]) if entry else default
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[(namespace, key)] = (json.dumps(value), expires_at)
+
+    def add(self, namespace, key, value=True, ttl=None):
+        with self._lock:
+            if self._live(namespace, key):
+                return False
+            self._data[(namespace, key)] = (json.dumps(value), time.time() + ttl if ttl else None)
+            return True
+
+    def update(self, namespace, key, fn, default=None, ttl=None):
+        with self._lock:
+            entry = self._live(namespace, key)
+            value = fn(json.loads(entry[0]) if entry else default)
+            self._data[(namespace, key)] = (json.dumps(value), time.time() + ttl if ttl else None)
+            return value
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+
+class SQLiteStateStore:
+    """The kv_state table in the shared database file; safe across worker processes."""
+
+    def __init__(self):
+        self._writes = 0
+
+    @traced("db", "state.get")
+    def get(self, namespace, key, default=None):
+        conn = connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv_state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else default
+
+    @traced("db", "state.set")
+    def set(self, namespace, key, value, ttl=None):
+        self._write(
+            "INSERT OR REPLACE INTO kv_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), time.time() + ttl if ttl else None)
+        )
+
+    @traced("db", "state.add")
+    def add(self, namespace, key, value=True, ttl=None):
+        now = time.time()
+        conn = connect()
+        try:
+            # Claim the key unless a live value exists: one statement, so workers can't both win
+            cursor = conn.execute(
+                "INSERT INTO kv_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE kv_state.expires_at IS NOT NULL AND kv_state.expires_at <= ?",
+                (namespace, key, json.dumps(value), now + ttl if ttl else None, now)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    @traced("db", "state.update")
+    def update(self, namespace, key, fn, default=None, ttl=None):
+        now = time.time()
+        conn = connect()
+        try:
+            # Takes the write lock before reading: a second worker's update waits for this one
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT value FROM kv_state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, now)
+            ).fetchone()
+            value = fn(json.loads(row[0]) if row else default)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), now + ttl if ttl else None)
+            )
+            conn.commit()
+            return value
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @traced("db", "state.delete")
+    def delete(self, namespace, key):
+        self._write("DELETE FROM kv_state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def _write(self, query, params):
+        self._writes += 1
+        conn = connect()
+        try:
+            conn.execute(query, params)
+            if self._writes % SWEEP_EVERY == 0:
+                conn.execute("DELETE FROM kv_state WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """The process-wide store picked by STATE_BACKEND."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STATE_BACKEND == "memory":
+                _store = MemoryStateStore()
+            elif STATE_BACKEND == "sqlite":
+                _store = SQLiteStateStore()
+            else:
+                raise ValueError(f"❌ Unknown STATE_BACKEND '{STATE_BACKEND}' (use 'sqlite' or 'memory')")
+    return _store
+
+
+def set_state_store(store):
+    """Plugs in another implementation (anything with get/set/add/delete)."""
+    global _store
+    with _store_lock:
+        _store = store
@@ -1,35 +1,33 @@
-
-import google.generativeai as genai
 import os
-import json
+import re
+import time
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from tracing import traced, span, count, submit
+from gemini_json import generate_json, load_genai, MODEL_NAME
+from database import get_cached_syllabus, save_cached_syllabus, syllabus_cache_stats
 
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
-def parse_syllabus_with_gemini(file_path):
-    """
-    Reads a Syllabus PDF/Image and returns a list of Subjects + Units.
-    Returns ONLY academic subjects found in the file.
-    """
-    print(f"📄 Parsing syllabus: {file_path}...")
+# Below this many extracted characters per page we treat the PDF as a scan
+MIN_TEXT_CHARS_PER_PAGE = 200
 
-    # 1. Upload File
-    myfile = genai.upload_file(file_path)
-    # Note: Ensure the model name is correct. "gemini-1.5-flash" or "gemini-pro" are common.
-    # "gemini-2.0-flash" might be experimental/preview.
-    model = genai.GenerativeModel("gemini-2.5-flash")
+# Long syllabi are parsed as page ranges in parallel, then merged
+CHUNK_PAGES = int(os.getenv("SYLLABUS_CHUNK_PAGES", "8"))
+CHUNK_RETRIES = 2
+CHUNK_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("SYLLABUS_CHUNK_WORKERS", "4")))
 
-    # 2. The Prompt (Strict JSON output)
-    prompt = """
+PROMPT = """
     Analyze this syllabus document. Extract the list of Subjects including Labs and their Units/Modules.
 
     Return ONLY a JSON object with this exact structure:
     {
-        "subjects": {
-            "Subject Name 1": ["Unit 1 Name", "Unit 2 Name"],
-            "Subject Name 2": ["Unit 1 Name", "Unit 2 Name"]
-        }
+        "subjects": [
+            {"name": "Subject Name 1", "units": ["Unit 1 Name", "Unit 2 Name"]},
+            {"name": "Subject Name 2", "units": ["Unit 1 Name", "Unit 2 Name"]}
+        ]
     }
 
     Rules:
@@ -37,17 +35,235 @@ def parse_syllabus_with_gemini(file_path):
     - If units don't have names, just use ["Unit 1", "Unit 2", ...].
     """
 
-    # 3. Generate
-    result = model.generate_content([myfile, prompt])
+# Gemini's schema subset has no free-form maps, so subjects come back as a list
+SUBJECTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "subjects": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "units": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["name", "units"],
+            },
+        },
+    },
+    "required": ["subjects"],
+}
+
+CHUNK_NOTE = """
+    This is only pages {first}-{last} of a {total}-page syllabus. List what appears on these pages,
+    even if a subject started on an earlier page. Return {{"subjects": []}} if there are none.
+    """
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
+@lru_cache(maxsize=None)
+def pdf_tools():
+    """(PdfReader, PdfWriter), imported on first use, or (None, None) without pypdf."""
     try:
-        # Clean up code blocks if Gemini adds them
-        clean_text = result.text.replace("```json", "").replace("```", "").strip()
-        parsed_data = json.loads(clean_text)
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:  # No local pre-pass; every syllabus goes through the file upload
+        return None, None
+    return PdfReader, PdfWriter
 
-        # 4. Return ONLY the subjects found (No defaults here!)
-        return parsed_data.get("subjects", {})
 
+def clean_text(text):
+    text = re.sub(r"[ \t]+", " ", text)
+    return re.sub(r"\n\s*\n+", "\n", text).strip()
+
+
+@traced("syllabus")
+def read_pdf_pages(file_path):
+    """
+    Returns the PDF's text layer, one string per page (empty for scanned pages),
+    or None for images and anything pypdf can't read.
+    """
+    PdfReader, _ = pdf_tools()
+    if PdfReader is None:
+        return None
+
+    with open(file_path, "rb") as f:
+        if not f.read(5).startswith(b"%PDF"):
+            return None
+
+    try:
+        reader = PdfReader(file_path)
+        return [clean_text(page.extract_text() or "") for page in reader.pages]
     except Exception as e:
-        print(f"❌ Parser Error: {e}")
-        return {} # Return empty dict instead of None to avoid crashes
\ No newline at end of file
+        print(f"⚠️ Text extraction failed, falling back to upload: {e}")
+        return None
+
+
+def has_text_layer(pages):
+    return bool(pages) and sum(len(p) for p in pages) >= MIN_TEXT_CHARS_PER_PAGE * len(pages)
+
+
+def page_ranges(total, size=None):
+    """[(first, last), ...] 1-based and inclusive, `size` pages each."""
+    size = max(1, size or CHUNK_PAGES)
+    return [(first, min(first + size - 1, total)) for first in range(1, total + 1, size)]
+
+
+def write_pdf_range(file_path, first, last):
+    """Copies pages first..last into their own PDF (for scanned syllabi) and returns its path."""
+    PdfReader, PdfWriter = pdf_tools()
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for index in range(first - 1, last):
+        writer.add_page(reader.pages[index])
+    part_path = f"{file_path}.p{first}-{last}.pdf"
+    with open(part_path, "wb") as f:
+        writer.write(f)
+    return part_path
+
+
+def merge_subjects(parts):
+    """
+    Merges per-chunk {subject: [units]} dicts in page order. A subject split across
+    chunks (or repeated in a later semester's table) keeps its first spelling and
+    collects every distinct unit once.
+    """
+    merged, names = {}, {}
+    for subjects in parts:
+        for subject, units in (subjects or {}).items():
+            key = " ".join(str(subject).split()).casefold()
+            if not key:
+                continue
+            name = names.setdefault(key, " ".join(str(subject).split()))
+            bucket = merged.setdefault(name, [])
+            seen = {u.casefold() for u in bucket}
+            for unit in units or []:
+                unit = " ".join(str(unit).split())
+                if unit and unit.casefold() not in seen:
+                    seen.add(unit.casefold())
+                    bucket.append(unit)
+    return merged
+
+
+def subjects_to_dict(subjects):
+    """[{"name": ..., "units": [...]}, ...] -> {"Subject Name": [units]} (the shape the rest of the app uses)."""
+    return merge_subjects({item.get("name", ""): item.get("units", [])} for item in subjects or [])
+
+
+def upload_for_gemini(path):
+    with span("gemini", "upload_file"):
+        return load_genai().upload_file(path)
+
+
+@traced("gemini")
+def parse_chunk(model, make_contents, label):
+    """
+    Runs one page range through Gemini, retrying just this range on API or JSON errors
+    (generate_json doesn't retry itself here: a re-upload may be needed too).
+    make_contents() builds the prompt (and uploads the pages if needed) for each attempt.
+    """
+    for attempt in range(CHUNK_RETRIES + 1):
+        try:
+            reply = generate_json(make_contents(), SUBJECTS_SCHEMA, "syllabus", required=("subjects",),
+                                  retries=0, model=model)
+            subjects = subjects_to_dict(reply["subjects"])
+            count("syllabus_chunks", result="ok" if attempt == 0 else "retried")
+            return subjects
+        except Exception as e:
+            print(f"⚠️ Syllabus chunk {label} failed (attempt {attempt + 1}/{CHUNK_RETRIES + 1}): {e}")
+            if attempt == CHUNK_RETRIES:
+                count("syllabus_chunks", result="failed")
+                raise
+            time.sleep(2 ** attempt)
+
+
+@traced("gemini")
+def parse_syllabus_with_gemini(file_path, on_progress=None):
+    """
+    Reads a Syllabus PDF/Image and returns a list of Subjects + Units.
+    Returns ONLY academic subjects found in the file.
+
+    Identical files (same bytes) are answered from a cache shared by all users.
+    Text-based PDFs send their extracted text; only scans and images are uploaded.
+    Documents longer than CHUNK_PAGES are parsed as page ranges in parallel and merged;
+    a failing range is retried on its own and, if it still fails, left out.
+    on_progress(stage, percent) is called as the parse moves along.
+    """
+    print(f"📄 Parsing syllabus: {file_path}...")
+    report = on_progress or (lambda stage, percent: None)
+
+    # 0. Same syllabus as someone else (or as last time)?
+    report("checking cache", 5)
+    content_hash = file_sha256(file_path)
+    cached = get_cached_syllabus(content_hash)
+    if cached:
+        count("syllabus_cache_lookups", result="hit")
+        count("syllabus_cache_seconds_saved", cached["parse_seconds"] or 0)
+        stats = syllabus_cache_stats()
+        print(f"♻️ Syllabus cache hit (saved ~{cached['parse_seconds'] or 0:.1f}s) | "
+              f"hit rate {stats['hit_rate']:.0%}, {stats['seconds_saved']}s saved so far")
+        return cached["subjects"]
+    count("syllabus_cache_lookups", result="miss")
+
+    started = time.perf_counter()
+    model = load_genai().GenerativeModel(MODEL_NAME)
+
+    # 1. Plan the chunks: page ranges of text, page ranges of a scanned PDF, or the whole file
+    report("reading document", 15)
+    pages = read_pdf_pages(file_path)
+    chunks, part_files = [], []
+    if has_text_layer(pages):
+        source = "text"
+        print(f"📝 Using extracted text ({sum(len(p) for p in pages)} chars) instead of uploading the file")
+        for first, last in page_ranges(len(pages)):
+            text = "\n".join(pages[first - 1:last])
+            note = CHUNK_NOTE.format(first=first, last=last, total=len(pages)) if len(pages) > CHUNK_PAGES else ""
+            chunks.append((f"p{first}-{last}", lambda text=text, note=note: [PROMPT + note, "Syllabus text:\n" + text]))
+    else:
+        # 2. Scanned PDF / image: multimodal upload, split by pages when it is long
+        source = "upload"
+        report("uploading to AI", 30)
+        if pages and pdf_tools()[1] is not None and len(pages) > CHUNK_PAGES:
+            for first, last in page_ranges(len(pages)):
+                part_files.append(write_pdf_range(file_path, first, last))
+                note = CHUNK_NOTE.format(first=first, last=last, total=len(pages))
+                chunks.append((f"p{first}-{last}", lambda path=part_files[-1], note=note: [upload_for_gemini(path), PROMPT + note]))
+        else:
+            chunks.append(("all", lambda: [upload_for_gemini(file_path), PROMPT]))
+    count("syllabus_parses", source=source)
+
+    # 3. Map: parse the chunks in parallel
+    report("extracting subjects", 50)
+    if len(chunks) > 1:
+        print(f"✂️ Parsing {len(chunks)} page ranges in parallel")
+    results, failed = {}, []
+    try:
+        futures = {submit(CHUNK_POOL, parse_chunk, model, make_contents, label): label
+                   for label, make_contents in chunks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            label = futures[future]
+            try:
+                results[label] = future.result()
+            except Exception as e:
+                print(f"❌ Parser Error ({label}): {e}")
+                failed.append(label)
+            report("extracting subjects", 50 + 45 * done // len(chunks))
+    finally:
+        for part_path in part_files:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    # 4. Reduce: merge in page order. Return ONLY the subjects found (No defaults here!)
+    subjects = merge_subjects(results[label] for label, _ in chunks if label in results)
+    if failed:
+        print(f"⚠️ {len(failed)}/{len(chunks)} page ranges failed ({', '.join(failed)}); result may be incomplete")
+    elif subjects:
+        # Only complete parses are cached, so a retry later can still fill the gaps
+        save_cached_syllabus(content_hash, subjects, source, time.perf_counter() - started)
+    return subjects # Empty dict instead of None to avoid crashes
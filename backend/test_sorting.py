@@ -1,36 +1,57 @@
 import os
-import google.generativeai as genai
-from googleapiclient.http import MediaFileUpload
+import time
+import mimetypes
+import httplib2
 from dotenv import load_dotenv
+from tracing import traced
+from gemini_json import generate_json, load_genai
+from routing_table import table_for
 
 # 1. Import the shared Auth logic (Do not define it again below!)
 from google_auth import authenticate_drive
 
-# 2. Load Environment Variables
+# 2. Load Environment Variables (Gemini itself is configured on first use, see gemini_json.py)
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if not GEMINI_API_KEY:
-    raise ValueError("❌ Missing GEMINI_API_KEY in .env file")
-
-genai.configure(api_key=GEMINI_API_KEY)
+# Resumable upload tuning (Drive wants chunks in multiples of 256 KB, so we size them in MB)
+UPLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_UPLOAD_CHUNK_MB", "5")) * 1024 * 1024
+UPLOAD_MAX_RESUMES = int(os.getenv("DRIVE_UPLOAD_MAX_RESUMES", "5"))
+UPLOAD_RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
 
 # Add this import
 import json
 
+# Response schemas (Gemini's OpenAPI subset); fields are listed in the order we want them streamed
+SEARCH_INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_search": {"type": "boolean"},
+        "subject": {"type": "string"},
+        "keyword": {"type": "string"},
+    },
+    "required": ["is_search"],
+}
+
+SORT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "subject": {"type": "string"},
+        "unit": {"type": "string"},
+        "suggested_filename": {"type": "string"},
+    },
+    "required": ["subject", "unit", "suggested_filename"],
+}
+
+@traced("gemini")
 def parse_search_intent(user_text, folder_map):
     """
     Asks Gemini: 'User wants X. Which folder ID from this list matches?'
+    folder_map may be its routing_table.RoutingTable, which has the subject list ready.
     """
-    model = genai.GenerativeModel('gemini-2.5-flash')
-
-    # Simplify map for Gemini (Subject names only)
-    map_summary = list(folder_map.keys())
-
     prompt = f"""
     You are a Search Assistant.
     User Query: "{user_text}"
-    Available Folders: {json.dumps(map_summary)}
+    Available Folders: {table_for(folder_map).subjects_prompt}
 
     1. Did the user ask to FIND/GET/SHOW a file? (yes/no)
     2. Which 'Subject' from the list matches best? (If 'Aadhar', maybe 'Important Documents')
@@ -43,30 +64,33 @@ def parse_search_intent(user_text, folder_map):
     }}
     """
 
+    # Most messages aren't searches: stop reading as soon as "is_search" comes back false
+    def stop_unless_search(key, value):
+        return key == "is_search" and value is False
+
     try:
-        result = model.generate_content(prompt)
-        text = result.text.replace("```json", "").replace("```", "").strip()
-        return json.loads(text)
-    except:
+        return generate_json(prompt, SEARCH_INTENT_SCHEMA, "search_intent",
+                             required=("is_search",), on_field=stop_unless_search)
+    except Exception:
         return {"is_search": False}
 
 
 # --- FUNCTION 1: Ask Gemini (The Brain) ---
+@traced("gemini")
 def ask_gemini_to_sort(file_path, folder_map):
+    """folder_map (or its routing_table.RoutingTable) gives the subjects and units to pick from."""
     print("🤖 AI is analyzing the file...")
 
-    # Use the standard Flash model
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    myfile = genai.upload_file(file_path)
+    myfile = load_genai().upload_file(file_path)
 
-    # Simplify map for AI
-    syllabus_lite = {subj: list(data['units'].keys()) for subj, data in folder_map.items()}
+    # Simplify map for AI (compiled once per folder_map version)
+    syllabus_lite = table_for(folder_map).sort_prompt
 
     prompt = f"""
     You are a Document Sorter.
     Analyze the attached file.
     Match it to one of these Subjects and Units:
-    {json.dumps(syllabus_lite)}
+    {syllabus_lite}
 
     Return STRICT JSON:
     {{
@@ -76,28 +100,106 @@ def ask_gemini_to_sort(file_path, folder_map):
     }}
     """
 
-    result = model.generate_content(
-        [prompt, myfile],
-        generation_config={"response_mime_type": "application/json"}
-    )
-    return json.loads(result.text)
+    return generate_json([prompt, myfile], SORT_SCHEMA, "sort", required=("subject",))
 
 
 # --- FUNCTION 2: Upload to Drive (The Action) ---
-def upload_to_drive(service, file_path, filename, folder_id):
-    print(f"🚀 Uploading '{filename}' to Drive...")
+def detect_mime_type(file_path):
+    """
+    Sniffs the first bytes of the file, falling back to the extension.
+    WhatsApp images all arrive as '.jpg' temp files, so the extension alone lies.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(12)
+
+    if head.startswith(b'%PDF'):
+        return 'application/pdf'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':  # WAV and AVI are RIFF too
+        return 'image/webp'
+
+    guessed, _ = mimetypes.guess_type(file_path)
+    return guessed or 'application/octet-stream'
 
-    file_metadata = {'name': filename, 'parents': [folder_id]}
 
-    # Auto-detect mime type (simple check)
-    mime_type = 'application/pdf'
-    if file_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-        mime_type = 'image/jpeg'
+def _is_transient_upload_error(error):
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        return error.resp.status in UPLOAD_RETRYABLE_STATUS
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
 
-    media = MediaFileUpload(file_path, mimetype=mime_type)
 
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+@traced("drive")
+def upload_to_drive(service, file_path, filename, folder_id, chunk_size=None, on_progress=None):
+    """
+    Uploads a local file and returns the new Drive file ID.
+
+    Files bigger than one chunk go through a resumable session: every chunk is
+    committed separately, and after a transient failure we ask Drive how far it
+    got and carry on from there instead of re-sending the whole file.
+    on_progress(fraction) is called after each committed chunk.
+    """
+    from googleapiclient.http import MediaFileUpload
+    print(f"🚀 Uploading '{filename}' to Drive...")
+
+    file_metadata = {'name': filename, 'parents': [folder_id or 'root']}
+    mime_type = detect_mime_type(file_path)
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+
+    # Small files: one multipart request is cheaper than opening a session
+    if os.path.getsize(file_path) <= chunk_size:
+        media = MediaFileUpload(file_path, mimetype=mime_type)
+        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        if on_progress:
+            on_progress(1.0)
+        print(f"✅ Success! File ID: {file.get('id')}")
+        return file.get('id')
+
+    media = MediaFileUpload(file_path, mimetype=mime_type, chunksize=chunk_size, resumable=True)
+    request = service.files().create(body=file_metadata, media_body=media, fields='id')
+
+    file = None
+    resumes = 0
+    while file is None:
+        try:
+            # No num_retries here: the client's own retry re-sends an already consumed file slice
+            status, file = request.next_chunk()
+        except Exception as e:
+            if not _is_transient_upload_error(e) or resumes >= UPLOAD_MAX_RESUMES:
+                raise
+            # The request is now in its error state; the next call asks Drive for the committed range
+            resumes += 1
+            print(f"⚠️ Upload interrupted ({e}). Resuming ({resumes}/{UPLOAD_MAX_RESUMES})...")
+            time.sleep(min(2 ** resumes, 30))
+            continue
+
+        resumes = 0
+        if status and on_progress:
+            on_progress(status.progress())
+
+    if on_progress:
+        on_progress(1.0)
     print(f"✅ Success! File ID: {file.get('id')}")
+    return file.get('id')
+
+
+@traced("drive")
+def finalize_drive_upload(service, file_id, filename, folder_id, staging_folder_id):
+    """
+    Renames an already uploaded file and moves it from its staging folder
+    into the folder the AI picked. One metadata call, no bytes re-sent.
+    """
+    params = {'fileId': file_id, 'body': {'name': filename}, 'fields': 'id'}
+    if folder_id and folder_id != staging_folder_id:
+        params['addParents'] = folder_id
+        params['removeParents'] = staging_folder_id or 'root'
+
+    service.files().update(**params).execute()
+    print(f"📎 Finalized '{filename}' ({file_id})")
+    return file_id
 
 
 # --- FUNCTION 3: Local Testing Helper (Optional) ---
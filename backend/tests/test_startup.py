@@ -0,0 +1,42 @@
+"""
+Cold start: importing main stays cheap. No Gemini/Drive SDK imports and no database
+writes at import time; those happen in the lifespan hook or on first use.
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1000"))
+DEFERRED_MODULES = ("google.generativeai", "googleapiclient.discovery")
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import main
+print(json.dumps({{"import_ms": (time.perf_counter() - started) * 1000,
+                  "loaded": [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def import_main(scratch):
+    """Imports main in a fresh interpreter (cwd = scratch); returns the probe's report."""
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {k: v for k, v in os.environ.items() if k != "DB_PATH"}
+    env.update(PYTHONPATH=backend, WHATSAPP_TOKEN="test", PHONE_NUMBER_ID="test-phone", GEMINI_API_KEY="test")
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=scratch, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_main_within_budget(tmp_path):
+    import_main(tmp_path)  # Warm the OS page cache and .pyc files
+    import_ms = statistics.median(import_main(tmp_path)["import_ms"] for _ in range(3))
+    assert import_ms <= STARTUP_BUDGET_MS, f"import main took {import_ms:.0f} ms"
+
+
+def test_import_main_defers_sdks_and_database(tmp_path):
+    report = import_main(tmp_path)
+    assert report["loaded"] == []
+    assert not (tmp_path / "bot_memory.db").exists()
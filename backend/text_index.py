@@ -0,0 +1,169 @@
+"""
+Full-text search over the contents of the files users send us.
+
+The upload pipeline already has every file on local disk, so its text is extracted
+there (PDF text layer via pypdf, .docx via its XML; images have no text to read) and
+stored in a SQLite FTS5 table next to the file's Drive ID, name and folder. search()
+ranks a user's documents with BM25 (name matches weigh more than body matches) and
+returns a snippet around the hit for the WhatsApp reply.
+
+Tables (created in database.init_db): doc_files holds one row per (phone, file_id);
+doc_text is the FTS5 index, sharing doc_files' rowid. The phone is an indexed column,
+so a query only touches that user's postings.
+"""
+import os
+import re
+import html
+import time
+import sqlite3
+import zipfile
+import mimetypes
+from database import connect
+from syllabus_parser import read_pdf_pages
+from payloads import FILE_LINK
+from state_store import get_state_store
+from tracing import traced, count
+
+MAX_TEXT_CHARS = 200_000  # Enough for a long set of notes; bounds the index per file
+SNIPPET_TOKENS = 12
+SEARCH_RESULTS = 10  # Content hits added to a search
+SNIPPET_RESULTS = 5  # One WhatsApp page (search_cache.PAGE_SIZE)
+NAME_WEIGHT, BODY_WEIGHT = 5.0, 1.0
+
+# Words that say "search" rather than what to search for
+STOPWORDS = {"give", "get", "find", "search", "show", "me", "my", "the", "notes", "file", "on", "about", "for"}
+
+
+# --- EXTRACTION ---
+def read_docx(path):
+    """The paragraphs of a .docx as plain text ("" if it isn't one)."""
+    try:
+        with zipfile.ZipFile(path) as doc:
+            xml = doc.read("word/document.xml").decode("utf-8", "replace")
+    except (zipfile.BadZipFile, KeyError):
+        return ""
+    xml = re.sub(r"</w:p>|<w:br/>|<w:tab/>", "\n", xml)
+    return html.unescape(re.sub(r"<[^>]+>", "", xml))
+
+
+@traced("index")
+def extract_text(path):
+    """Searchable text of a local PDF or .docx, capped at MAX_TEXT_CHARS; "" for anything else."""
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == ".pdf":
+            text = "\n".join(read_pdf_pages(path) or [])
+        elif ext == ".docx":
+            text = read_docx(path)
+        else:
+            return ""
+    except Exception as e:  # The file still gets saved and found by name
+        print(f"⚠️ Text extraction failed for {path}: {e}")
+        return ""
+    return " ".join(text.split())[:MAX_TEXT_CHARS]
+
+
+# --- INDEXING ---
+def _bump(namespace, phone):
+    """Tells cached per-user views (semantic_index) that the user's documents changed."""
+    get_state_store().update(namespace, phone, lambda generation: generation + 1, default=0)
+
+
+@traced("db")
+def index_file(phone, file_id, name, folder_id, text, mime_type=None, link=None):
+    """Adds (or replaces) one file's entry."""
+    mime_type = mime_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+    conn = connect()
+    try:
+        row = conn.execute("SELECT id FROM doc_files WHERE phone = ? AND file_id = ?", (phone, file_id)).fetchone()
+        if row:
+            conn.execute("DELETE FROM doc_text WHERE rowid = ?", (row[0],))
+            conn.execute("DELETE FROM doc_files WHERE id = ?", (row[0],))
+        cur = conn.execute(
+            "INSERT INTO doc_files (phone, file_id, folder_id, name, mime_type, link, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (phone, file_id, folder_id, name, mime_type, link or FILE_LINK.format(id=file_id), time.time())
+        )
+        conn.execute("INSERT INTO doc_text (rowid, phone, name, body) VALUES (?, ?, ?, ?)",
+                     (cur.lastrowid, phone, name, text or ""))
+        conn.commit()
+        _bump("doc_layout" if row else "doc_generation", phone)
+        count("docs_indexed", with_text=bool(text))
+    except sqlite3.Error as e:
+        print(f"❌ Index Error: {e}")
+    finally:
+        conn.close()
+
+
+@traced("db")
+def update_folders(phone, moves):
+    """Keeps folder IDs current after files move: moves = [(file_id, folder_id), ...]."""
+    conn = connect()
+    try:
+        conn.executemany("UPDATE doc_files SET folder_id = ? WHERE phone = ? AND file_id = ?",
+                         [(folder_id, phone, file_id) for file_id, folder_id in moves])
+        conn.commit()
+        if moves:
+            _bump("doc_layout", phone)
+    except sqlite3.Error as e:
+        print(f"❌ Index Error: {e}")
+    finally:
+        conn.close()
+
+
+# --- SEARCH ---
+def keywords(query_text):
+    return [w for w in re.findall(r"\w+", query_text.lower()) if w not in STOPWORDS]
+
+
+def match_expression(phone, words, all_words=True):
+    """
+    An FTS5 query for this user's documents containing all (or any) of the words. No prefix
+    matching: the porter stemmer already folds "normalize"/"normalization", and a short prefix
+    can expand to thousands of terms.
+    """
+    terms = f" {'AND' if all_words else 'OR'} ".join(f'"{w}"' for w in words)
+    return f'phone : "{phone}" AND ({terms})'
+
+
+@traced("db")
+def search(phone, query_text, folder_id=None, limit=SEARCH_RESULTS):
+    """
+    Best BM25 matches for the query's keywords, all of them if possible, else any:
+    [{"id", "name", "mimeType", "webViewLink", "snippet"}]. Errors give [].
+    Only the first SNIPPET_RESULTS (one WhatsApp page) get a snippet.
+    """
+    words = keywords(query_text)
+    if not words:
+        return []
+
+    rank_sql = (
+        "SELECT f.id, f.file_id, f.name, f.mime_type, f.link "
+        "FROM doc_text JOIN doc_files f ON f.id = doc_text.rowid "
+        f"WHERE doc_text MATCH ? AND rank MATCH 'bm25(0.0, {NAME_WEIGHT}, {BODY_WEIGHT})'" +
+        (" AND f.folder_id = ?" if folder_id else "") +
+        " ORDER BY rank LIMIT ?"  # Sorted inside FTS5
+    )
+    conn = connect()
+    try:
+        for all_words in ((True, False) if len(words) > 1 else (True,)):
+            expression = match_expression(phone, words, all_words)
+            rows = conn.execute(rank_sql, [expression] + ([folder_id] if folder_id else []) + [limit]).fetchall()
+            if not rows:
+                continue
+
+            # snippet() re-reads the file's text, so it only runs for the rows shown first
+            top = [row[0] for row in rows[:SNIPPET_RESULTS]]
+            snippets = dict(conn.execute(
+                f"SELECT rowid, snippet(doc_text, 2, '*', '*', '…', {SNIPPET_TOKENS}) FROM doc_text "
+                f"WHERE doc_text MATCH ? AND rowid IN ({', '.join('?' * len(top))})", [expression] + top
+            ).fetchall())
+            # A name-only hit has no highlighted body text to show
+            return [{"id": file_id, "name": name, "mimeType": mime, "webViewLink": link,
+                     "snippet": snippets[rowid] if "*" in snippets.get(rowid, "") else None}
+                    for rowid, file_id, name, mime, link in rows]
+        return []
+    except sqlite3.Error as e:
+        print(f"❌ Full-text search error: {e}")
+        return []
+    finally:
+        conn.close()
@@ -0,0 +1,176 @@
+import os
+import time
+import json
+import uuid
+import bisect
+import threading
+import contextvars
+from functools import wraps
+
+# Print one JSON line per finished span (off by default, the histograms are always on)
+TRACE_LOG = os.getenv("TRACE_LOG", "0") == "1"
+
+# Seconds. Covers a ~1ms SQLite read up to a minute-long Gemini call.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+_histograms = {}  # (component, span, status) -> [bucket_counts, sum, count]
+_counters = {}  # (metric, sorted label items) -> value
+_gauges = {}  # (metric, sorted label items) -> last value
+_lock = threading.Lock()
+
+
+# --- REQUEST IDS ---
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+
+def set_request_id(request_id):
+    """Binds a request ID to the current context (webhook -> background job -> worker threads)."""
+    _request_id.set(request_id or new_request_id())
+    return _request_id.get()
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def submit(pool, fn, *args, **kwargs):
+    """pool.submit() that keeps the caller's request ID (executors don't copy contextvars)."""
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, fn, *args, **kwargs)
+
+
+# --- SPANS ---
+def observe(component, name, seconds, status="ok"):
+    key = (component, name, status)
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        hist[0][index] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+
+class _Span:
+    __slots__ = ("component", "name", "parent", "token", "started")
+
+    def __init__(self, component, name):
+        self.component = component
+        self.name = name
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.token = _current_span.set(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        _current_span.reset(self.token)
+        status = "ok" if exc_type is None else "error"
+        observe(self.component, self.name, elapsed, status)
+        if TRACE_LOG:
+            print(json.dumps({
+                "request_id": _request_id.get(),
+                "component": self.component,
+                "span": self.name,
+                "parent": self.parent,
+                "ms": round(elapsed * 1000, 2),
+                "status": status,
+            }))
+        return False
+
+
+def span(component, name):
+    """
+    Times a `with` block and files it under component ("db", "graph", "gemini", "drive", ...).
+    Exceptions are recorded as status="error" and re-raised untouched.
+    """
+    return _Span(component, name)
+
+
+def traced(component, name=None):
+    """Decorator version of span(); the span is named after the function by default."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(component, span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# --- COUNTERS ---
+def count(metric, amount=1, **labels):
+    """Adds to a counter, exported as docs_manager_<metric>_total{labels}."""
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def counter_value(metric, **labels):
+    with _lock:
+        return _counters.get((metric, tuple(sorted(labels.items()))), 0)
+
+
+def gauge(metric, value, **labels):
+    """Sets a gauge (a value that goes up and down), exported as docs_manager_<metric>{labels}."""
+    with _lock:
+        _gauges[(metric, tuple(sorted(labels.items())))] = value
+
+
+# --- PROMETHEUS EXPORT ---
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics():
+    """All span histograms and counters in the Prometheus text exposition format (version 0.0.4)."""
+    metric = "docs_manager_span_duration_seconds"
+    lines = [
+        f"# HELP {metric} Latency of traced operations (DB, Graph API, Gemini, Drive, HTTP).",
+        f"# TYPE {metric} histogram",
+    ]
+
+    with _lock:
+        snapshot = {key: (list(h[0]), h[1], h[2]) for key, h in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    for (component, name, status), (counts, total, count) in sorted(snapshot.items()):
+        labels = f'component="{_label(component)}",span="{_label(name)}",status="{_label(status)}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"{metric}_sum{{{labels}}} {total}")
+        lines.append(f"{metric}_count{{{labels}}} {count}")
+
+    declared = set()
+    for (name, label_items), value in sorted(counters.items()):
+        counter = f"docs_manager_{name}_total"
+        if counter not in declared:
+            declared.add(counter)
+            lines.append(f"# TYPE {counter} counter")
+        labels = ",".join(f'{k}="{_label(v)}"' for k, v in label_items)
+        lines.append(f"{counter}{{{labels}}} {value}" if labels else f"{counter} {value}")
+
+    for (name, label_items), value in sorted(gauges.items()):
+        metric = f"docs_manager_{name}"
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f"# TYPE {metric} gauge")
+        labels = ",".join(f'{k}="{_label(v)}"' for k, v in label_items)
+        lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,75 @@
+import axios from "axios";
+
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001';
+const TREE_DEPTH = 2;
+const LISTING_MAX_AGE_MS = 60 * 1000;
+const FOLDER_MIME = "application/vnd.google-apps.folder";
+
+// Folder listings ({ folders, files }) by folder ID, shared by the Dashboard and FileExplorer.
+// /api/drive/tree fills it TREE_DEPTH levels at a time, so most clicks never hit the network.
+const listings = new Map();
+
+// Listings are requested with compact=1: the standard Drive links are left out
+// (backend/payloads.py) and rebuilt here from each item's id and mimeType.
+function expandItem(item) {
+    const isFolder = item.mimeType === FOLDER_MIME;
+    return {
+        ...item,
+        webViewLink: item.webViewLink || (isFolder
+            ? `https://drive.google.com/drive/folders/${item.id}`
+            : `https://drive.google.com/file/d/${item.id}/view?usp=drivesdk`),
+        iconLink: item.iconLink || `https://drive-thirdparty.googleusercontent.com/16/type/${item.mimeType}`,
+    };
+}
+
+export function expandLinks(listing) {
+    return {
+        folders: (listing?.folders || []).map(expandItem),
+        files: (listing?.files || []).map(expandItem),
+    };
+}
+
+function fresh(folderId) {
+    const entry = listings.get(folderId);
+    return entry && Date.now() - entry.at < LISTING_MAX_AGE_MS ? entry.listing : null;
+}
+
+// Seeds the cache with a listing we already have (e.g. the root from /api/dashboard).
+export function rememberListing(folderId, listing) {
+    if (folderId && listing) listings.set(folderId, { listing: expandLinks(listing), at: Date.now() });
+}
+
+// Fetches `folderId` and its sub-folders down to `depth` levels into the cache.
+export async function loadTree(folderId, depth = TREE_DEPTH) {
+    const params = { depth, compact: 1 };
+    if (folderId) params.folder_id = folderId;
+    const { data } = await axios.get(`${API_URL}/api/drive/tree`, { params, withCredentials: true });
+    Object.entries(data.listings || {}).forEach(([id, listing]) => rememberListing(id, listing));
+    return data;
+}
+
+// A folder's listing: from memory when possible, otherwise one tree request that also
+// brings in the level below. Either way the children's own children get loaded in the
+// background, so the next click is instant too.
+export async function getListing(folderId) {
+    const cached = fresh(folderId);
+    if (cached) {
+        if (cached.folders.some(f => !fresh(f.id))) loadTree(folderId).catch(() => {});
+        return cached;
+    }
+    await loadTree(folderId);
+    return fresh(folderId) || { folders: [], files: [] };
+}
+
+// Onboarding import of the user's existing Drive (backend/drive_import.py).
+// apply=false builds a dry-run plan; apply=true moves the planned files.
+export async function startImport(apply = false) {
+    const { data } = await axios.post(`${API_URL}/api/import-drive`, null,
+        { params: { apply: apply ? 1 : 0 }, withCredentials: true });
+    return data.job;
+}
+
+export async function getImportStatus() {
+    const { data } = await axios.get(`${API_URL}/api/import-drive`, { withCredentials: true });
+    return data.job;
+}
@@ -0,0 +1,28 @@
+import axios from "axios";
+
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001';
+const POLL_INTERVAL_MS = 1500;
+
+// Uploads a syllabus and waits for the background parse.
+// The backend answers the upload with a job ID right away; we poll that job
+// (short requests) instead of holding one request open while Gemini works.
+// Resolves with { subjects: { "Subject Name": ["Unit 1", ...] } }.
+export async function uploadSyllabus(file, onProgress) {
+    const formData = new FormData();
+    formData.append("file", file);
+
+    const res = await axios.post(`${API_URL}/upload-syllabus`, formData, {
+        withCredentials: true,
+        headers: { "Content-Type": "multipart/form-data" }
+    });
+    if (!res.data.job_id) return res.data;
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+        const { data: job } = await axios.get(`${API_URL}/upload-syllabus/${res.data.job_id}`, { withCredentials: true });
+        if (onProgress) onProgress(job);
+
+        if (job.status === "done") return job;
+        if (job.status === "error") throw new Error(job.error || "Syllabus parsing failed");
+    }
+}
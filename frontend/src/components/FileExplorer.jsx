@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import axios from 'axios';
+import { getListing } from '../api/drive';
 import { Folder, FileText, ChevronRight, Loader2, Download, Eye, ArrowLeft } from 'lucide-react';
 
 const FileExplorer = ({ rootFolderId }) => {
@@ -11,18 +11,18 @@ const FileExplorer = ({ rootFolderId }) => {
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
 
-    // Fetch data whenever currentFolder changes
+    // Load data whenever currentFolder changes (usually from memory, see api/drive.js)
     useEffect(() => {
         if (!currentFolder) return;
 
         setLoading(true);
         setError(null);
 
-        axios.get(`http://localhost:8001/api/drive/browse?folder_id=${currentFolder}`, { withCredentials: true })
-            .then(res => {
+        getListing(currentFolder)
+            .then(listing => {
                 setContent({
-                    folders: res.data.folders || [],
-                    files: res.data.files || []
+                    folders: listing.folders || [],
+                    files: listing.files || []
                 });
                 setLoading(false);
             })
@@ -5,6 +5,7 @@ import {
 } from "lucide-react";
 import { motion, AnimatePresence } from "framer-motion";
 import { Link, useNavigate } from "react-router-dom";
+import { uploadSyllabus } from "../api/syllabus";
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001';
 
@@ -15,6 +16,7 @@ export default function CreateSubject() {
     const [analyzedSubjects, setAnalyzedSubjects] = useState([]);
     const [selectedSubjects, setSelectedSubjects] = useState([]);
     const [manualName, setManualName] = useState("");
+    const [analyzeStage, setAnalyzeStage] = useState("");
     const fileInputRef = useRef(null);
 
     const handleFileUpload = async (e) => {
@@ -22,15 +24,10 @@ export default function CreateSubject() {
         if (!file) return;
 
         setPhase('analyzing');
-        const formData = new FormData();
-        formData.append("file", file);
+        setAnalyzeStage("");
 
         try {
-            const res = await axios.post(`${API_URL}/upload-syllabus`, formData, {
-                withCredentials: true,
-                headers: { "Content-Type": "multipart/form-data" }
-            });
-            const data = res.data;
+            const data = await uploadSyllabus(file, job => setAnalyzeStage(job.stage));
             let backendSubjects = [];
 
             if (data.subjects && typeof data.subjects === 'object' && !Array.isArray(data.subjects)) {
@@ -235,7 +232,9 @@ export default function CreateSubject() {
                                 </div>
                                 <div className="text-center space-y-1">
                                     <h3 className="text-xl font-bold text-white">{phase === 'analyzing' ? 'Analyzing Syllabus...' : 'Creating Folders...'}</h3>
-                                    <p className="text-white/40 text-sm">This might take a few seconds</p>
+                                    <p className="text-white/40 text-sm">
+                                        {phase === 'analyzing' && analyzeStage ? `Step: ${analyzeStage}` : 'This might take a few seconds'}
+                                    </p>
                                 </div>
                             </motion.div>
                         )}
@@ -1,13 +1,14 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import { Link } from "react-router-dom";
 import {
     Terminal, Folder, Clock, Trash2, Settings, Search, Plus,
     MoreVertical, FileText, Image as ImageIcon, FileCode, LogOut, ChevronRight,
     Loader2, Home, BookOpen, GraduationCap, Calculator, Beaker, Globe, Code,
-    LayoutGrid, List, Command
+    LayoutGrid, List, Command, Download
 } from "lucide-react";
 import { motion } from "framer-motion";
+import { getListing, loadTree, rememberListing, expandLinks, startImport, getImportStatus } from "../api/drive";
 
 // --- THEMES & ASSETS ---
 const SUBJECT_THEMES = [
@@ -49,15 +50,26 @@ function Breadcrumbs({ items, onNavigate }) {
     );
 }
 
+const formatBytes = (bytes) => {
+    if (!bytes) return "";
+    const units = ["B", "KB", "MB", "GB"];
+    const i = Math.min(units.length - 1, Math.floor(Math.log(bytes) / Math.log(1024)));
+    return `${(bytes / Math.pow(1024, i)).toFixed(i ? 1 : 0)} ${units[i]}`;
+};
+
 // --- FOLDER CARD COMPONENT ---
-function FolderCard({ folder, onClick, unitCount, index }) {
+function FolderCard({ folder, onClick, stats, index }) {
     const themeIndex = (index !== undefined ? index : folder.name.length) % SUBJECT_THEMES.length;
     const theme = SUBJECT_THEMES[themeIndex];
     const Icon = theme.icon;
 
     let badgeText = "";
-    if (unitCount && unitCount > 0) {
-        badgeText = `${unitCount} Units`;
+    if (stats && (stats.units > 0 || stats.files > 0)) {
+        // Counts come from the server's Drive index (see /api/dashboard)
+        const parts = [];
+        if (stats.units > 0) parts.push(`${stats.units} Units`);
+        if (stats.files > 0) parts.push(`${stats.files} Files`, formatBytes(stats.bytes));
+        badgeText = parts.filter(Boolean).join(" · ");
     } else if (typeof folder.childCount === 'number' && folder.childCount > 0) {
         // Only show item count if > 0
         badgeText = `${folder.childCount} Items`;
@@ -134,6 +146,76 @@ function FileCard({ file }) {
     )
 }
 
+// --- DRIVE IMPORT CARD (opt-in: preview first, then apply) ---
+const IMPORT_POLL_MS = 3000;
+
+function ImportCard() {
+    const [job, setJob] = useState(null);
+    const [busy, setBusy] = useState(false);
+    const running = job && (job.status === "scanning" || job.status === "moving");
+
+    useEffect(() => { getImportStatus().then(setJob).catch(() => {}); }, []);
+    useEffect(() => {
+        if (!running && !busy) return;
+        const timer = setInterval(() => {
+            getImportStatus().then(j => { setJob(j); setBusy(false); }).catch(() => {});
+        }, IMPORT_POLL_MS);
+        return () => clearInterval(timer);
+    }, [running, busy]);
+
+    const start = (apply) => {
+        setBusy(true);
+        startImport(apply).then(setJob).catch(() => setBusy(false));
+    };
+
+    return (
+        <div className="p-6 bg-[#0A0A0A] border border-white/5 rounded-2xl max-w-xl">
+            <div className="flex items-center gap-3 mb-3">
+                <Download size={18} className="text-white/60" />
+                <h2 className="font-semibold text-white">Import my existing Drive</h2>
+            </div>
+            <p className="text-sm text-white/40 mb-5">
+                Finds the notes already in your Drive and sorts them into your subject folders.
+                You see the plan before anything is moved; files we can't place stay where they are.
+            </p>
+
+            {job && job.status === "scanning" && (
+                <p className="text-sm text-white/60 mb-4">Scanning… {job.files_found} files in {job.folders_scanned} folders</p>
+            )}
+            {job && job.status === "moving" && (
+                <p className="text-sm text-white/60 mb-4">Moving… {job.position}/{job.planned} ({job.moved} moved)</p>
+            )}
+            {job && job.status === "planned" && (
+                <div className="text-sm text-white/60 mb-4 space-y-1">
+                    <p>{job.planned} of {job.files_found} files can be sorted ({job.unsorted} stay put):</p>
+                    {Object.entries(job.by_subject || {}).map(([subject, n]) => (
+                        <p key={subject} className="text-white/40">· {subject}: {n}</p>
+                    ))}
+                </div>
+            )}
+            {job && job.status === "done" && (
+                <p className="text-sm text-white/60 mb-4">Done: moved {job.moved} files ({job.failed} failed).</p>
+            )}
+            {job && job.status === "failed" && (
+                <p className="text-sm text-red-400/80 mb-4">Import failed: {job.error}</p>
+            )}
+
+            <div className="flex gap-3">
+                <button disabled={busy || running} onClick={() => start(false)}
+                    className="text-xs font-bold px-4 py-2 rounded-lg border border-white/10 text-white/80 hover:bg-white/5 disabled:opacity-40">
+                    {job ? "Scan again" : "Preview import"}
+                </button>
+                {job && job.status === "planned" && job.planned > 0 && (
+                    <button disabled={busy} onClick={() => start(true)}
+                        className="bg-white hover:bg-gray-200 text-black text-xs font-bold px-4 py-2 rounded-lg disabled:opacity-40">
+                        Move {job.planned} files
+                    </button>
+                )}
+            </div>
+        </div>
+    );
+}
+
 // --- MAIN DASHBOARD COMPONENT ---
 export default function Dashboard() {
     const [currentView, setCurrentView] = useState('drive');
@@ -144,9 +226,18 @@ export default function Dashboard() {
     const [subjectCounts, setSubjectCounts] = useState({});
     const [currentFolderId, setCurrentFolderId] = useState(null);
     const [breadcrumbs, setBreadcrumbs] = useState([]);
+    // Root folder whose listing already came with /api/dashboard (skip the extra browse call)
+    const prefilledFolderId = useRef(null);
 
     useEffect(() => { fetchDashboardData(); }, []);
-    useEffect(() => { if (currentFolderId) fetchDriveContent(currentFolderId); }, [currentFolderId]);
+    useEffect(() => {
+        if (!currentFolderId) return;
+        if (prefilledFolderId.current === currentFolderId) {
+            prefilledFolderId.current = null;
+            return;
+        }
+        fetchDriveContent(currentFolderId);
+    }, [currentFolderId]);
 
     const fetchDashboardData = () => {
         setLoading(true);
@@ -154,38 +245,32 @@ export default function Dashboard() {
         // Detect if we are on Vercel (Production) or Localhost (Development)
         const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001';
 
-        // Update your axios call to use this variable
-        axios.get(`${API_URL}/api/dashboard-data`, { withCredentials: true })
+        // One aggregated call: profile, root listing and per-subject counts
+        axios.get(`${API_URL}/api/dashboard`, { params: { compact: 1 }, withCredentials: true })
             .then(res => {
                 const data = res.data;
                 setUserData(data);
 
-                if (data.subjects) {
-                    const counts = {};
-                    const addSubject = (name, units) => {
-                        if (!name) return;
-                        const cleanName = name.trim().toLowerCase();
-                        const count = Array.isArray(units) ? units.length : 0;
-                        counts[cleanName] = count;
-                        counts[name] = count;
-                    };
-                    if (Array.isArray(data.subjects)) {
-                        data.subjects.forEach(s => {
-                            if (typeof s === 'string') addSubject(s, []);
-                            else addSubject(s.name || s.subject, s.units);
-                        });
-                    } else if (typeof data.subjects === 'object') {
-                        Object.entries(data.subjects).forEach(([name, units]) => { addSubject(name, units); });
-                    }
-                    setSubjectCounts(counts);
-                }
+                const counts = {};
+                Object.entries(data.subjects || {}).forEach(([name, stats]) => {
+                    counts[name] = stats;
+                    counts[name.trim().toLowerCase()] = stats;
+                });
+                setSubjectCounts(counts);
 
                 const needsSetup = data.status === "AWAITING_SYLLABUS" || !data.root_folder_id;
                 if (needsSetup) {
                     window.location.href = "/setup";
                 } else if (data.root_folder_id) {
                     if (!currentFolderId) {
+                        prefilledFolderId.current = data.root_folder_id;
+                        const root = expandLinks(data.root);
+                        setFolders(root.folders);
+                        setFiles(root.files);
                         setCurrentFolderId(data.root_folder_id);
+                        // Subjects and their units load in the background, before they are clicked
+                        rememberListing(data.root_folder_id, data.root);
+                        loadTree(data.root_folder_id).catch(() => {});
                         setCurrentView('drive');
                     } else {
                         // Check if we are at root, if so, re-fetch to see new manual folders
@@ -200,12 +285,11 @@ export default function Dashboard() {
     };
 
     const fetchDriveContent = (folderId) => {
-        // Detect if we are on Vercel (Production) or Localhost (Development)
-        const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001';
-        axios.get(`${API_URL}/api/drive/browse?folder_id=${folderId}`, { withCredentials: true })
-            .then(res => {
-                setFolders(res.data.folders || []);
-                setFiles(res.data.files || []);
+        // From memory when the tree already has it (see api/drive.js)
+        getListing(folderId)
+            .then(listing => {
+                setFolders(listing.folders || []);
+                setFiles(listing.files || []);
                 setLoading(false);
             })
             .catch(err => {
@@ -233,7 +317,7 @@ export default function Dashboard() {
         }
     };
 
-    const getUnitCount = (folderName) => {
+    const getSubjectStats = (folderName) => {
         if (breadcrumbs.length === 0 && subjectCounts) {
             if (subjectCounts[folderName]) return subjectCounts[folderName];
             const clean = folderName.trim().toLowerCase();
@@ -363,7 +447,7 @@ export default function Dashboard() {
                                                         folder={folder}
                                                         index={idx}
                                                         onClick={handleFolderClick}
-                                                        unitCount={getUnitCount(folder.name)}
+                                                        stats={getSubjectStats(folder.name)}
                                                     />
                                                 ))}
                                             </div>
@@ -396,6 +480,13 @@ export default function Dashboard() {
                         </>
                     )}
 
+                    {currentView === 'settings' && (
+                        <>
+                            <h1 className="text-3xl font-light tracking-tight text-white mb-8">Settings</h1>
+                            <ImportCard />
+                        </>
+                    )}
+
                     {currentView === 'trash' && (
                         <div className="flex flex-col items-center justify-center h-full text-center opacity-50">
                             <Trash2 size={32} className="text-white mb-4" />
@@ -6,6 +6,7 @@ import {
     UploadCloud, Loader2, Wand2, Terminal, ChevronDown, ChevronRight, CheckCircle2,
     LayoutDashboard, ArrowUp, ArrowRightCircle
 } from "lucide-react";
+import { uploadSyllabus } from "../api/syllabus";
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8001';
 
@@ -126,6 +127,7 @@ export default function Setup() {
     const [newSubjectName, setNewSubjectName] = useState("");
     const [expandedId, setExpandedId] = useState(null);
     const [analyzing, setAnalyzing] = useState(false);
+    const [analyzeProgress, setAnalyzeProgress] = useState(0);
     const fileInputRef = useRef(null);
 
     useEffect(() => {
@@ -169,17 +171,11 @@ export default function Setup() {
         if (!file) return;
 
         setAnalyzing(true);
-        const formData = new FormData();
-        formData.append("file", file);
+        setAnalyzeProgress(0);
 
         try {
-            const res = await axios.post(`${API_URL}/upload-syllabus`, formData, {
-                withCredentials: true,
-                headers: { "Content-Type": "multipart/form-data" }
-            });
-
-            console.log("API Response:", res.data);
-            const data = res.data;
+            const data = await uploadSyllabus(file, job => setAnalyzeProgress(job.progress || 0));
+            console.log("API Response:", data);
 
             let backendSubjects = [];
 
@@ -397,7 +393,7 @@ export default function Setup() {
                                         />
                                         <button className={`h-12 px-5 flex items-center gap-2 bg-gradient-to-r from-blue-600 to-indigo-600 hover:from-blue-500 hover:to-indigo-500 text-white font-bold text-sm rounded-xl transition-all shadow-lg shadow-blue-500/20 whitespace-nowrap ${analyzing ? 'opacity-80' : ''}`}>
                                             {analyzing ? <Loader2 className="animate-spin" size={16} /> : <Wand2 size={16} />}
-                                            <span>{analyzing ? "Scanning..." : "Auto-Fill from PDF"}</span>
+                                            <span>{analyzing ? `Scanning... ${analyzeProgress}%` : "Auto-Fill from PDF"}</span>
                                         </button>
                                     </div>
                                 </div>